@@ -0,0 +1,82 @@
+import asyncio
+import secrets
+import threading
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+
+from app.settings import get_settings
+from app.shared import metrics, profiling
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+# Allocation tracking, set up at startup when PROFILE_ALLOCATIONS is on
+allocations = None
+# Only one profile at a time, two samplers would only slow each other down
+_profiling = threading.Lock()
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    token = get_settings().admin_token
+    # Without a configured token the admin endpoints do not exist
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/profile", dependencies=[Depends(require_admin)])
+async def profile(seconds: float = Query(10.0, gt=0, le=300), mode: str = "sample", format: str = "collapsed",
+                  interval: float = Query(0.005, gt=0, le=1)):
+    # "sample" sees every thread, including the thread pool running the endpoints. "cprofile" only
+    # sees the event loop thread (middleware, async endpoints, serialization)
+    if mode not in ("sample", "cprofile"):
+        raise HTTPException(status_code=400, detail="Invalid mode, expected sample or cprofile")
+    if format not in ({"collapsed", "top"} if mode == "sample" else {"text", "pstats"}):
+        raise HTTPException(status_code=400, detail="Invalid format, sample profiles are collapsed or top, "
+                                                    "cprofile profiles are text or pstats")
+    if not _profiling.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    try:
+        profiler = profiling.SamplingProfiler(interval) if mode == "sample" else profiling.CProfileSession()
+        profiler.start()
+        try:
+            # Sleeping on the event loop lets the requests we want to see run meanwhile
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    finally:
+        _profiling.release()
+
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    if format == "top":
+        return PlainTextResponse(profiler.top_text())
+    if format == "text":
+        return PlainTextResponse(profiler.text())
+    return Response(profiler.profile_bytes(), media_type="application/octet-stream",
+                    headers={"Content-Disposition": 'attachment; filename="api.pstats"'})
+
+
+@router.get("/allocations", dependencies=[Depends(require_admin)])
+def allocation_report(limit: int = 10):
+    if allocations is None:
+        raise HTTPException(status_code=404, detail="Allocation tracking is off, set PROFILE_ALLOCATIONS=true")
+    return allocations.report(limit)
+
+
+class AllocationMiddleware:
+    """ASGI middleware measuring the memory each request allocates, by route template."""
+
+    def __init__(self, app, tracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = self.tracker.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tracker.record(f'{scope["method"]} {metrics.route_template(scope)}', started)
@@ -0,0 +1,128 @@
+"""Builds the clients for the databases and the broker, either the real ones or the in-memory fakes.
+
+``BACKEND=live`` (the default) connects to the services of docker-compose. ``BACKEND=fake`` uses
+the stand-ins of ``app.fakes``: a single instance of each is shared by the whole process so data
+written by one request is visible to the next one. ``FAKE_LATENCY`` and ``FAKE_BROKER_LATENCY``
+add a delay (in seconds) to every store and broker call.
+"""
+import os
+import threading
+
+from app.settings import get_settings
+
+_fakes = {}
+_lock = threading.Lock()
+
+
+def is_fake():
+    return get_settings().backend == "fake"
+
+
+def _fake(name, factory):
+    with _lock:
+        if name not in _fakes:
+            _fakes[name] = factory()
+        return _fakes[name]
+
+
+def fakes():
+    """The fake instances created so far, by store name."""
+    return dict(_fakes)
+
+
+def _after_fork():
+    # The lock may have been held by another thread of the parent. The fakes are kept: each worker
+    # goes on with its own copy of the stores as they were at the fork
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def reset():
+    """Forget the fake instances, so the next call starts with empty stores."""
+    with _lock:
+        _fakes.clear()
+
+
+def redis_client():
+    if is_fake():
+        from app.fakes import FakeRedisClient
+        return _fake("redis", lambda: FakeRedisClient(get_settings().fake_latency))
+    from app.redis_client import RedisClient
+    return RedisClient(host="redis")
+
+
+def mongodb_client():
+    if is_fake():
+        from app.fakes import FakeMongoDBClient
+        return _fake("mongodb", lambda: FakeMongoDBClient(get_settings().fake_latency))
+    from app.mongodb_client import MongoDBClient
+    return MongoDBClient(host="mongodb")
+
+
+def elasticsearch_client():
+    if is_fake():
+        from app.fakes import FakeElasticsearchClient
+        return _fake("elasticsearch", lambda: FakeElasticsearchClient(get_settings().fake_latency))
+    from app.elasticsearch_client import ElasticsearchClient
+    return ElasticsearchClient(host="elasticsearch")
+
+
+def timescale():
+    if is_fake():
+        from app.fakes import FakeTimescale
+        return _fake("timescale", lambda: FakeTimescale(get_settings().fake_latency))
+    from app.timescale import Timescale
+    return Timescale()
+
+
+def cassandra_client():
+    if is_fake():
+        from app.fakes import FakeCassandraClient
+        return _fake("cassandra", lambda: FakeCassandraClient(get_settings().fake_latency))
+    from app.cassandra_client import CassandraClient
+    return CassandraClient(hosts=["cassandra"])
+
+
+def session_factory():
+    # Postgres is replaced by an in-memory SQLite database shared by every session
+    if is_fake():
+        return _fake("postgres", _sqlite_session_factory)
+    from app.database import get_session_local
+    return get_session_local()
+
+
+def _sqlite_session_factory():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.database import Base
+    from app.sensors import models
+    from app.shared.metrics import instrument_engine
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    instrument_engine(engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def broker():
+    from app.fakes import FakeBroker
+    return _fake("broker", lambda: FakeBroker(publish_latency=get_settings().fake_broker_latency,
+                                              deliver_latency=get_settings().fake_broker_latency))
+
+
+def publisher(**kwargs):
+    from app.shared.publisher import Publisher
+    if is_fake():
+        return Publisher(connection_factory=broker().connect, **kwargs)
+    return Publisher(**kwargs)
+
+
+def subscriber():
+    from app.shared.subscriber import Subscriber
+    if is_fake():
+        return Subscriber(connection_factory=broker().connect)
+    return Subscriber()
@@ -1,5 +1,12 @@
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
+from app.shared.metrics import instrumented
 
+# Statements of add_readings in flight at once
+CONCURRENCY = 100
+
+@instrumented("cassandra")
 class CassandraClient:
     def __init__(self, hosts):
         self.cluster = Cluster(hosts,protocol_version=4)
@@ -12,6 +19,9 @@ class CassandraClient:
         self.session.execute("CREATE TABLE IF NOT EXISTS sensor.quantity(type_sensor text PRIMARY KEY, quantity counter);")
         # Finally, we will create the low_battery table
         self.session.execute("CREATE TABLE IF NOT EXISTS sensor.battery(id INT PRIMARY KEY, battery_level FLOAT);")
+        # Prepared once, the consumer sends them for every reading
+        self.insert_temperature = self.session.prepare("INSERT INTO sensor.temperature (id, last_seen, temperature) VALUES (?, ?, ?)")
+        self.update_battery = self.session.prepare("UPDATE sensor.battery SET battery_level = ? WHERE id = ?")
 
     def get_session(self):
         return self.session
@@ -19,6 +29,49 @@ class CassandraClient:
     def close(self):
         self.cluster.shutdown()
 
-    def execute(self, query):
-        return self.get_session().execute(query)
+    def execute(self, query, parameters=None):
+        return self.get_session().execute(query, parameters)
+
+    # Temperatures are keyed by the reading time, so storing the same reading twice keeps a single row
+    def add_temperature(self, sensor_id, last_seen, temperature):
+        return self.execute("INSERT INTO sensor.temperature (id, last_seen, temperature) VALUES (%s, %s, %s)",
+                            (sensor_id, last_seen, temperature))
+
+    def set_battery_level(self, sensor_id, battery_level):
+        return self.execute("UPDATE sensor.battery SET battery_level = %s WHERE id = %s", (battery_level, sensor_id))
+
+    # Several (sensor_id, last_seen, temperature) temperatures and (sensor_id, battery_level) battery levels,
+    # sent as concurrent prepared statements rather than one batch: a batch spanning the partitions of a whole
+    # consumer batch loads a single coordinator, and past batch_size_fail_threshold_in_kb it is refused for
+    # good. Every statement is idempotent, so a partially applied call is simply written again on retry
+    def add_readings(self, temperatures, battery_levels):
+        statements = [(self.insert_temperature, temperature) for temperature in temperatures]
+        statements += [(self.update_battery, (battery_level, sensor_id)) for sensor_id, battery_level in battery_levels]
+        return execute_concurrent(self.get_session(), statements, concurrency=CONCURRENCY)
+
+    def increment_quantity(self, type_sensor):
+        return self.execute("UPDATE sensor.quantity SET quantity = quantity + 1 WHERE type_sensor = %s", (type_sensor,))
+
+    # Several {type_sensor: amount} increments in one counter batch, counters can only be batched together
+    def increment_quantities(self, amounts):
+        batch = BatchStatement(batch_type=BatchType.COUNTER)
+        for type_sensor, amount in amounts.items():
+            batch.add("UPDATE sensor.quantity SET quantity = quantity + %s WHERE type_sensor = %s", (amount, type_sensor))
+        return self.get_session().execute(batch)
+
+    # Max, min and average temperature of each sensor
+    def get_temperature_values(self):
+        return self.execute("""
+            SELECT id,
+            MAX(temperature) as max_temperature,
+            MIN(temperature) as min_temperature,
+            AVG(temperature) as average_temperature
+            FROM sensor.temperature GROUP BY id;""")
+
+    def get_quantities(self):
+        return self.execute("SELECT type_sensor, quantity FROM sensor.quantity GROUP BY type_sensor;")
+
+    def get_low_battery(self, threshold):
+        return self.execute("SELECT id, battery_level FROM sensor.battery WHERE battery_level < %s ALLOW FILTERING;",
+                            (threshold,))
 
@@ -1,7 +1,9 @@
 from elasticsearch import Elasticsearch
 import time
+from app.shared.metrics import instrumented
 
 
+@instrumented("elasticsearch")
 class ElasticsearchClient:
     def __init__(self, host="localhost", port="9200"):
         self.host = host
@@ -49,3 +51,16 @@ class ElasticsearchClient:
 
     def index_document(self, index_name, document):
         return self.client.index(index=index_name, document=document)
+
+    # Several documents in one _bulk request, returns {position: error} of the documents that were not indexed
+    def index_documents(self, index_name, documents):
+        operations = []
+        for document in documents:
+            operations.append({"index": {}})
+            operations.append(document)
+        response = self.client.bulk(index=index_name, operations=operations)
+        if not response["errors"]:
+            return {}
+        # The items come in the order of the operations
+        return {position: item["index"]["error"].get("reason", "") for position, item in enumerate(response["items"])
+                if "error" in item["index"]}
@@ -0,0 +1,154 @@
+"""Columnar export of sensor readings, as Parquet or Arrow, for analysis outside the API.
+
+    python -m app.export --ids 1,2,3 --from 2023-01-01 --to 2023-02-01 --columns temperature,humidity \
+        --format parquet --partition day --output readings
+
+Readings are streamed from a Timescale server side cursor in chunks, each chunk becomes one Arrow
+record batch (one row group in Parquet) and is written out before the next one is fetched, so
+memory is bounded by the chunk size whatever the size of the export. ``GET /sensors/readings``
+streams the same bytes over HTTP. With ``--partition day`` the CLI writes one file per day in
+``day=YYYY-MM-DD`` directories, which ``pyarrow.dataset`` and pandas read as a partitioned dataset.
+"""
+import argparse
+import itertools
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+FORMATS = ("parquet", "arrow")
+MEDIA_TYPES = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.stream"}
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+
+def columns(fields=None):
+    # Every export starts with the sensor and the time of the reading
+    return ("id", "last_seen", *(fields or FIELDS))
+
+
+def schema(fields=None):
+    types = {"id": pa.int32(), "last_seen": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(name, types.get(name, pa.float64())) for name in columns(fields)])
+
+
+def record_batch(rows, schema):
+    values = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(values, schema)],
+                                      schema=schema)
+
+
+def writer(sink, schema, format, stream=False):
+    if format == "parquet":
+        return pq.ParquetWriter(sink, schema)
+    # The streaming format can be read as it arrives, the file format can be memory mapped
+    return pa.ipc.new_stream(sink, schema) if stream else pa.ipc.new_file(sink, schema)
+
+
+class Chunks:
+    """A write only file keeping what was written until it is drained, to send it as it is produced."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream(chunks, fields=None, format="parquet"):
+    """The bytes of one Parquet file or Arrow stream holding every chunk of rows, yielded batch by batch."""
+    target = schema(fields)
+    sink = Chunks()
+    with writer(sink, target, format, stream=True) as out:
+        for rows in chunks:
+            out.write_batch(record_batch(rows, target))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def write(chunks, path, fields=None, format="parquet", partition=None):
+    """Write every chunk of rows to ``path``, or to one file per day under it, and return the number of rows."""
+    target = schema(fields)
+    if partition is None:
+        count = 0
+        with writer(path, target, format) as out:
+            for rows in chunks:
+                out.write_batch(record_batch(rows, target))
+                count += len(rows)
+        return count
+
+    # Rows come in time order, so a day is complete once a row of the next one arrives
+    count, day, out = 0, None, None
+    try:
+        for rows in chunks:
+            for rows_day, day_rows in itertools.groupby(rows, key=lambda row: row[1].date()):
+                day_rows = list(day_rows)
+                if rows_day != day:
+                    if out is not None:
+                        out.close()
+                    day = rows_day
+                    directory = os.path.join(path, f"day={day.isoformat()}")
+                    os.makedirs(directory, exist_ok=True)
+                    out = writer(os.path.join(directory, f"part-0.{EXTENSIONS[format]}"), target, format)
+                out.write_batch(record_batch(day_rows, target))
+                count += len(day_rows)
+    finally:
+        if out is not None:
+            out.close()
+    return count
+
+
+def parse_fields(value):
+    fields = tuple(field.strip() for field in value.split(",") if field.strip()) if value else FIELDS
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown columns {', '.join(unknown)}, expected some of {', '.join(FIELDS)}")
+    return fields
+
+
+def main(argv=None):
+    from app import backends
+    from app.settings import get_settings
+
+    parser = argparse.ArgumentParser(description="Export sensor readings from Timescale as Parquet or Arrow")
+    parser.add_argument("--ids", type=lambda value: [int(item) for item in value.split(",")],
+                        help="comma separated sensor ids, every sensor by default")
+    parser.add_argument("--from", dest="from_time")
+    parser.add_argument("--to", dest="to_time")
+    parser.add_argument("--columns", type=parse_fields, default=FIELDS, help=f"some of {','.join(FIELDS)}")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--partition", choices=["day"], help="write one file per day under --output")
+    parser.add_argument("--chunk-size", type=int, default=get_settings().readings_export_chunk_size)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    timescale = backends.timescale()
+    try:
+        chunks = timescale.stream_readings(columns(args.columns), args.ids, args.from_time, args.to_time,
+                                           chunk_size=args.chunk_size)
+        count = write(chunks, args.output, args.columns, args.format, args.partition)
+    finally:
+        timescale.close()
+    print(f" [*] Exported {count} readings to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""In-memory stand-ins for the databases and the message broker, selected with ``BACKEND=fake``.
+
+They implement the same methods as the real clients, count round trips in ``calls`` and can
+inject latency, so the API and the consumer can be tested and benchmarked without any service.
+"""
+from app.fakes.broker import FakeBroker
+from app.fakes.cassandra import FakeCassandraClient
+from app.fakes.elasticsearch import FakeElasticsearchClient
+from app.fakes.mongodb import FakeMongoDBClient
+from app.fakes.redis import FakeRedisClient
+from app.fakes.timescale import FakeTimescale
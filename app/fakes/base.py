@@ -0,0 +1,25 @@
+import time
+from collections import Counter
+
+
+class FakeStore:
+    """Common part of the in-memory stand-ins: call counting and latency injection.
+
+    ``calls`` counts every round trip the real client would have made, by operation, so tests
+    and benchmarks can catch regressions in the number of round trips per request.
+    """
+
+    store = "fake"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    def _call(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def close(self):
+        # Fakes are shared by every request, closing one must not lose its data
+        pass
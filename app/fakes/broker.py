@@ -0,0 +1,197 @@
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+
+
+class FakeBroker:
+    """In-process stand-in for RabbitMQ, shared by fake publishers and subscribers.
+
+    Only the default exchange is supported, which is all the application uses. Queues declared
+    with ``x-message-ttl`` and ``x-dead-letter-routing-key`` behave like the retry queues: expired
+    messages move to the dead letter queue. ``publish_latency`` and ``deliver_latency`` inject a
+    delay per message to model a remote or slow broker.
+    """
+
+    def __init__(self, publish_latency=0.0, deliver_latency=0.0):
+        self.publish_latency = publish_latency
+        self.deliver_latency = deliver_latency
+        self.calls = Counter()
+        self.available = True
+        self._queues = {}
+        self._arguments = {}
+        self.durable = {}
+        self._condition = threading.Condition()
+
+    def connect(self, parameters=None):
+        if not self.available:
+            raise ConnectionError("Fake broker is unavailable")
+        return FakeConnection(self)
+
+    def declare(self, queue, arguments=None, durable=False):
+        with self._condition:
+            # Like RabbitMQ, a queue can not be declared again with a different durability
+            if self.durable.setdefault(queue, durable) != durable:
+                raise ValueError(f"PRECONDITION_FAILED - inequivalent arg 'durable' for queue '{queue}'")
+            self._queues.setdefault(queue, deque())
+            if arguments:
+                self._arguments[queue] = arguments
+
+    def publish(self, queue, body, properties=None):
+        self.calls["publish"] += 1
+        if not self.available:
+            raise ConnectionError("Fake broker is unavailable")
+        if self.publish_latency:
+            time.sleep(self.publish_latency)
+        ttl = self._arguments.get(queue, {}).get("x-message-ttl")
+        expires = time.monotonic() + ttl / 1000 if ttl is not None else None
+        with self._condition:
+            self._queues.setdefault(queue, deque()).append((body, properties or SimpleNamespace(), expires))
+            self._condition.notify_all()
+
+    def get(self, queue, timeout=0.0):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                self._expire()
+                messages = self._queues.get(queue)
+                if messages:
+                    body, properties, _ = messages.popleft()
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(min(remaining, 0.05))
+        self.calls["deliver"] += 1
+        if self.deliver_latency:
+            time.sleep(self.deliver_latency)
+        return body, properties
+
+    def requeue(self, queue, body, properties):
+        with self._condition:
+            self._queues.setdefault(queue, deque()).appendleft((body, properties, None))
+            self._condition.notify_all()
+
+    def depth(self, queue):
+        with self._condition:
+            self._expire()
+            return len(self._queues.get(queue, ()))
+
+    def purge(self, queue):
+        with self._condition:
+            count = len(self._queues.get(queue, ()))
+            self._queues[queue] = deque()
+            return count
+
+    def _expire(self):
+        now = time.monotonic()
+        for queue, arguments in self._arguments.items():
+            target = arguments.get("x-dead-letter-routing-key")
+            messages = self._queues.get(queue)
+            while target and messages and messages[0][2] is not None and messages[0][2] <= now:
+                body, properties, _ = messages.popleft()
+                self._queues.setdefault(target, deque()).append((body, properties, None))
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self._channel = None
+
+    def channel(self):
+        self._channel = FakeChannel(self.broker)
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        if self._channel is not None:
+            self._channel.process(time_limit)
+
+    def close(self):
+        self.is_open = False
+        if self._channel is not None:
+            self._channel.is_open = False
+
+
+class FakeChannel:
+    """The subset of ``pika.adapters.blocking_connection.BlockingChannel`` the application uses."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.prefetch_count = 0
+        self._consumers = []
+        self._consuming = False
+        self._tags = itertools.count(1)
+        self._unacked = {}
+
+    def queue_declare(self, queue, passive=False, durable=False, arguments=None):
+        if not passive:
+            self.broker.declare(queue, arguments, durable)
+        return SimpleNamespace(method=SimpleNamespace(queue=queue, message_count=self.broker.depth(queue)))
+
+    def queue_purge(self, queue):
+        return SimpleNamespace(method=SimpleNamespace(message_count=self.broker.purge(queue)))
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_qos(self, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.broker.publish(routing_key, body, properties)
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self._consumers.append((queue, on_message_callback, auto_ack))
+
+    def basic_get(self, queue, auto_ack=False):
+        message = self.broker.get(queue)
+        if message is None:
+            return None, None, None
+        return self._deliver(queue, message, auto_ack), message[1], message[0]
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.broker.calls["ack"] += 1
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        for queue, body, properties in self._settle(delivery_tag, multiple):
+            if requeue:
+                self.broker.requeue(queue, body, properties)
+
+    def _deliver(self, queue, message, auto_ack):
+        tag = next(self._tags)
+        if not auto_ack:
+            self._unacked[tag] = (queue, message[0], message[1])
+        return SimpleNamespace(delivery_tag=tag, routing_key=queue, redelivered=False)
+
+    def _settle(self, delivery_tag, multiple):
+        tags = [tag for tag in self._unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        return [self._unacked.pop(tag) for tag in tags if tag in self._unacked]
+
+    def process(self, time_limit=0):
+        # Deliver what is ready to the registered consumers, waiting at most time_limit seconds for a message
+        delivered = False
+        for queue, callback, auto_ack in self._consumers:
+            while not self.prefetch_count or len(self._unacked) < self.prefetch_count:
+                message = self.broker.get(queue, timeout=0 if delivered else (time_limit or 0))
+                if message is None:
+                    break
+                delivered = True
+                callback(self, self._deliver(queue, message, auto_ack), message[1], message[0])
+        return delivered
+
+    def start_consuming(self):
+        self._consuming = True
+        while self._consuming and self.is_open:
+            self.process(time_limit=0.1)
+
+    def stop_consuming(self):
+        self._consuming = False
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,76 @@
+import threading
+from collections import namedtuple
+
+from app.fakes.base import FakeStore
+from app.shared.metrics import instrumented
+
+TemperatureValues = namedtuple("TemperatureValues", "id max_temperature min_temperature average_temperature")
+Quantity = namedtuple("Quantity", "type_sensor quantity")
+Battery = namedtuple("Battery", "id battery_level")
+
+
+@instrumented("cassandra")
+class FakeCassandraClient(FakeStore):
+    """In-memory stand-in for ``app.cassandra_client.CassandraClient`` and the ``sensor`` keyspace."""
+
+    store = "cassandra"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._temperatures = {}
+        self._quantities = {}
+        self._batteries = {}
+        self._lock = threading.Lock()
+
+    def get_session(self):
+        return self
+
+    def execute(self, query, parameters=None):
+        # Only statements the tests use to reset the keyspace are understood
+        self._call("execute")
+        if query.strip().upper().startswith("DROP KEYSPACE"):
+            self._temperatures.clear()
+            self._quantities.clear()
+            self._batteries.clear()
+
+    def add_temperature(self, sensor_id, last_seen, temperature):
+        self._call("insert")
+        with self._lock:
+            self._temperatures.setdefault(sensor_id, {})[last_seen] = temperature
+
+    def set_battery_level(self, sensor_id, battery_level):
+        self._call("update")
+        self._batteries[sensor_id] = battery_level
+
+    def add_readings(self, temperatures, battery_levels):
+        self._call("concurrent")
+        with self._lock:
+            for sensor_id, last_seen, temperature in temperatures:
+                self._temperatures.setdefault(sensor_id, {})[last_seen] = temperature
+            for sensor_id, battery_level in battery_levels:
+                self._batteries[sensor_id] = battery_level
+
+    def increment_quantity(self, type_sensor):
+        self._call("update")
+        with self._lock:
+            self._quantities[type_sensor] = self._quantities.get(type_sensor, 0) + 1
+
+    def increment_quantities(self, amounts):
+        self._call("batch")
+        with self._lock:
+            for type_sensor, amount in amounts.items():
+                self._quantities[type_sensor] = self._quantities.get(type_sensor, 0) + amount
+
+    def get_temperature_values(self):
+        self._call("select")
+        return [TemperatureValues(sensor_id, max(values.values()), min(values.values()),
+                                  sum(values.values()) / len(values))
+                for sensor_id, values in sorted(self._temperatures.items())]
+
+    def get_quantities(self):
+        self._call("select")
+        return [Quantity(type_sensor, quantity) for type_sensor, quantity in sorted(self._quantities.items())]
+
+    def get_low_battery(self, threshold):
+        self._call("select")
+        return [Battery(sensor_id, level) for sensor_id, level in sorted(self._batteries.items()) if level < threshold]
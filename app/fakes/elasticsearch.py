@@ -0,0 +1,87 @@
+import copy
+import threading
+
+from app.fakes.base import FakeStore
+from app.shared.metrics import instrumented
+
+
+@instrumented("elasticsearch")
+class FakeElasticsearchClient(FakeStore):
+    """In-memory stand-in for ``app.elasticsearch_client.ElasticsearchClient``.
+
+    Supports the query types the API uses (match, term, prefix, fuzzy and wildcard on one field)
+    closely enough for load tests; relevance scoring is a plain count of matching terms.
+    """
+
+    store = "elasticsearch"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def ping(self):
+        self._call("ping")
+        return True
+
+    def clearIndex(self, index_name):
+        with self._lock:
+            return self._indices.pop(index_name, None)
+
+    def create_index(self, index_name):
+        self._call("create_index")
+        self._indices.setdefault(index_name, [])
+
+    def create_mapping(self, index_name, mapping):
+        self._call("put_mapping")
+
+    def index_document(self, index_name, document):
+        self._call("index")
+        with self._lock:
+            documents = self._indices.setdefault(index_name, [])
+            documents.append(copy.deepcopy(document))
+            return {"_id": str(len(documents)), "result": "created"}
+
+    def index_documents(self, index_name, documents):
+        self._call("bulk")
+        with self._lock:
+            self._indices.setdefault(index_name, []).extend(copy.deepcopy(document) for document in documents)
+        return {}
+
+    def search(self, index_name, query):
+        self._call("search")
+        ((search_type, clause),) = query["query"].items()
+        ((field, value),) = clause.items()
+        if isinstance(value, dict):
+            value = value.get("value", value.get("query"))
+        hits = []
+        for document in list(self._indices.get(index_name, [])):
+            score = _score(search_type, str(document.get(field, "")), str(value))
+            if score:
+                hits.append({"_index": index_name, "_score": score, "_source": copy.deepcopy(document)})
+        hits.sort(key=lambda hit: -hit["_score"])
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+def _score(search_type, text, value):
+    terms = text.lower().split()
+    value = value.lower()
+    if search_type == "term":
+        return float(text == value or value in terms)
+    if search_type == "prefix":
+        return float(text.lower().startswith(value))
+    if search_type == "wildcard":
+        return float(text.lower().startswith(value.rstrip("*")))
+    if search_type == "fuzzy":
+        return float(any(_edit_distance(term, value) <= 2 for term in terms + [text.lower()]))
+    return float(sum(term in terms for term in value.split()))
+
+
+def _edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
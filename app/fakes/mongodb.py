@@ -0,0 +1,85 @@
+import copy
+import math
+import threading
+
+from app.fakes.base import FakeStore
+from app.shared.metrics import instrumented
+
+EARTH_RADIUS = 6378100
+
+
+@instrumented("mongodb")
+class FakeMongoDBClient(FakeStore):
+    """In-memory stand-in for ``app.mongodb_client.MongoDBClient`` and its ``SensorsDB.Sensors`` collection."""
+
+    store = "mongodb"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._sensors = {}
+        self._lock = threading.Lock()
+        self.indexed = False
+
+    def ping(self):
+        self._call("ping")
+        return {"ok": 1.0}
+
+    def clearDb(self, database):
+        with self._lock:
+            self._sensors.clear()
+        self.indexed = False
+
+    def ensure_indexes(self):
+        self._call("create_indexes")
+        self.indexed = True
+        return ["id_unique", "id_type", "location_2dsphere"]
+
+    def add_sensor(self, document):
+        if not self.indexed:
+            self.ensure_indexes()
+        self._call("insert_one")
+        with self._lock:
+            self._sensors[document["id"]] = copy.deepcopy(document)
+        return document
+
+    def add_sensors(self, documents):
+        if not self.indexed:
+            self.ensure_indexes()
+        self._call("insert_many")
+        with self._lock:
+            for document in documents:
+                self._sensors[document["id"]] = copy.deepcopy(document)
+        return {}
+
+    def get_near_sensors(self, latitude, longitude, radius):
+        # Same semantics as find with $near: the sensors within radius meters, nearest first
+        self._call("find")
+        near = []
+        for document in list(self._sensors.values()):
+            x, y = document["location"]["coordinates"]
+            distance = _distance(latitude, longitude, x, y)
+            if distance <= radius:
+                near.append((distance, document["id"], document))
+        return [copy.deepcopy(document) for _, _, document in sorted(near, key=lambda item: item[:2])]
+
+    def get_sensor(self, id):
+        self._call("find_one")
+        document = self._sensors.get(id)
+        return copy.deepcopy(document) if document is not None else None
+
+    def get_sensors(self, ids):
+        self._call("find")
+        return [copy.deepcopy(self._sensors[id]) for id in ids if id in self._sensors]
+
+    def get_sensor_types(self):
+        if not self.indexed:
+            self.ensure_indexes()
+        self._call("find")
+        return [{"id": document["id"], "type": document["type"]} for document in list(self._sensors.values())]
+
+
+def _distance(x1, y1, x2, y2):
+    # Great circle distance in meters, with GeoJSON's [x, y] = [longitude, latitude] order
+    lon1, lat1, lon2, lat2 = map(math.radians, (x1, y1, x2, y2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
@@ -0,0 +1,215 @@
+import threading
+import time
+
+import orjson
+
+from app.fakes.base import FakeStore
+from app.shared.metrics import instrumented
+
+
+@instrumented("redis")
+class FakeRedisClient(FakeStore):
+    """In-memory stand-in for ``app.redis_client.RedisClient``."""
+
+    store = "redis"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self._data = {}
+        self._expires = {}
+        self._buckets = {}
+        # Rollup hashes, key -> {field: [count, sum, min, max]}, they never expire here
+        self._rollups = {}
+        # Other hashes, key -> {field: bytes}
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    @staticmethod
+    def _key(key):
+        return str(key)
+
+    @staticmethod
+    def _value(value):
+        # Redis stores bytes, and so do we, so callers decode exactly what they would get from Redis
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def ping(self):
+        self._call("ping")
+        return True
+
+    def get(self, key):
+        self._call("get")
+        key = self._key(key)
+        return self._data[key] if self._alive(key) else None
+
+    def set(self, key, value, ttl=None):
+        self._call("set")
+        with self._lock:
+            self._data[self._key(key)] = self._value(value)
+            if ttl:
+                self._expires[self._key(key)] = time.monotonic() + ttl
+            else:
+                self._expires.pop(self._key(key), None)
+        return True
+
+    def delete(self, key):
+        self._call("delete")
+        with self._lock:
+            self._expires.pop(self._key(key), None)
+            return int(self._data.pop(self._key(key), None) is not None)
+
+    def exists(self, key):
+        self._call("exists")
+        return int(self._alive(self._key(key)))
+
+    def set_if_absent(self, key, value, ttl=None):
+        self._call("set_if_absent")
+        key = self._key(key)
+        with self._lock:
+            if self._alive(key):
+                return False
+            self._data[key] = self._value(value)
+            if ttl:
+                self._expires[key] = time.monotonic() + ttl
+            return True
+
+    def exists_many(self, keys):
+        self._call("exists")
+        return [self._alive(self._key(key)) for key in keys]
+
+    def set_many_if_absent(self, keys, value, ttl=None):
+        self._call("set_if_absent")
+        results = []
+        with self._lock:
+            for key in map(self._key, keys):
+                results.append(not self._alive(key))
+                if results[-1]:
+                    self._data[key] = self._value(value)
+                    if ttl:
+                        self._expires[key] = time.monotonic() + ttl
+        return results
+
+    def take_token(self, key, rate, burst):
+        self._call("take_token")
+        now = time.time()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return True, 0
+            self._buckets[key] = (tokens, now)
+            return False, (1 - tokens) / rate
+
+    def keys(self, pattern):
+        self._call("keys")
+        prefix = pattern.rstrip("*")
+        return [key.encode() for key in list(self._data) if key.startswith(prefix) and self._alive(key)]
+
+    def clearAll(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            self._buckets.clear()
+            self._rollups.clear()
+            self._hashes.clear()
+
+    def add_sensor(self, key, value, versions=()):
+        self._call("set")
+        data = value.dict()
+        with self._lock:
+            self._data[self._key(key)] = orjson.dumps(data)
+            self._incr(versions)
+        return data
+
+    def add_sensors(self, values, versions=()):
+        self._call("set")
+        with self._lock:
+            for key, value in values.items():
+                self._data[self._key(key)] = orjson.dumps(value.dict())
+            self._incr(versions)
+        return True
+
+    def get_many(self, keys):
+        self._call("mget")
+        return [self._data[self._key(key)] if self._alive(self._key(key)) else None for key in keys]
+
+    def incr_many(self, keys):
+        self._call("incr")
+        with self._lock:
+            return self._incr(keys)
+
+    def _incr(self, keys):
+        values = []
+        for key in map(self._key, keys):
+            values.append(int(self._data[key]) + 1 if self._alive(key) else 1)
+            self._data[key] = self._value(values[-1])
+        return values
+
+    def get_sensor(self, key):
+        self._call("get")
+        return orjson.loads(self._data[self._key(key)])
+
+    def get_sensors(self, keys):
+        self._call("mget")
+        return [orjson.loads(self._data[self._key(key)]) if self._alive(self._key(key)) else None for key in keys]
+
+    def get_fields(self, key, fields):
+        self._call("hmget")
+        values = self._hashes.get(self._key(key), {})
+        return [values.get(str(name)) for name in fields]
+
+    def set_fields(self, key, values, ttl=None):
+        self._call("hset")
+        with self._lock:
+            current = self._hashes.setdefault(self._key(key), {})
+            added = sum(str(name) not in current for name in values)
+            current.update({str(name): self._value(value) for name, value in values.items()})
+        return added
+
+    def delete_fields(self, fields):
+        self._call("hdel")
+        with self._lock:
+            return [sum(self._hashes.get(self._key(key), {}).pop(str(name), None) is not None for name in names)
+                    for key, names in fields.items()]
+
+    def merge_rollups(self, rollups, versions=(), values=None):
+        self._call("eval")
+        with self._lock:
+            self._incr(versions)
+            for key, value in (values or {}).items():
+                self._data[self._key(key)] = self._value(value)
+                self._expires.pop(self._key(key), None)
+            for key, (_, aggregates) in rollups.items():
+                current = self._rollups.setdefault(self._key(key), {})
+                for field, (count, total, low, high) in aggregates.items():
+                    if field not in current:
+                        current[field] = [count, total, low, high]
+                    else:
+                        aggregate = current[field]
+                        aggregate[0] += count
+                        aggregate[1] += total
+                        aggregate[2] = min(aggregate[2], low)
+                        aggregate[3] = max(aggregate[3], high)
+        return [1] * len(rollups)
+
+    def get_rollup(self, key):
+        self._call("hgetall")
+        rollup = self._rollups.get(self._key(key))
+        return {field: tuple(values) for field, values in rollup.items()} if rollup else None
+
+    def get_rollup_since(self, key, since_key):
+        self._call("hgetall")
+        since = self._data.get(self._key(since_key)) if self._alive(self._key(since_key)) else None
+        rollup = self._rollups.get(self._key(key))
+        return (float(since) if since is not None else None), \
+            ({field: tuple(values) for field, values in rollup.items()} if rollup else None)
@@ -0,0 +1,85 @@
+import threading
+
+from app.fakes.base import FakeStore
+from app.shared.buckets import parse_time, time_bucket
+from app.shared.metrics import instrumented
+
+
+# The columns of sensor_data, in the order of its rows
+COLUMNS = ("id", "last_seen", "velocity", "temperature", "humidity", "battery_level")
+
+
+@instrumented("timescale")
+class FakeTimescale(FakeStore):
+    """In-memory stand-in for ``app.timescale.Timescale`` and its ``sensor_data`` hypertable."""
+
+    store = "timescale"
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        # (id, last_seen) -> (velocity, temperature, humidity, battery_level), like the table's primary key
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def ping(self):
+        self._call("ping")
+        return True
+
+    def execute(self, query):
+        # Only statements the tests use to reset the table are understood
+        self._call("execute")
+        if query.strip().upper().startswith(("DELETE FROM SENSOR_DATA", "DROP TABLE")):
+            self._rows.clear()
+
+    def rollback(self):
+        pass
+
+    def delete(self, table):
+        self._rows.clear()
+
+    def insert_reading(self, sensor_id, data):
+        self._call("insert")
+        with self._lock:
+            self._rows[(sensor_id, parse_time(data.last_seen))] = (data.velocity, data.temperature,
+                                                                    data.humidity, data.battery_level)
+
+    def insert_readings(self, readings):
+        self._call("insert")
+        with self._lock:
+            for sensor_id, data in readings:
+                self._rows[(sensor_id, parse_time(data.last_seen))] = (data.velocity, data.temperature,
+                                                                        data.humidity, data.battery_level)
+
+    def get_buckets(self, sensor_id, bucket, from_time=None, to_time=None):
+        self._call("select")
+        from_time = parse_time(from_time) if from_time else None
+        to_time = parse_time(to_time) if to_time else None
+        buckets = {}
+        for (row_id, last_seen), values in list(self._rows.items()):
+            if row_id != sensor_id or (from_time and last_seen < from_time) or (to_time and last_seen > to_time):
+                continue
+            buckets.setdefault(time_bucket(bucket, last_seen), []).append(values)
+        return [(sensor_id, start, _avg(rows, 0), _avg(rows, 1), _avg(rows, 2), _min(rows, 3))
+                for start, rows in sorted(buckets.items())]
+
+    def stream_readings(self, columns, sensor_ids=None, from_time=None, to_time=None, chunk_size=10000, ordered=True):
+        self._call("select")
+        from_time = parse_time(from_time) if from_time else None
+        to_time = parse_time(to_time) if to_time else None
+        rows = [dict(zip(COLUMNS, (row_id, last_seen, *values))) for (row_id, last_seen), values in list(self._rows.items())
+                if (sensor_ids is None or row_id in sensor_ids) and not (from_time and last_seen < from_time)
+                and not (to_time and last_seen > to_time)]
+        if ordered:
+            rows.sort(key=lambda row: (row["last_seen"], row["id"]))
+        for start in range(0, len(rows), chunk_size):
+            yield [tuple(row[column] for column in columns) for row in rows[start:start + chunk_size]]
+
+
+def _avg(rows, column):
+    values = [row[column] for row in rows if row[column] is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _min(rows, column):
+    values = [row[column] for row in rows if row[column] is not None]
+    return min(values) if values else None
@@ -0,0 +1,49 @@
+"""Applies the Timescale migrations with yoyo, and creates the MongoDB indexes.
+
+Run it as a pre-start command (``python -m app.migrations``) and start the API with
+``SKIP_MIGRATIONS=true``, so that API processes start without waiting for a database lock.
+Otherwise the API applies them in its startup hook. Read docs: https://ollycope.com/software/yoyo/latest/
+"""
+import time
+
+from app.settings import get_settings
+
+
+def apply_migrations():
+    settings = get_settings()
+    # The fake backends have no schema to migrate
+    if settings.backend != "live":
+        return 0
+    from yoyo import get_backend, read_migrations
+
+    # First get TS database
+    backend = get_backend(settings.timescale_migrations_url)
+    # Get the migrations to be applied, where the table is defined
+    migrations = read_migrations(settings.timescale_migrations_dir)
+    # Apply the migrations to the TS database
+    with backend.lock():
+        to_apply = backend.to_apply(migrations)
+        backend.apply_migrations(to_apply)
+    return len(to_apply)
+
+
+def ensure_mongodb_indexes():
+    # Building an index on a large collection takes a while, better before the API takes traffic
+    # than on the first registration
+    if get_settings().backend != "live":
+        return []
+    from app.mongodb_client import MongoDBClient
+
+    mongodb = MongoDBClient(host="mongodb")
+    try:
+        return mongodb.ensure_indexes()
+    finally:
+        mongodb.close()
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    applied = apply_migrations()
+    indexes = ensure_mongodb_indexes()
+    print(" [*] Applied %d Timescale migrations and ensured %d MongoDB indexes in %.2fs"
+          % (applied, len(indexes), time.perf_counter() - start))
@@ -1,10 +1,37 @@
-from pymongo import MongoClient
+from pymongo import ASCENDING, GEOSPHERE, IndexModel, MongoClient
 from bson.son import SON
-from bson import json_util
-import json
+from pymongo.errors import BulkWriteError
+from app.shared.metrics import instrumented
 
+# Indexes of SensorsDB.Sensors: every lookup filters on the unique sensor id, get_sensor_types is
+# answered from the (id, type) index alone without reading the documents, get_near_sensors needs
+# the 2dsphere one. create_indexes leaves the ones that already exist as they are
+INDEXES = [IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+           IndexModel([("id", ASCENDING), ("type", ASCENDING)], name="id_type"),
+           IndexModel([("location", GEOSPHERE)], name="location_2dsphere")]
+# Projection of get_sensor_types, covered by the id_type index
+TYPES_PROJECTION = {'_id': 0, 'id': 1, 'type': 1}
 
+
+def plan_stages(explanation):
+    """Stage names of the winning plan of an ``explain()``, from the root to the leaves."""
+    plan = explanation["queryPlanner"]["winningPlan"]
+    # Plans run by the slot based engine nest the classic plan under queryPlan
+    plan = plan.get("queryPlan", plan)
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop(0)
+        stages.append(stage["stage"])
+        pending.extend(stage.get("inputStages", [stage["inputStage"]] if "inputStage" in stage else []))
+    return stages
+
+
+@instrumented("mongodb")
 class MongoDBClient:
+    # Whether this process already made sure the indexes exist, clients are created for every request
+    indexed = False
+
     def __init__(self, host="localhost", port=27017):
         self.host = host
         self.port = port
@@ -28,29 +55,67 @@ class MongoDBClient:
 
     def clearDb(self, database):
         self.client.drop_database(database)
+        MongoDBClient.indexed = False
+
+    # Creates the indexes of the Sensors collection that do not exist yet, in one round trip
+    def ensure_indexes(self):
+        # Select database
+        self.getDatabase("SensorsDB")
+        # Select Sensor's collection
+        col_sensors = self.getCollection("Sensors")
+        names = col_sensors.create_indexes(INDEXES)
+        MongoDBClient.indexed = True
+        return names
+
+    # Stage names of the plan MongoDB picks for a find, to check that a query uses an index
+    def explain(self, query, projection=None, hint=None):
+        # Select database
+        self.getDatabase("SensorsDB")
+        # Select collection
+        col_sensors = self.getCollection("Sensors")
+        cursor = col_sensors.find(query, projection)
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        return plan_stages(cursor.explain())
 
     def add_sensor(self, document):
         # Select database
         self.getDatabase("SensorsDB")
         # Select Sensor's collection
         col_sensors = self.getCollection("Sensors")
+        # The unique id index has to exist before the first sensor, two sensors must never share an id
+        if not MongoDBClient.indexed:
+            self.ensure_indexes()
         # Insert sensor's data
-        sensor = col_sensors.insert_one(document)
-        # Create an index for location so we can later search based on it
-        col_sensors.create_index([("location", "2dsphere")])
-        return sensor
+        return col_sensors.insert_one(document)
 
-    # This method returns the nearest sensor given an area
+    # Several sensors in one round trip, returns {position: error} of the documents that were not inserted.
+    # Unordered, a document that fails does not stop the ones after it
+    def add_sensors(self, documents):
+        # Select database
+        self.getDatabase("SensorsDB")
+        # Select Sensor's collection
+        col_sensors = self.getCollection("Sensors")
+        if not MongoDBClient.indexed:
+            self.ensure_indexes()
+        try:
+            col_sensors.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        return {}
+
+    # This method returns the sensors within radius meters of a point, nearest first
     def get_near_sensors(self, latitude, longitude, radius):
         # Select database
         self.getDatabase("SensorsDB")
         # Select collection
         col_sensors = self.getCollection("Sensors")
-        # Query to find nearest sensors
-        query = {"location": SON([("$near", {
-            "$geometry": SON([("type", "Point"), ("coordinates", [latitude, longitude]), ("$maxDistance", radius)])})])}
-        # Find sensors with query and convert result to json, so it can be iterable
-        return json.loads(json.dumps(col_sensors.find_one(query, {'_id': 0}), default=json_util.default))
+        # Query to find nearest sensors, $maxDistance goes next to $geometry, not inside it
+        query = {"location": SON([("$near", SON([
+            ("$geometry", SON([("type", "Point"), ("coordinates", [latitude, longitude])])),
+            ("$maxDistance", radius)]))])}
+        # Leaving _id out of the projection leaves only plain types, the documents need no conversion
+        return list(col_sensors.find(query, {'_id': 0}))
 
     # This method returns data from a sensor given its unique ID
     def get_sensor(self, id):
@@ -58,7 +123,25 @@ class MongoDBClient:
         self.getDatabase("SensorsDB")
         # Select collection
         col_sensors = self.getCollection("Sensors")
-        # Find sensor by id
-        return json.loads(json.dumps(col_sensors.find_one({"id": id}, {'_id': 0}), default=json_util.default))
+        # Find sensor by id, a plain dict since _id is left out
+        return col_sensors.find_one({"id": id}, {'_id': 0})
 
+    # This method returns the sensors with the given ids, in one query
+    def get_sensors(self, ids):
+        # Select database
+        self.getDatabase("SensorsDB")
+        # Select collection
+        col_sensors = self.getCollection("Sensors")
+        return list(col_sensors.find({"id": {"$in": list(ids)}}, {'_id': 0}))
 
+    # This method returns the id and type of every sensor, read from the id_type index alone
+    def get_sensor_types(self):
+        # Select database
+        self.getDatabase("SensorsDB")
+        # Select collection
+        col_sensors = self.getCollection("Sensors")
+        # Without a filter the planner would scan the collection, the hint makes it a covered index scan.
+        # A hint naming an index that does not exist is an error
+        if not MongoDBClient.indexed:
+            self.ensure_indexes()
+        return list(col_sensors.find({}, TYPES_PROJECTION).hint("id_type"))
@@ -1,7 +1,53 @@
 import redis
-import json
+import orjson
+import time
+from app.shared.metrics import instrumented
 
+# Token bucket kept in a Redis hash, refilled lazily on every call so no background job is needed.
+# Returns {allowed, milliseconds until a token is available}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, wait}
+"""
 
+# Merges running aggregates into a rollup hash, with {field}:count, {field}:sum, {field}:min and
+# {field}:max entries. ARGV is the ttl then, for every field, its name, count, sum, min and max
+ROLLUP_MERGE_SCRIPT = """
+for i = 2, #ARGV, 5 do
+    local field = ARGV[i]
+    redis.call('HINCRBY', KEYS[1], field .. ':count', ARGV[i + 1])
+    redis.call('HINCRBYFLOAT', KEYS[1], field .. ':sum', ARGV[i + 2])
+    local low = tonumber(redis.call('HGET', KEYS[1], field .. ':min'))
+    if low == nil or tonumber(ARGV[i + 3]) < low then
+        redis.call('HSET', KEYS[1], field .. ':min', ARGV[i + 3])
+    end
+    local high = tonumber(redis.call('HGET', KEYS[1], field .. ':max'))
+    if high == nil or tonumber(ARGV[i + 4]) > high then
+        redis.call('HSET', KEYS[1], field .. ':max', ARGV[i + 4])
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+@instrumented("redis")
 class RedisClient:
     def __init__(self, host='localhost', port=6379, db=0):
         self._host = host
@@ -18,12 +64,38 @@ class RedisClient:
     def get(self, key):
         return self._client.get(key)
 
-    def set(self, key, value):
-        return self._client.set(key, value)
+    def set(self, key, value, ttl=None):
+        return self._client.set(key, value, ex=ttl)
 
     def delete(self, key):
         return self._client.delete(key)
 
+    def exists(self, key):
+        return self._client.exists(key)
+
+    # Set a key only if it does not exist yet, returns True when it was set
+    def set_if_absent(self, key, value, ttl=None):
+        return bool(self._client.set(key, value, nx=True, ex=ttl))
+
+    # Take a token from the bucket under key, returns (allowed, seconds to wait before retrying)
+    def take_token(self, key, rate, burst):
+        allowed, wait = self._client.eval(TOKEN_BUCKET_SCRIPT, 1, key, rate, burst, time.time())
+        return bool(allowed), wait / 1000
+
+    # Which of the keys exist, in a single round trip
+    def exists_many(self, keys):
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(key)
+        return [bool(found) for found in pipeline.execute()]
+
+    # set_if_absent of several keys in a single round trip
+    def set_many_if_absent(self, keys, value, ttl=None):
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(key, value, nx=True, ex=ttl)
+        return pipeline.execute()
+
     def keys(self, pattern):
         return self._client.keys(pattern)
 
@@ -31,16 +103,103 @@ class RedisClient:
         for key in self._client.keys("*"):
             self._client.delete(key)
 
-    # This method allows us to store a sensor variable data
-    def add_sensor(self, key, value):
+    # Store the data of several sensors, a {key: value} dict, and bump the version counters, in a single round trip
+    def add_sensors(self, values, versions=()):
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.mset({key: orjson.dumps(value.dict()) for key, value in values.items()})
+        for version in versions:
+            pipeline.incr(version)
+        return pipeline.execute()[0]
+
+    # This method allows us to store a sensor variable data, and bump the version counters it changes
+    def add_sensor(self, key, value, versions=()):
         # We will convert our sensor´s data into a JSON so we can easily store it under a single key
-        self._client.set(key, json.dumps(value.dict()))
-        # Once we have store it, we return the data on the DB to check everything was saved properly
-        return json.loads(self._client.get(key))
+        data = value.dict()
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.set(key, orjson.dumps(data))
+        for version in versions:
+            pipeline.incr(version)
+        pipeline.execute()
+        # SET fails loudly, so what we stored is exactly what we just encoded, no need to read it back
+        return data
+
+    # The values of several keys, None for the missing ones, in a single round trip
+    def get_many(self, keys):
+        return self._client.mget(keys) if keys else []
+
+    # Increment several counters in a single round trip
+    def incr_many(self, keys):
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.incr(key)
+        return pipeline.execute()
 
     # This method given a key return
     def get_sensor(self, key):
         # Since we are saving JSONs on the data base, data will be stored as bytes. We will reconvert it
-        # to its original type by performing json.loads
-        return json.loads(self._client.get(key))
+        # to its original type by parsing it
+        return orjson.loads(self._client.get(key))
+
+    # The data of several sensors in a single round trip, None for the sensors without data
+    def get_sensors(self, keys):
+        return [orjson.loads(value) if value is not None else None for value in self._client.mget(keys)] if keys else []
+
+    # The values of some fields of a hash, None for the missing ones, in a single round trip
+    def get_fields(self, key, fields):
+        return self._client.hmget(key, fields) if fields else []
+
+    # Set {field: value} entries of a hash, and the time to live of the hash, in a single round trip
+    def set_fields(self, key, values, ttl=None):
+        if not values:
+            return 0
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.hset(key, mapping=values)
+        if ttl:
+            pipeline.expire(key, ttl)
+        return pipeline.execute()[0]
+
+    # Delete the fields of several hashes, a {key: [fields]} dict, in a single round trip
+    def delete_fields(self, fields):
+        pipeline = self._client.pipeline(transaction=False)
+        for key, names in fields.items():
+            pipeline.hdel(key, *names)
+        return pipeline.execute()
+
+    # Merge {key: (ttl, {field: (count, sum, min, max)})} running aggregates into their hashes, bump the
+    # version counters and set the {key: value} values, in one round trip
+    def merge_rollups(self, rollups, versions=(), values=None):
+        pipeline = self._client.pipeline(transaction=False)
+        for key, (ttl, aggregates) in rollups.items():
+            arguments = [ttl]
+            for field, values in aggregates.items():
+                arguments += [field, *values]
+            pipeline.eval(ROLLUP_MERGE_SCRIPT, 1, key, *arguments)
+        for version in versions:
+            pipeline.incr(version)
+        for key, value in (values or {}).items():
+            pipeline.set(key, value)
+        return pipeline.execute()[:len(rollups)]
+
+    # The aggregates of a rollup hash as {field: (count, sum, min, max)}, None when there is none
+    def get_rollup(self, key):
+        return parse_rollup(self._client.hgetall(key))
+
+    # The number in since_key, None when unset, and the aggregates of a rollup hash, in one round trip
+    def get_rollup_since(self, key, since_key):
+        pipeline = self._client.pipeline(transaction=False)
+        pipeline.get(since_key)
+        pipeline.hgetall(key)
+        since, entries = pipeline.execute()
+        return (float(since) if since is not None else None), parse_rollup(entries)
+
 
+def parse_rollup(entries):
+    if not entries:
+        return None
+    values = {}
+    for entry, value in entries.items():
+        entry = entry.decode() if isinstance(entry, bytes) else entry
+        field, statistic = entry.rsplit(":", 1)
+        values.setdefault(field, {})[statistic] = float(value)
+    return {field: (int(stats.get("count", 0)), stats.get("sum", 0.0), stats.get("min"), stats.get("max"))
+            for field, stats in values.items()}
@@ -0,0 +1,59 @@
+"""Bulk registration of sensors, to onboard a whole site at once.
+
+    python -m app.register sensors.json --report report.json
+
+The file holds a JSON array of sensors, or one sensor per line, with the fields of
+``POST /sensors``. They are registered in chunks, each chunk costing one round trip to every
+store, like ``POST /sensors/bulk``: names already registered are left as they are and reported.
+"""
+import argparse
+import json
+
+from app.sensors import schemas
+
+
+def read_sensors(path):
+    with open(path) as file:
+        text = file.read()
+    if text.lstrip().startswith("["):
+        items = json.loads(text)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [schemas.SensorCreate(**item) for item in items]
+
+
+def main(argv=None):
+    from app import backends
+    from app.sensors import repository
+    from app.settings import get_settings
+
+    parser = argparse.ArgumentParser(description="Register many sensors in every store at once")
+    parser.add_argument("file", help="JSON array of sensors, or one JSON sensor per line")
+    parser.add_argument("--chunk-size", type=int, default=get_settings().sensors_bulk_chunk_size)
+    parser.add_argument("--report", help="write the outcome of each sensor to this JSON file")
+    args = parser.parse_args(argv)
+
+    sensors = read_sensors(args.file)
+    db = backends.session_factory()()
+    mongodb, elastic, cassandra, redis = (backends.mongodb_client(), backends.elasticsearch_client(),
+                                          backends.cassandra_client(), backends.redis_client())
+    try:
+        report = repository.create_sensors(db, mongodb, elastic, cassandra, sensors, redis=redis,
+                                           chunk_size=args.chunk_size)
+    finally:
+        db.close()
+        for client in (mongodb, elastic, cassandra, redis):
+            client.close()
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump(report, file, indent=2)
+    print(f" [*] Registered {report['created']} sensors, {report['existing']} already registered, "
+          f"{report['duplicates']} duplicated in the file")
+    failed = [item for item in report["items"] if "errors" in item]
+    if failed:
+        print(f" [!] {len(failed)} sensors are missing from some stores, see the report")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+
+class AdmissionController:
+    """Decides whether the API can take one more reading, instead of letting requests pile up.
+
+    Three signals are checked before a reading is accepted:
+
+    * requests in flight in this process (hard limit, 503), counted by ``hold_slot`` on the event
+      loop as soon as they arrive: the ones still waiting for a worker thread count too,
+    * the ingestion backlog: publisher buffer, spool and broker queue (hard limit, 503),
+    * the smoothed latency of the databases (soft limit: past it, an increasing share of the
+      requests is shed with a 503, so the API slows down gracefully instead of collapsing).
+      Latency is only observed on admitted requests, so the estimate also halves every
+      ``decay`` seconds and at most ``max_shed`` of the requests are shed: the ones let through
+      are the probes that see the databases recover.
+
+    On top of that each sensor gets a token bucket in Redis (429 when it is empty).
+    Every rejection carries a ``Retry-After`` header.
+    """
+
+    def __init__(self, max_in_flight=32, max_queue_depth=50000, max_store_latency=0.5, retry_after=1,
+                 rate=10.0, burst=20, backlog=None, smoothing=0.2, decay=5.0, max_shed=0.95,
+                 clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_store_latency = max_store_latency
+        self.retry_after = retry_after
+        self.rate = rate
+        self.burst = burst
+        # Callable returning the ingestion backlog, None while there is no publisher
+        self.backlog = backlog
+        self.smoothing = smoothing
+        self.decay = decay
+        self.max_shed = max_shed
+        self.clock = clock
+        self.in_flight = 0
+        self.store_latency = 0.0
+        self.observed_at = clock()
+        self.rejected = {"in_flight": 0, "queue_depth": 0, "store_latency": 0, "rate_limit": 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold_slot(self):
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.reject("in_flight", self.retry_after)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @contextmanager
+    def admit(self, redis, sensor_id):
+        self.check_rate_limit(redis, sensor_id)
+        self.check_backlog()
+        self.check_store_latency()
+        start = self.clock()
+        yield
+        self.observe_latency(self.clock() - start)
+
+    def check_rate_limit(self, redis, sensor_id):
+        if not self.rate:
+            return
+        try:
+            allowed, wait = redis.take_token(f"ratelimit:{sensor_id}", self.rate, self.burst)
+        except Exception:
+            # Rate limiting is a protection, not a dependency: if Redis is down let the reading through
+            return
+        if not allowed:
+            self.reject("rate_limit", wait, status_code=429, detail="Too many readings for this sensor")
+
+    def check_backlog(self):
+        if self.backlog is not None and self.backlog() >= self.max_queue_depth:
+            self.reject("queue_depth", self.retry_after)
+
+    def check_store_latency(self):
+        # Shed the share of requests by which the latency overshoots its limit: 1.5x the limit sheds 50%
+        overshoot = self.current_latency() / self.max_store_latency - 1 if self.max_store_latency else 0
+        if overshoot > 0 and random.random() < min(overshoot, self.max_shed):
+            self.reject("store_latency", self.retry_after * (1 + overshoot))
+
+    def current_latency(self):
+        # The estimate fades while nothing is observed, shedding everything could otherwise last forever
+        if not self.decay:
+            return self.store_latency
+        return self.store_latency * 0.5 ** ((self.clock() - self.observed_at) / self.decay)
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            latency = self.current_latency()
+            self.store_latency = latency + self.smoothing * (seconds - latency)
+            self.observed_at = self.clock()
+
+    def reject(self, reason, retry_after, status_code=503, detail="Service overloaded, retry later"):
+        self.rejected[reason] += 1
+        raise HTTPException(status_code=status_code, detail=detail,
+                            headers={"Retry-After": str(max(math.ceil(retry_after), 1))})
+
+    def stats(self):
+        return {"in_flight": self.in_flight,
+                "store_latency": self.current_latency(),
+                "backlog": self.backlog() if self.backlog is not None else None,
+                "rejected": dict(self.rejected)}
@@ -1,24 +1,93 @@
-from fastapi import APIRouter, Depends, HTTPException,Request
+import base64
+import os
+import queue
+import time
+from datetime import datetime, timezone
+from typing import List
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.database import SessionLocal
-from app.redis_client import RedisClient
-from app.mongodb_client import MongoDBClient
-from app.elasticsearch_client import ElasticsearchClient
-from app.timescale import Timescale
-from app.cassandra_client import CassandraClient
+# Store clients (and their drivers) are imported by app.backends on first use, not when the API starts
+from app import backends
+from app.settings import get_settings
+from app.shared import versions
+from app.shared.buckets import time_bucket
 from . import schemas, repository
+from .admission import AdmissionController
+
+# Publisher used in "queue" ingest mode, created on first use so the API starts even without RabbitMQ
+publisher = None
+
+def get_publisher():
+    global publisher
+    if publisher is None:
+        publisher = backends.publisher()
+    return publisher
+
+# Admission controller shedding load on the ingestion route
+admission = None
+
+def get_admission_controller():
+    global admission
+    if admission is None:
+        settings = get_settings()
+        admission = AdmissionController(max_in_flight=settings.admission_max_in_flight,
+                                        max_queue_depth=settings.admission_max_queue_depth,
+                                        max_store_latency=settings.admission_max_store_latency,
+                                        retry_after=settings.admission_retry_after,
+                                        rate=settings.rate_limit_per_sensor,
+                                        burst=settings.rate_limit_burst,
+                                        decay=settings.admission_latency_decay,
+                                        max_shed=settings.admission_max_shed,
+                                        backlog=lambda: publisher.backlog() if publisher is not None else 0)
+    return admission
+
+# Type of every sensor, cached for the fleet analytics
+sensor_types = None
+
+def get_sensor_types():
+    global sensor_types
+    if sensor_types is None:
+        from app.shared.analytics import SensorTypes
+        sensor_types = SensorTypes(ttl=get_settings().sensor_types_ttl)
+    return sensor_types
+
+# A forked worker has neither the publisher thread nor the in-flight readings of its parent, it
+# creates its own publisher (with a spool of its own) and admission controller on first use
+def _after_fork():
+    global publisher, admission
+    publisher = None
+    admission = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+# Opaque cursor of GET /sensors: the last id of the previous page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode()
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 # Dependency to get db session
 def get_db():
-    db = SessionLocal()
+    db = backends.session_factory()()
     try:
         yield db
     finally:
         db.close()
 
 def get_timescale():
-    ts = Timescale()
+    ts = backends.timescale()
     try:
         yield ts
     finally:
@@ -26,7 +95,7 @@ def get_timescale():
 
 # Dependency to get redis client
 def get_redis_client():
-    redis = RedisClient(host="redis")
+    redis = backends.redis_client()
     try:
         yield redis
     finally:
@@ -34,7 +103,7 @@ def get_redis_client():
 
 # Dependency to get mongodb client
 def get_mongodb_client():
-    mongodb = MongoDBClient(host="mongodb")
+    mongodb = backends.mongodb_client()
     try:
         yield mongodb
     finally:
@@ -42,7 +111,7 @@ def get_mongodb_client():
 
 # Dependency to get elastic_search client
 def get_elastic_search():
-    es = ElasticsearchClient(host="elasticsearch")
+    es = backends.elasticsearch_client()
     try:
         yield es
     finally:
@@ -50,12 +119,49 @@ def get_elastic_search():
 
 # Dependency to get cassandra client
 def get_cassandra_client():
-    cassandra = CassandraClient(hosts=["cassandra"])
+    cassandra = backends.cassandra_client()
     try:
         yield cassandra
     finally:
         cassandra.close()
 
+# Dependency holding an in-flight slot for the request. It is async so that it runs on the event loop before
+# anything is handed to the thread pool: requests piling up behind busy worker threads are counted and shed too
+async def hold_in_flight_slot():
+    with get_admission_controller().hold_slot():
+        yield
+
+# Dependency admitting a reading, or rejecting it with 429/503 when the API is overloaded
+def admit_reading(sensor_id: int, slot: None = Depends(hold_in_flight_slot), redis_client = Depends(get_redis_client)):
+    with get_admission_controller().admit(redis_client, sensor_id):
+        yield
+
+# Conditional GET: the ETag of a route is made of the version counters of what it reads, templates of
+# app.shared.versions keys filled with the path parameters. When If-None-Match still matches, the
+# 304 is sent by this dependency, before the route's other stores are even connected to. variant(request)
+# adds to the tag what else the response depends on
+def conditional(*keys, variant=None):
+    def check(request: Request, redis_client = Depends(get_redis_client)):
+        tag = versions.etag(*versions.current(redis_client, [key.format(**request.path_params) for key in keys]),
+                            variant=request.url.query + (variant(request) if variant is not None else ""))
+        if versions.matches(request.headers.get("if-none-match"), tag):
+            raise HTTPException(status_code=304, headers={"ETag": tag})
+        return tag
+    return Depends(check)
+
+def tagged(content, etag):
+    return ORJSONResponse(content, headers={"ETag": etag})
+
+def step_fill_end(request: Request):
+    # Without "to", fill=step repeats the last bucket up to the current one: the response changes with it
+    params = request.query_params
+    if params.get("fill") != "step" or params.get("to"):
+        return ""
+    try:
+        return "#" + time_bucket(params.get("bucket"), datetime.now(timezone.utc)).isoformat()
+    except ValueError:
+        return ""
+
 
 router = APIRouter(
     prefix="/sensors",
@@ -66,7 +172,7 @@ router = APIRouter(
 
 # 🙋🏽‍♀️ Add here the route to get a list of sensors near to a given location
 @router.get("/near")
-def get_sensors_near(latitude: float, longitude: float, radius:float, redis_client: RedisClient = Depends(get_redis_client),mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def get_sensors_near(latitude: float, longitude: float, radius:float, redis_client = Depends(get_redis_client),mongodb_client = Depends(get_mongodb_client)):
     return repository.get_sensors_near(mongodb=mongodb_client, redisdb = redis_client, latitude=latitude, longitude=longitude, radius=radius)
 
 # 🙋🏽‍♀️ Add here the route to search sensors by query to Elasticsearch
@@ -77,67 +183,148 @@ def get_sensors_near(latitude: float, longitude: float, radius:float, redis_clie
 # - db: database session
 # - mongodb_client: mongodb client
 @router.get("/search")
-def search_sensors(query: str, size: int = 10, search_type: str = "match", db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), es: ElasticsearchClient = Depends(get_elastic_search)):
+def search_sensors(query: str, size: int = 10, search_type: str = "match", db: Session = Depends(get_db), mongodb_client = Depends(get_mongodb_client), es = Depends(get_elastic_search)):
     return repository.search_sensors(db=db,mongodb=mongodb_client,elastic=es,query=query, size=size, search_type=search_type)
 
 # 🙋🏽‍♀️ Add here the route to get the temperature values of a sensor
 @router.get("/temperature/values")
-def get_temperature_values(mongo_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_temperature_values(mongodb=mongo_client, cassandra=cassandra_client)
+def get_temperature_values(etag: str = conditional(versions.SENSORS, versions.TEMPERATURE),
+                           mongo_client = Depends(get_mongodb_client), cassandra_client = Depends(get_cassandra_client)):
+    return tagged(repository.get_temperature_values(mongodb=mongo_client, cassandra=cassandra_client), etag)
 
 @router.get("/quantity_by_type")
-def get_sensors_quantity(cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_sensors_quantity(cassandra=cassandra_client)
+def get_sensors_quantity(etag: str = conditional(versions.SENSORS), cassandra_client = Depends(get_cassandra_client)):
+    return tagged(repository.get_sensors_quantity(cassandra=cassandra_client), etag)
 
 @router.get("/low_battery")
-def get_low_battery_sensors(mongo_client:  MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client)):
-    return repository.get_low_battery_sensors(mongodb=mongo_client, cassandra=cassandra_client)
+def get_low_battery_sensors(etag: str = conditional(versions.SENSORS, versions.BATTERY),
+                            mongo_client = Depends(get_mongodb_client), cassandra_client = Depends(get_cassandra_client)):
+    return tagged(repository.get_low_battery_sensors(mongodb=mongo_client, cassandra=cassandra_client), etag)
 
 # 🙋🏽‍♀️ Add here the route to get all sensors
+# Pages are walked with the cursor of the X-Next-Cursor header, which is absent on the last page
 @router.get("")
-def get_sensors(db: Session = Depends(get_db)):
-    return repository.get_sensors(db)
+def get_sensors(response: Response, cursor: str = None, limit: int = Query(None, gt=0), db: Session = Depends(get_db)):
+    settings = get_settings()
+    limit = min(limit or settings.sensors_page_size, settings.sensors_max_page_size)
+    # One more than the page, to know whether there is a next one
+    sensors = repository.get_sensors_after(db, after_id=decode_cursor(cursor), limit=limit + 1)
+    if len(sensors) > limit:
+        sensors = sensors[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(sensors[-1].id)
+    return sensors
+
+# Every sensor as one JSON object per line, optionally with its MongoDB metadata and its latest reading
+@router.get("/export")
+def export_sensors(metadata: bool = False, latest: bool = False, db: Session = Depends(get_db),
+                   mongodb_client = Depends(get_mongodb_client), redis_client = Depends(get_redis_client)):
+    sensors = repository.export_sensors(db, mongodb=mongodb_client if metadata else None,
+                                        redisdb=redis_client if latest else None,
+                                        batch_size=get_settings().sensors_export_batch_size)
+    return StreamingResponse((orjson.dumps(sensor) + b"\n" for sensor in sensors), media_type="application/x-ndjson")
+
+# The readings of some sensors (ids=1,2,3, every sensor by default) over a time range as one Parquet
+# file or Arrow stream, written and sent a chunk at a time
+@router.get("/readings")
+def export_readings(ids: str = None, from_data: str = Query(None, alias="from"), to_data: str = Query(None, alias="to"),
+                    columns: str = None, format: str = "parquet", timescale = Depends(get_timescale)):
+    try:
+        sensor_ids = [int(item) for item in ids.split(",")] if ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma separated sensor ids")
+    chunks, media_type = repository.export_readings(timescale, sensor_ids, from_data, to_data, fields=columns, format=format,
+                                                    chunk_size=get_settings().readings_export_chunk_size)
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="readings.{format}"'})
+
+# Percentiles, histogram and per type statistics of a field over every reading of the fleet in a time window
+@router.get("/analytics")
+def get_fleet_analytics(metric: str = "temperature", from_data: str = Query(None, alias="from"),
+                        to_data: str = Query(None, alias="to"), percentiles: str = "50,90,99",
+                        bins: int = Query(20, ge=1, le=1000), mongodb_client = Depends(get_mongodb_client),
+                        timescale = Depends(get_timescale)):
+    try:
+        quantiles = [float(item) for item in percentiles.split(",")]
+    except ValueError:
+        quantiles = None
+    if not quantiles or not all(0 <= q <= 100 for q in quantiles):
+        raise HTTPException(status_code=400, detail="percentiles must be comma separated numbers between 0 and 100")
+    return ORJSONResponse(repository.get_fleet_analytics(mongodb_client, timescale, get_sensor_types(), metric, from_data,
+                                                         to_data, quantiles, bins,
+                                                         chunk_size=get_settings().readings_export_chunk_size))
 
 
 # 🙋🏽‍♀️ Add here the route to create a sensor
 @router.post("")
-def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client), elasticsearch_client : ElasticsearchClient = Depends(get_elastic_search)):
+def create_sensor(sensor: schemas.SensorCreate, db: Session = Depends(get_db), mongodb_client = Depends(get_mongodb_client), cassandra_client = Depends(get_cassandra_client), elasticsearch_client = Depends(get_elastic_search), redis_client = Depends(get_redis_client)):
     db_sensor = repository.get_sensor_by_name(db, sensor.name)
     if db_sensor:
         raise HTTPException(status_code=400, detail="Sensor with same name already registered")
-    return repository.create_sensor(db=db, mongodb= mongodb_client, elastic=elasticsearch_client, cassandra=cassandra_client, sensor=sensor)
+    return repository.create_sensor(db=db, mongodb= mongodb_client, elastic=elasticsearch_client, cassandra=cassandra_client, sensor=sensor, redis=redis_client)
+
+# Registers many sensors at once, each store written once per chunk, with the outcome of each sensor
+@router.post("/bulk")
+def create_sensors(sensors: List[schemas.SensorCreate], db: Session = Depends(get_db), mongodb_client = Depends(get_mongodb_client), cassandra_client = Depends(get_cassandra_client), elasticsearch_client = Depends(get_elastic_search), redis_client = Depends(get_redis_client)):
+    settings = get_settings()
+    if len(sensors) > settings.sensors_bulk_max:
+        raise HTTPException(status_code=400, detail=f"At most {settings.sensors_bulk_max} sensors per request")
+    return repository.create_sensors(db=db, mongodb=mongodb_client, elastic=elasticsearch_client, cassandra=cassandra_client,
+                                     sensors=sensors, redis=redis_client, chunk_size=settings.sensors_bulk_chunk_size)
 
 # 🙋🏽‍♀️ Add here the route to get a sensor by id
 @router.get("/{sensor_id}")
-def get_sensor(sensor_id: int, mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def get_sensor(sensor_id: int, etag: str = conditional(versions.sensor("{sensor_id}")), mongodb_client = Depends(get_mongodb_client)):
     db_sensor = repository.get_sensor(mongodb_client, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return db_sensor
+    # The document only holds plain types, a Response skips FastAPI's own encoding pass
+    return tagged(db_sensor, etag)
 
 # 🙋🏽‍♀️ Add here the route to delete a sensor
 @router.delete("/{sensor_id}")
-def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client: MongoDBClient = Depends(get_mongodb_client)):
+def delete_sensor(sensor_id: int, db: Session = Depends(get_db), mongodb_client = Depends(get_mongodb_client), redis_client = Depends(get_redis_client)):
     db_sensor = repository.get_sensor(db, sensor_id)
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    return repository.delete_sensor(db=db, sensor_id=sensor_id)
+    return repository.delete_sensor(db=db, sensor_id=sensor_id, redis=redis_client)
 
 # 🙋🏽‍♀️ Add here the route to update a sensor
 @router.post("/{sensor_id}/data")
-def record_data(sensor_id: int, data: schemas.SensorData, mongo: Session = Depends(get_mongodb_client), cassandra_client: CassandraClient = Depends(get_cassandra_client) ,redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale = Depends(get_timescale)):
+def record_data(sensor_id: int, data: schemas.SensorData, admitted: None = Depends(admit_reading), mongo: Session = Depends(get_mongodb_client), cassandra_client = Depends(get_cassandra_client) ,redis_client = Depends(get_redis_client), timescale = Depends(get_timescale)):
     # First, check if sensor is on the database
     db_sensor = repository.get_sensor(mongo, sensor_id)
     # If the sensor is not on the database, we will rise an error
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
-    # Else, we will post the new data
+    # Else, we will post the new data, either handing it to the consumer through the queue...
+    elif get_settings().ingest_mode == "queue":
+        try:
+            get_publisher().publish(schemas.SensorDataMessage(sensor_id=sensor_id, data=data, received_at=time.time()))
+        except queue.Full:
+            get_admission_controller().reject("queue_depth", get_settings().admission_retry_after)
+        return data.dict()
+    # ... or writing it to the databases ourselves
     else:
-        return repository.record_data(redis=redis_client, ts=timescale, cassandra=cassandra_client, sensor_id=sensor_id, data=data)
+        return repository.record_data(redis=redis_client, ts=timescale, cassandra=cassandra_client, sensor_id=sensor_id, data=data,
+                                      cache_grace=bucket_cache_grace())
+
+# The consumer keeps rollups of the open buckets only when it writes the readings
+def use_rollups():
+    settings = get_settings()
+    return settings.ingest_mode == "queue" and settings.rollup_flush_interval > 0
+
+# Seconds after closing a bucket is cached, None when closed buckets are not cached
+def bucket_cache_grace():
+    settings = get_settings()
+    return settings.bucket_cache_grace if settings.bucket_cache else None
 
 # 🙋🏽‍♀️ Add here the route to get data from a sensor
 @router.get("/{sensor_id}/data")
-def get_data(sensor_id: int, request: Request, mongo: Session = Depends(get_mongodb_client), redis_client: RedisClient = Depends(get_redis_client), timescale: Timescale = Depends(get_timescale)):
+# max_points downsamples the raw readings, or the buckets, to that many points chosen on field with
+# "lttb" (keeps the shape) or "minmax" (keeps the peaks of every slice of time)
+def get_data(sensor_id: int, request: Request, max_points: int = Query(None, ge=2), downsample: str = "lttb", field: str = None,
+             etag: str = conditional(versions.sensor("{sensor_id}"), versions.data("{sensor_id}"), variant=step_fill_end),
+             mongo: Session = Depends(get_mongodb_client), redis_client = Depends(get_redis_client), timescale = Depends(get_timescale)):
     # First, check if sensor is on the database
     db_sensor = repository.get_sensor(mongo, sensor_id)
     # If the sensor is not on the database, we will rise an error
@@ -145,5 +332,5 @@ def get_data(sensor_id: int, request: Request, mongo: Session = Depends(get_mong
         raise HTTPException(status_code=404, detail="Sensor not found")
     # Else we will return the data
     else:
-        return repository.get_data(redis=redis_client, ts=timescale, sensor_id=sensor_id, from_data=request.query_params.get('from',None), to_data=request.query_params.get('to',None), bucket=request.query_params.get('bucket',None))
+        return tagged(repository.get_data(redis=redis_client, ts=timescale, sensor_id=sensor_id, from_data=request.query_params.get('from',None), to_data=request.query_params.get('to',None), bucket=request.query_params.get('bucket',None), use_rollups=use_rollups(), max_points=max_points, method=downsample, field=field, chunk_size=get_settings().readings_chunk_size, cache_grace=bucket_cache_grace(), fill=request.query_params.get('fill'), cache_ttl=get_settings().bucket_cache_ttl), etag)
 
@@ -1,36 +1,97 @@
 from fastapi import HTTPException
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from . import models, schemas
+from app.shared import bucket_cache, rollups, versions
+from app.shared.buckets import parse_time, step_fill
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 import json
 
-def get_sensor(mongodb: Session, sensor_id: int) -> Optional[models.Sensor]:
+def get_sensor(mongodb: Session, sensor_id: int) -> Optional[dict]:
     # Get sensor data on MongoDB by its id
     sensor_data = mongodb.get_sensor(sensor_id)
     if sensor_data:
-        # Prepare data to be returned
-        sensor_data["latitude"] = float(sensor_data["location"]["coordinates"][0])
-        sensor_data["longitude"] = float(sensor_data["location"]["coordinates"][1])
-        sensor_data.pop("location")
-        return json.dumps(sensor_data)
+        # Prepare data to be returned, as a dict: the response class encodes it once
+        return sensor_document(sensor_data)
     else:
         return
 
+def sensor_document(sensor_data: dict) -> dict:
+    # MongoDB keeps the position as a GeoJSON point, the API as latitude and longitude
+    location = sensor_data.pop("location")
+    sensor_data["latitude"] = float(location["coordinates"][0])
+    sensor_data["longitude"] = float(location["coordinates"][1])
+    return sensor_data
+
 def get_sensor_by_name(db: Session, name: str) -> Optional[models.Sensor]:
     return db.query(models.Sensor).filter(models.Sensor.name == name).first()
 
 def get_sensors(db: Session, skip: int = 0, limit: int = 100) -> List[models.Sensor]:
     return db.query(models.Sensor).offset(skip).limit(limit).all()
 
-def create_sensor(db: Session, mongodb: Session, elastic: Session, cassandra: Session, sensor: schemas.SensorCreate) -> models.Sensor:
+def get_sensors_after(db: Session, after_id: int = 0, limit: int = 100) -> List[models.Sensor]:
+    # Keyset pagination: the primary key index finds where the page starts, however deep it is,
+    # where an offset would read and drop every sensor before it
+    return db.query(models.Sensor).filter(models.Sensor.id > after_id).order_by(models.Sensor.id).limit(limit).all()
+
+def export_sensors(db: Session, mongodb: Session = None, redisdb: Session = None, batch_size: int = 1000):
+    # Walk every sensor in id order without loading them all: Postgres streams the rows from a server
+    # side cursor, batch_size at a time, and each batch is joined with MongoDB and Redis in one query each
+    rows = db.execute(select(models.Sensor.id, models.Sensor.name, models.Sensor.joined_at)
+                      .order_by(models.Sensor.id).execution_options(yield_per=batch_size))
+    for batch in rows.partitions():
+        sensors = [{"id": row.id, "name": row.name, "joined_at": row.joined_at} for row in batch]
+        ids = [sensor["id"] for sensor in sensors]
+        if mongodb is not None:
+            documents = {document["id"]: sensor_document(document) for document in mongodb.get_sensors(ids)}
+            for sensor in sensors:
+                sensor.update(documents.get(sensor["id"], {}))
+        if redisdb is not None:
+            for sensor, latest in zip(sensors, redisdb.get_sensors(ids)):
+                sensor["latest"] = latest
+        yield from sensors
+
+def export_readings(ts: Session, sensor_ids: list, from_data: str, to_data: str, fields: str = None, format: str = "parquet",
+                    chunk_size: int = 65536):
+    # pyarrow is only loaded by the first export
+    from app import export
+    try:
+        fields = export.parse_fields(fields)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {', '.join(export.FORMATS)}")
+    chunks = ts.stream_readings(export.columns(fields), sensor_ids, from_data, to_data, chunk_size=chunk_size)
+    return export.stream(chunks, fields, format), export.MEDIA_TYPES[format]
+
+def create_sensor(db: Session, mongodb: Session, elastic: Session, cassandra: Session, sensor: schemas.SensorCreate,
+                  redis: Session = None) -> models.Sensor:
     # Add data to Postgress
     db_sensor = models.Sensor(name=sensor.name)
     db.add(db_sensor)
     db.commit()
     db.refresh(db_sensor)
     #  Add data to MongoDB
-    data = {"id": db_sensor.id,
+    mongodb.add_sensor(mongodb_document(db_sensor.id, sensor))
+    # Add data to ElasticSearch
+    elastic.index_document('sensors', elastic_document(sensor))
+
+    # Add 1 to Cassandra sensor type counter
+    cassandra.increment_quantity(sensor.type)
+    # Once every store has it, the ETags of the sensor and of the fleet change
+    if redis is not None:
+        redis.incr_many(versions.registration_keys(db_sensor.id))
+
+    # Prepare data to be returned
+    sensor = sensor.dict()
+    sensor['id'] = db_sensor.id
+    return sensor
+
+def mongodb_document(sensor_id: int, sensor: schemas.SensorCreate) -> dict:
+    return {"id": sensor_id,
             "name": sensor.name,
             "type": sensor.type,
             "mac_address": sensor.mac_address,
@@ -40,55 +101,132 @@ def create_sensor(db: Session, mongodb: Session, elastic: Session, cassandra: Se
             "firmware_version": sensor.firmware_version,
             "description": sensor.description,
             "location": {"type": "Point", "coordinates": [sensor.latitude, sensor.longitude]}}
-    mongodb.add_sensor(data)
-    # Add data to ElasticSearch
-    # Define the mapping for the index
-    es_data = {
-        "name": sensor.name,
-        "type": sensor.type,
-        "description": sensor.description
-    }
-    elastic.index_document('sensors', es_data)
 
-    # Add 1 to Cassandra sensor type counter
-    cassandra.execute(f"""
-        UPDATE sensor.quantity 
-        SET quantity = quantity+1  WHERE  type_sensor = '{sensor.type}';""")
+def elastic_document(sensor: schemas.SensorCreate) -> dict:
+    # The fields of the mapping of the sensors index
+    return {"name": sensor.name, "type": sensor.type, "description": sensor.description}
 
-    # Prepare data to be returned
-    sensor = sensor.dict()
-    sensor['id'] = db_sensor.id
-    return sensor
+def create_sensors(db: Session, mongodb: Session, elastic: Session, cassandra: Session, sensors: List[schemas.SensorCreate],
+                   redis: Session = None, chunk_size: int = 1000) -> dict:
+    # One item per sensor sent, in order: created (with its id), exists (the name was already registered)
+    # or duplicate (the name came earlier in the same request)
+    items = []
+    first = {}
+    for sensor in sensors:
+        if sensor.name in first:
+            items.append({"name": sensor.name, "status": "duplicate"})
+        else:
+            first[sensor.name] = len(items)
+            items.append({"name": sensor.name, "status": "exists"})
+    unique = [sensors[position] for position in first.values()]
 
-def record_data(redis: Session, ts: Session, cassandra: Session, sensor_id: int, data: schemas.SensorData) -> schemas.Sensor:
-    # First we will add the data to TimeScale
-    # We will prepare the query with placeholders
-    query = f'''INSERT INTO sensor_data(id, battery_level, last_seen, temperature, humidity, velocity) 
-             VALUES ({sensor_id}, {data.battery_level}, 
-                     {f"'{data.last_seen}'" if data.last_seen is not None else 'NULL'}, 
-                     {data.temperature if data.temperature is not None else 'NULL'}, 
-                     {data.humidity if data.humidity is not None else 'NULL'}, 
-                     {data.velocity if data.velocity is not None else 'NULL'})
-             ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature,
-             humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level;'''
-    # We will execute the query and update the database
-    ts.execute(query)
-    ts.execute('commit')
+    # Each chunk is one round trip to every store
+    for start in range(0, len(unique), chunk_size):
+        chunk = unique[start:start + chunk_size]
+        ids = insert_sensor_names(db, [sensor.name for sensor in chunk])
+        created = [(ids[sensor.name], sensor) for sensor in chunk if sensor.name in ids]
+        if not created:
+            continue
+        failed = {"mongodb": mongodb.add_sensors([mongodb_document(sensor_id, sensor) for sensor_id, sensor in created]),
+                  "elasticsearch": elastic.index_documents('sensors', [elastic_document(sensor) for _, sensor in created])}
+        cassandra.increment_quantities(Counter(sensor.type for _, sensor in created))
+        if redis is not None:
+            redis.incr_many([versions.SENSORS, *(versions.sensor(sensor_id) for sensor_id, _ in created)])
+        for position, (sensor_id, sensor) in enumerate(created):
+            item = items[first[sensor.name]]
+            item.update(status="created", id=sensor_id)
+            errors = {store: reasons[position] for store, reasons in failed.items() if position in reasons}
+            if errors:
+                item["errors"] = errors
+
+    statuses = Counter(item["status"] for item in items)
+    return {"created": statuses["created"], "existing": statuses["exists"], "duplicates": statuses["duplicate"],
+            "items": items}
 
+def insert_sensor_names(db: Session, names: List[str]) -> dict:
+    # A single INSERT ... ON CONFLICT DO NOTHING RETURNING for all of them, the names already registered
+    # get no row back. Rows come back in no particular order, hence the names
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    joined_at = datetime.utcnow()
+    statement = insert(models.Sensor).values([{"name": name, "joined_at": joined_at} for name in names]) \
+        .on_conflict_do_nothing(index_elements=["name"]).returning(models.Sensor.id, models.Sensor.name)
+    rows = db.execute(statement).all()
+    db.commit()
+    return {name: sensor_id for sensor_id, name in rows}
+
+def record_data(redis: Session, ts: Session, cassandra: Session, sensor_id: int, data: schemas.SensorData,
+                cache_grace: float = None) -> schemas.Sensor:
+    # First we will add the data to TimeScale
+    record_data_timescale(ts, sensor_id, data, redis=redis, cache_grace=cache_grace)
     # We will update Cassandra's tables as well
+    record_data_cassandra(cassandra, sensor_id, data)
+    # After that we will update the data on Redis
+    return record_data_redis(redis, sensor_id, data)
+
+def record_data_timescale(ts: Session, sensor_id: int, data: schemas.SensorData, redis: Session = None,
+                          cache_grace: float = None):
+    # Timescale keeps the whole history, a reading sent twice replaces itself
+    ts.insert_reading(sensor_id, data)
+    # Once it is in Timescale, a late reading can no longer be hidden by the cached buckets it changes
+    if redis is not None and cache_grace is not None:
+        bucket_cache.forget(redis, [(sensor_id, data)], datetime.now(timezone.utc), cache_grace)
+
+def record_data_cassandra(cassandra: Session, sensor_id: int, data: schemas.SensorData):
+    # Temperatures are keyed by the reading time so that replaying a reading overwrites the same row
+    # instead of adding a new one
     if data.temperature is not None:
-        cassandra.execute(f"""
-            INSERT INTO sensor.temperature (id, last_seen, temperature)
-            VALUES ({sensor_id}, toTimeStamp(now()), {data.temperature})""")
+        cassandra.add_temperature(sensor_id, datetime.fromisoformat(data.last_seen), data.temperature)
+    cassandra.set_battery_level(sensor_id, data.battery_level)
+
+def record_data_redis(redis: Session, sensor_id: int, data: schemas.SensorData):
+    # We will call an internal redis client method that allows us to store data under a key. Redis is
+    # written last, so bumping the version counters with it changes the ETags once every store has the reading
+    return redis.add_sensor(sensor_id, data, versions=versions.reading_keys([(sensor_id, data)]))
+
+# The same writes for a batch of (sensor_id, data) readings, with one round trip per database. Each
+# store is written (and retried) on its own, so each one bumps the version counters of what it serves
+# once it holds the readings: a failed write leaves them alone, its retry bumps them
+def record_data_many_timescale(ts: Session, readings: list, redis: Session = None, cache_grace: float = None):
+    ts.insert_readings(readings)
+    if redis is not None:
+        redis.incr_many(versions.reading_keys(readings, "timescale"))
+    if redis is not None and cache_grace is not None:
+        bucket_cache.forget(redis, readings, datetime.now(timezone.utc), cache_grace)
 
-    cassandra.execute(f"""
-               UPDATE sensor.battery 
-               SET battery_level = {data.battery_level} WHERE id = {sensor_id};""")
+def record_data_many_cassandra(cassandra: Session, readings: list, redis: Session = None, deadband=None):
+    # Every temperature is kept, the battery table only holds the newest level of each sensor, and with a
+    # deadband it keeps the level it has while the new one stays within its rule
+    batteries = latest_readings(readings)
+    if deadband is not None:
+        batteries = deadband.changed("battery_level", batteries)
+    temperatures = [(sensor_id, datetime.fromisoformat(data.last_seen), data.temperature)
+                    for sensor_id, data in readings if data.temperature is not None]
+    if temperatures or batteries:
+        cassandra.add_readings(temperatures, [(sensor_id, data.battery_level) for sensor_id, data in batteries])
+    if deadband is not None:
+        deadband.hold("battery_level", batteries)
+    if redis is not None:
+        redis.incr_many(versions.reading_keys(readings, "cassandra"))
 
-    # After that we will update the data on Redis, we will call an internal redis client method that allows us to store data under a key
-    return redis.add_sensor(sensor_id, data)
+def record_data_many_redis(redis: Session, readings: list):
+    # Only the latest reading of each sensor is kept, one write per sensor whatever the size of the batch
+    redis.add_sensors(dict(latest_readings(readings)), versions=versions.reading_keys(readings, "redis"))
 
-def get_data(redis: Session, ts: Session, sensor_id: int, from_data: str, to_data: str, bucket: str):
+def latest_readings(readings: list) -> list:
+    # The newest (sensor_id, data) reading of each sensor by last_seen, the last one received on a tie
+    latest = {}
+    for sensor_id, data in readings:
+        last_seen = parse_time(data.last_seen)
+        if sensor_id not in latest or last_seen >= latest[sensor_id][0]:
+            latest[sensor_id] = (last_seen, data)
+    return [(sensor_id, data) for sensor_id, (_, data) in latest.items()]
+
+def get_data(redis: Session, ts: Session, sensor_id: int, from_data: str, to_data: str, bucket: str, use_rollups: bool = False,
+             max_points: int = None, method: str = "lttb", field: str = None, chunk_size: int = 10000,
+             cache_grace: float = None, fill: str = None, cache_ttl: float = bucket_cache.TTL):
     # If no time specifications, we will call an internal redis client method that allows us to get data under a key
     if not from_data and not to_data:
         redis_data =  redis.get_sensor(sensor_id)
@@ -97,44 +235,80 @@ def get_data(redis: Session, ts: Session, sensor_id: int, from_data: str, to_dat
 
     # Else, we will search the data on Timescale
     else:
+        if max_points:
+            # NumPy is only loaded by the first downsampled read
+            from app.shared import downsample
+            if method not in downsample.METHODS or (field and field not in downsample.FIELDS):
+                raise HTTPException(status_code=400, detail="Downsampling method or field is not valid")
+            # Without a bucket the raw readings are streamed into column arrays and downsampled
+            if not bucket:
+                buffer = downsample.ColumnBuffer()
+                for rows in ts.stream_readings(("id", "last_seen", *downsample.FIELDS), [sensor_id], from_data, to_data,
+                                               chunk_size=chunk_size):
+                    buffer.extend(rows)
+                return downsample.downsample(buffer, max_points, method, field)
         valid_buckets = ['hour', 'day', 'week', 'month', 'year']
         # If no bucket is specified we will rise and error
         if not bucket or bucket not in valid_buckets:
             raise HTTPException(status_code=400, detail="Bucket is not valid")
+        # The open hour or day can come from the consumer's running aggregates
+        if use_rollups and bucket in rollups.BUCKETS:
+            fetch = lambda start, end: get_buckets_with_rollup(redis, ts, sensor_id, bucket, start, end)
         # Else we will filter data by the provided conditions
-        if not from_data:
-            query = f'''SELECT id, time_bucket('1 {bucket}', last_seen) AS {bucket}, AVG(velocity), AVG(temperature), AVG(humidity), MIN(battery_level)
-                                FROM sensor_data WHERE id = {sensor_id} AND last_seen <= '{to_data}';'''
-        elif not to_data:
-            query = f'''SELECT id, time_bucket('1 {bucket}', last_seen) AS {bucket}, AVG(velocity), AVG(temperature), AVG(humidity), MIN(battery_level)
-                                FROM sensor_data WHERE id = {sensor_id} AND  last_seen >= '{from_data}';'''
         else:
-            query = f'''SELECT id, time_bucket('1 {bucket}', last_seen) AS {bucket}, AVG(velocity), AVG(temperature), AVG(humidity), MIN(battery_level)
-                    FROM sensor_data WHERE id = {sensor_id} AND  last_seen >= '{from_data}' AND last_seen <= '{to_data}'
-                    GROUP BY id,{bucket};'''
-        ts.getCursor().execute(query)
-        return ts.getCursor().fetchall()
+            fetch = lambda start, end: ts.get_buckets(sensor_id, bucket, start, end)
+        # Closed buckets never change, the ones already asked for come from the cache
+        if cache_grace is not None:
+            rows = bucket_cache.get_buckets(redis, fetch, sensor_id, bucket, from_data, to_data,
+                                            datetime.now(timezone.utc), cache_grace, ttl=cache_ttl)
+        else:
+            rows = fetch(from_data, to_data)
+        # Buckets without readings (left out by a deadband) repeat the previous one
+        if fill == "step":
+            rows = step_fill(rows, bucket, parse_time(to_data) if to_data else datetime.now(timezone.utc))
+        elif fill:
+            raise HTTPException(status_code=400, detail="fill must be step")
+        if max_points:
+            return downsample.downsample(downsample.ColumnBuffer().extend(rows), max_points, method, field)
+        return rows
 
-def delete_sensor(db: Session, sensor_id: int):
+def get_buckets_with_rollup(redis: Session, ts: Session, sensor_id: int, bucket: str, from_data: str, to_data: str):
+    # A rollup holds the whole open bucket, it answers for it only when the range covers all of it
+    now = datetime.now(timezone.utc)
+    start = rollups.open_bucket(bucket, now)
+    from_time = parse_time(from_data) if from_data else None
+    if (from_time and from_time > start) or (to_data and parse_time(to_data) < now):
+        return ts.get_buckets(sensor_id, bucket, from_data, to_data)
+    since, rollup = redis.get_rollup_since(rollups.key(sensor_id, bucket, start), rollups.SINCE_KEY)
+    # Without a rollup (no reading yet, or readings written by the API itself), or with one missing the beginning
+    # of the bucket (a consumer started or restarted since it opened), Timescale has the answer
+    if rollup is None or not rollups.covers(since, start):
+        return ts.get_buckets(sensor_id, bucket, from_data, to_data)
+    # Timescale only for the closed buckets, and only when the range reaches back to them
+    closed = []
+    if from_time is None or from_time < start:
+        closed = ts.get_buckets(sensor_id, bucket, from_data, (start - timedelta(microseconds=1)).isoformat())
+    return [*closed, rollups.row(sensor_id, start, rollup)]
+
+def delete_sensor(db: Session, sensor_id: int, redis: Session = None):
     db_sensor = db.query(models.Sensor).filter(models.Sensor.id == sensor_id).first()
     if db_sensor is None:
         raise HTTPException(status_code=404, detail="Sensor not found")
     db.delete(db_sensor)
     db.commit()
+    if redis is not None:
+        redis.incr_many(versions.registration_keys(sensor_id))
     return db_sensor
 
 def get_sensors_near(mongodb: Session, redisdb: Session, latitude, longitude, radius):
-    # First get nearest sensor
-    sensors = mongodb.get_near_sensors(latitude, longitude, radius)
-    # If there is any sensor, add its variable data stored in Redis
-    if sensors is not None:
-        for i in range(len(sensors)):
-            sensor_redis = get_data(redisdb,sensors[i]['id'])
-            sensors[i]["temperature"] = sensor_redis["temperature"]
-            sensors[i]["humidity"] = sensor_redis["humidity"]
-            sensors[i]["battery_level"] = sensor_redis["battery_level"]
-            sensors[i]["velocity"] = sensor_redis["velocity"]
-            sensors[i]["last_seen"] = sensor_redis["last_seen"]
+    # First get the sensors in the area, nearest first
+    sensors = [sensor_document(sensor) for sensor in mongodb.get_near_sensors(latitude, longitude, radius)]
+    # Then add their variable data stored in Redis, fetched for all of them at once
+    latest = redisdb.get_sensors([sensor["id"] for sensor in sensors])
+    for sensor, sensor_redis in zip(sensors, latest):
+        if sensor_redis is not None:
+            for field in ("temperature", "humidity", "battery_level", "velocity", "last_seen"):
+                sensor[field] = sensor_redis.get(field)
     return sensors
 
 def search_sensors(db: Session, mongodb: Session, elastic: Session, query: str, size: int, search_type: str):
@@ -155,20 +329,30 @@ def search_sensors(db: Session, mongodb: Session, elastic: Session, query: str,
         sensors.append(get_sensor(mongodb,sensor_db.id))
     return sensors
 
+def get_fleet_analytics(mongodb: Session, ts: Session, sensor_types, metric: str, from_data: str, to_data: str,
+                        percentiles: list, bins: int, chunk_size: int = 65536):
+    # NumPy is only loaded by the first analytics request
+    from app.shared import analytics
+    if metric not in analytics.FIELDS:
+        raise HTTPException(status_code=400, detail=f"Metric must be one of {', '.join(analytics.FIELDS)}")
+    if not from_data:
+        raise HTTPException(status_code=400, detail="A time window starting at from is required")
+    # Every (id, value) of the window in bulk, in no particular order, joined in memory with the types
+    ids, values = analytics.load_columns(ts.stream_readings(("id", metric), None, from_data, to_data,
+                                                            chunk_size=chunk_size, ordered=False))
+    names, codes = sensor_types.lookup(mongodb, ids)
+    return {"metric": metric, "from": from_data, "to": to_data,
+            **analytics.fleet_summary(ids, values, names, codes, percentiles, bins)}
+
 def get_temperature_values(mongodb: Session, cassandra : Session):
     # Get temperature stadistic values with Cassandra
-    temp_sensors = cassandra.execute("""
-        SELECT id,
-        MAX(temperature) as max_temperature,
-        MIN(temperature) as min_temperature, 
-        AVG(temperature) as average_temperature
-        FROM sensor.temperature GROUP BY id;""")
+    temp_sensors = cassandra.get_temperature_values()
 
     response = []
     # Iterate through sensors and add additional data stored on MongoDB
     for sensor in temp_sensors:
         # First, we will get mongo's data about the sensor
-        sensor_data = json.loads(get_sensor(mongodb,sensor.id))
+        sensor_data = get_sensor(mongodb,sensor.id)
         # Then we will add Cassandra's values
         sensor_data["values"] = [{"max_temperature": sensor.max_temperature,"min_temperature": sensor.min_temperature,"average_temperature": sensor.average_temperature}]
         response.append(sensor_data)
@@ -177,9 +361,7 @@ def get_temperature_values(mongodb: Session, cassandra : Session):
 
 def get_sensors_quantity(cassandra: Session):
     # Get quantities of each type with Cassandra
-    quantity_sensors = cassandra.execute("""
-            SELECT type_sensor, quantity
-            FROM sensor.quantity GROUP BY type_sensor;""")
+    quantity_sensors = cassandra.get_quantities()
 
     response = []
     # Reformat returned data
@@ -190,16 +372,13 @@ def get_sensors_quantity(cassandra: Session):
 
 def get_low_battery_sensors(mongodb:Session, cassandra : Session):
     # Get latest battery_level of each sensor with Cassandra db, filter those under 20%
-    battery_sensors = cassandra.execute("""
-               SELECT id, battery_level
-               FROM sensor.battery 
-               WHERE battery_level < 0.2 ALLOW FILTERING;""")
+    battery_sensors = cassandra.get_low_battery(0.2)
 
     response = []
     # Iterate through sensors and add additional data stored on MongoDB
     for sensor in battery_sensors:
         # First, we will get mongo's data about the sensor
-        sensor_data = json.loads(get_sensor(mongodb,sensor.id))
+        sensor_data = get_sensor(mongodb,sensor.id)
         # Then we will update the latest batter_level
         sensor_data['battery_level'] = round(sensor.battery_level, 2)
         response.append(sensor_data)
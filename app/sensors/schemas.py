@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+import orjson
+from pydantic import BaseModel, validator
 
 
 class Sensor(BaseModel):
@@ -39,3 +40,27 @@ class SensorData(BaseModel):
     humidity: float | None = None
     battery_level: float
     last_seen: str
+
+
+# Message sent through RabbitMQ when the API works in "queue" ingest mode
+class SensorDataMessage(BaseModel):
+    sensor_id: int
+    data: SensorData
+    # Time (epoch seconds) the API accepted the reading, where its ingest lag starts
+    received_at: float = None
+    # Deterministic id (sensor + reading time), the consumer uses it to drop redelivered readings
+    id: str = None
+
+    @validator("id", always=True)
+    def stamp_id(cls, value, values):
+        if value is None and "sensor_id" in values and "data" in values:
+            return message_id(values["sensor_id"], values["data"].last_seen)
+        return value
+
+    def to_json(self):
+        # UTF-8 bytes, ready for the broker and the spool
+        return orjson.dumps(self.dict())
+
+
+def message_id(sensor_id: int, last_seen: str) -> str:
+    return f"{sensor_id}:{last_seen}"
@@ -23,7 +23,7 @@ def clear_dbs():
     redis.clearAll()
     redis.close()
     mongo = MongoDBClient(host="mongodb")
-    mongo.clearDb("sensors")
+    mongo.clearDb("SensorsDB")
     mongo.close()
     es = ElasticsearchClient(host="elasticsearch")
     es.clearIndex("sensors")
@@ -85,21 +85,21 @@ def test_get_sensor_1():
     """A sensor can be properly retrieved"""
     response = client.get("/sensors/1")
     assert response.status_code == 200
-    assert response.json()[7] ==  '1' # Check that id is correct
+    assert response.json()["id"] == 1 # Check that id is correct
 
 
 def test_get_sensor_2():
     """A sensor can be properly retrieved"""
     response = client.get("/sensors/2")
     assert response.status_code == 200
-    assert response.json()[7] ==  '2' # Check that id is correct
+    assert response.json()["id"] == 2 # Check that id is correct
 
 
 def test_get_sensor_3():
     """A sensor can be properly retrieved"""
     response = client.get("/sensors/3")
     assert response.status_code == 200
-    assert response.json()[7] ==  '3' # Check that id is correct
+    assert response.json()["id"] == 3 # Check that id is correct
 
 def test_elasticsearch_client():
     """Elasticsearch client can be properly created"""
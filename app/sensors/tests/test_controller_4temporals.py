@@ -23,7 +23,7 @@ def clear_dbs():
     redis.clearAll()
     redis.close()
     mongo = MongoDBClient(host="mongodb")
-    mongo.clearDb("sensors")
+    mongo.clearDb("SensorsDB")
     mongo.close()
     es = ElasticsearchClient(host="elasticsearch")
     es.clearIndex("sensors")
@@ -0,0 +1,39 @@
+from app.mongodb_client import MongoDBClient, TYPES_PROJECTION
+import pytest
+
+
+@pytest.fixture(scope="module")
+def mongo():
+    mongo = MongoDBClient(host="mongodb")
+    mongo.ensure_indexes()
+    if mongo.get_sensor(1) is None:
+        mongo.add_sensor({"id": 1, "name": "Sensor Index 1", "type": "Temperatura",
+                          "location": {"type": "Point", "coordinates": [1.0, 1.0]}})
+    yield mongo
+    mongo.close()
+
+
+def test_sensor_lookups_use_the_id_index(mongo):
+    """The hot lookups by id never scan the collection"""
+    for query in ({"id": 1}, {"id": {"$in": [1, 2, 3]}}):
+        stages = mongo.explain(query, {'_id': 0})
+        assert "IXSCAN" in stages and "COLLSCAN" not in stages
+
+
+def test_sensor_types_are_read_from_the_index_alone(mongo):
+    """get_sensor_types is a covered query: the documents are never fetched"""
+    stages = mongo.explain({}, TYPES_PROJECTION, hint="id_type")
+    assert "IXSCAN" in stages and "FETCH" not in stages and "COLLSCAN" not in stages
+
+
+def test_near_sensors_use_the_2dsphere_index(mongo):
+    stages = mongo.explain({"location": {"$near": {"$geometry": {"type": "Point", "coordinates": [1.0, 1.0]},
+                                                   "$maxDistance": 1000}}}, {'_id': 0})
+    assert "COLLSCAN" not in stages
+
+
+def test_sensor_ids_are_unique(mongo):
+    from pymongo.errors import DuplicateKeyError
+    with pytest.raises(DuplicateKeyError):
+        mongo.add_sensor({"id": 1, "name": "Sensor Index 1 bis", "type": "Temperatura",
+                          "location": {"type": "Point", "coordinates": [1.0, 1.0]}})
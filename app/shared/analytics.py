@@ -0,0 +1,114 @@
+"""Fleet wide statistics of one reading field, computed with NumPy over every reading of a time window.
+
+Readings are pulled from Timescale as ``(id, value)`` chunks and stacked into two arrays. The
+type of each reading comes from ``SensorTypes``, an array indexed by sensor id kept in memory,
+so joining millions of readings with their sensor's type is one fancy indexing operation. The
+statistics of each type are computed on its slice of the readings sorted by type: the only
+Python loops run once per type or per chunk, never per reading.
+"""
+import threading
+import time
+
+import numpy as np
+
+FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+# Code of the readings of sensors without a known type
+UNKNOWN = -1
+
+
+def load_columns(chunks):
+    """``(ids, values)`` arrays of every ``(id, value)`` chunk, without the readings missing the value."""
+    ids, values = [], []
+    for rows in chunks:
+        # None becomes NaN, the conversion runs in C
+        columns = np.array(rows, dtype=float).reshape(-1, 2)
+        ids.append(columns[:, 0])
+        values.append(columns[:, 1])
+    ids = np.concatenate(ids) if ids else np.empty(0)
+    values = np.concatenate(values) if values else np.empty(0)
+    present = ~np.isnan(values)
+    return ids[present].astype(np.int64), values[present]
+
+
+class SensorTypes:
+    """The type of every sensor as a code array indexed by sensor id, loaded from MongoDB every ``ttl`` seconds.
+
+    Sensors registered since the last load are picked up by the next lookup that meets one of
+    their readings, at most once every ``min_reload`` seconds.
+    """
+
+    def __init__(self, ttl=60.0, min_reload=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.min_reload = min_reload
+        self.clock = clock
+        self.names = ()
+        self.codes = np.empty(0, dtype=np.int16)
+        self.loaded_at = None
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def load(self, mongodb):
+        documents = mongodb.get_sensor_types()
+        names = tuple(sorted({document.get("type") or "" for document in documents}))
+        index = {name: code for code, name in enumerate(names)}
+        codes = np.full(max((document["id"] for document in documents), default=-1) + 1, UNKNOWN, dtype=np.int16)
+        for document in documents:
+            codes[document["id"]] = index[document.get("type") or ""]
+        # Swapped together, a concurrent lookup sees either the old map or the new one
+        self.names, self.codes = names, codes
+        self.loaded_at = self.clock()
+        self.loads += 1
+
+    def lookup(self, mongodb, ids):
+        """``(type names, type code of each id)``, UNKNOWN for sensors MongoDB does not know."""
+        with self._lock:
+            age = None if self.loaded_at is None else self.clock() - self.loaded_at
+            if age is None or age > self.ttl or (age > self.min_reload and self._misses(ids)):
+                self.load(mongodb)
+            names, codes = self.names, self.codes
+        types = np.full(len(ids), UNKNOWN, dtype=np.int16)
+        known = ids < len(codes)
+        types[known] = codes[ids[known]]
+        return names, types
+
+    def _misses(self, ids):
+        return bool(len(ids)) and (ids.max() >= len(self.codes) or (self.codes[ids] == UNKNOWN).any())
+
+
+def describe(values, percentiles, histogram):
+    if not len(values):
+        return {"readings": 0, "mean": None, "min": None, "max": None,
+                "percentiles": {f"p{q:g}": None for q in percentiles}, "histogram": histogram.tolist()}
+    return {"readings": int(len(values)), "mean": float(values.mean()), "min": float(values.min()),
+            "max": float(values.max()),
+            "percentiles": dict(zip((f"p{q:g}" for q in percentiles), np.percentile(values, percentiles).tolist())),
+            "histogram": histogram.tolist()}
+
+
+def fleet_summary(ids, values, names, codes, percentiles=(50, 90, 99), bins=20):
+    """Statistics of the whole fleet and of each sensor type, with histograms sharing the same bins."""
+    low, high = (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+    high = high if high > low else low + 1.0
+    edges = np.linspace(low, high, bins + 1)
+    # Equal width bins: the bin of a reading is arithmetic, and one bincount over (type, bin) pairs
+    # gives the histogram of every type at once. Codes are shifted by one so UNKNOWN is row 0
+    slots = np.minimum(((values - low) * (bins / (high - low))).astype(np.int64), bins - 1)
+    groups = codes.astype(np.int64) + 1
+    histograms = np.bincount(groups * bins + slots, minlength=(len(names) + 1) * bins).reshape(-1, bins)
+    # A sensor has one type: the type of each sensor seen, then the sensors of each type
+    sensor_groups = np.zeros(int(ids.max()) + 1 if len(ids) else 0, dtype=np.int64)
+    sensor_groups[ids] = groups
+    seen = np.bincount(ids, minlength=len(sensor_groups)) > 0 if len(ids) else np.zeros(0, dtype=bool)
+    sensors = np.bincount(sensor_groups[seen], minlength=len(names) + 1)
+
+    summary = {**describe(values, percentiles, histograms.sum(axis=0)), "sensors": int(seen.sum()),
+               "edges": edges.tolist(), "types": []}
+    # Sorted by type, the readings of each type are one slice
+    order = np.argsort(groups, kind="stable")
+    counts = np.bincount(groups, minlength=len(names) + 1)
+    ends = np.cumsum(counts)
+    for group in np.flatnonzero(counts):
+        selected = values[order[ends[group] - counts[group]:ends[group]]]
+        summary["types"].append({"type": names[group - 1] if group else None, "sensors": int(sensors[group]),
+                                 **describe(selected, percentiles, histograms[group])})
+    return summary
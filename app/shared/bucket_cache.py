@@ -0,0 +1,177 @@
+"""Cache of the rows of closed buckets of ``GET /sensors/{id}/data?bucket=``.
+
+Once a bucket has closed its average and minimum never change, unless a late reading lands in
+it. The rows of the closed buckets a request covers whole are kept in Redis, in one hash per
+sensor and bucket size with one field per bucket start, with no expiry; a bucket without
+readings is kept too, as an empty value, so sparse sensors hit as well. A request reads the
+fields of its closed buckets in one HMGET and only asks Timescale for the rest: the partial
+buckets at its edges, the open bucket, and the closed buckets missing from the cache.
+
+A bucket is cached only ``grace`` seconds after it closed, so readings still on their way are
+in Timescale first. A reading older than the open hour may change closed buckets: once it is
+in Timescale the fields of its buckets, for every size, are deleted (see ``late_fields``).
+
+Every field carries its expiry and is a miss past it, so a bucket stays stale at most ``ttl``
+seconds: when the deletion failed, or when a request stored rows it read from Timescale just
+before a late reading landed and was forgotten. The cache is an optimisation, Redis errors are
+counted and the request falls back to Timescale; a failed deletion never fails the write.
+"""
+import logging
+from datetime import timedelta, timezone
+
+import orjson
+
+from app.shared import metrics
+from app.shared.buckets import next_bucket, parse_time, time_bucket
+
+BUCKETS = ("hour", "day", "week", "month", "year")
+KEY_PREFIX = "buckets:"
+TTL = 3600.0
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = metrics.REGISTRY.counter("bucket_cache_buckets_total",
+                                    "Closed buckets of /data requests, served from the cache (hit) or from Timescale (miss)",
+                                    ("bucket", "result"))
+INVALIDATIONS = metrics.REGISTRY.counter("bucket_cache_invalidations_total",
+                                         "Cached buckets dropped because a late reading changed them", ("bucket",))
+ERRORS = metrics.REGISTRY.counter("bucket_cache_errors_total", "Redis errors of the bucket cache, by operation",
+                                  ("operation",))
+
+
+def key(sensor_id, bucket):
+    return f"{KEY_PREFIX}{sensor_id}:{bucket}"
+
+
+def field(start):
+    return str(int(start.timestamp()))
+
+
+def closed_buckets(bucket, from_time, to_time, now, grace=60.0, limit=10000):
+    """Starts of the buckets closed for ``grace`` seconds and whole within ``[from_time, to_time]``, at most ``limit``."""
+    first = time_bucket(bucket, from_time)
+    if first < from_time:
+        first = next_bucket(bucket, first)
+    # to_time is inclusive, the bucket ending right after it is whole
+    end = min(to_time + timedelta(microseconds=1) if to_time else now, now - timedelta(seconds=grace))
+    starts = []
+    while first < end and next_bucket(bucket, first) <= end and len(starts) < limit:
+        starts.append(first)
+        first = next_bucket(bucket, first)
+    return starts
+
+
+def encode(row, expires):
+    # The expiry goes first, a bucket without readings has nothing after it
+    return orjson.dumps([expires, *(row[2:] if row is not None else ())])
+
+
+def decode(sensor_id, start, value, now):
+    """``(fresh, row)`` of a cached field, the row is None for a bucket without readings."""
+    if not value:
+        return False, None
+    expires, *values = orjson.loads(value)
+    if expires <= now.timestamp():
+        return False, None
+    return True, (sensor_id, start, *values) if values else None
+
+
+def failed(operation, error):
+    ERRORS.inc(operation)
+    logger.warning("Bucket cache %s failed: %r", operation, error)
+
+
+def hit_ratio(bucket=None):
+    buckets = [bucket] if bucket else BUCKETS
+    hits = sum(REQUESTS.value(name, "hit") for name in buckets)
+    misses = sum(REQUESTS.value(name, "miss") for name in buckets)
+    return hits / (hits + misses) if hits + misses else None
+
+
+def get_buckets(redis, fetch, sensor_id, bucket, from_data, to_data, now, grace=60.0, limit=10000, ttl=TTL):
+    """The rows of ``fetch(from, to)`` (a ``Timescale.get_buckets`` of the sensor and bucket) for the range,
+    with the closed buckets it covers whole read from the cache and the ones missing stored into it."""
+    from_time = parse_time(from_data) if from_data else None
+    to_time = parse_time(to_data) if to_data else None
+    # Without a start the range has no first bucket to enumerate from
+    starts = closed_buckets(bucket, from_time, to_time, now, grace, limit) if from_time else []
+    if not starts:
+        return fetch(from_data, to_data)
+
+    try:
+        values = redis.get_fields(key(sensor_id, bucket), [field(start) for start in starts])
+    except Exception as e:
+        failed("get", e)
+        return fetch(from_data, to_data)
+    cached, missing = {}, []
+    for start, value in zip(starts, values):
+        fresh, row = decode(sensor_id, start, value, now)
+        if fresh:
+            cached[start] = row
+        else:
+            missing.append(start)
+    REQUESTS.inc(bucket, "hit", amount=len(starts) - len(missing))
+    REQUESTS.inc(bucket, "miss", amount=len(missing))
+
+    # Timescale for the partial bucket before the first closed one, the missing closed buckets and
+    # what follows the last one, adjacent pieces asked together
+    last_end = next_bucket(bucket, starts[-1])
+    pieces = []
+    if from_time < starts[0]:
+        pieces.append([from_time, starts[0]])
+    if missing:
+        pieces.append([missing[0], next_bucket(bucket, missing[-1])])
+    if to_time is None or to_time >= last_end:
+        pieces.append([last_end, to_time])
+    merged = []
+    for piece in pieces:
+        if merged and merged[-1][1] == piece[0]:
+            merged[-1][1] = piece[1]
+        else:
+            merged.append(piece)
+
+    rows = {}
+    for start, end in merged:
+        # A piece ending at a bucket start stops just before it, to_time is inclusive
+        end = (end - timedelta(microseconds=1)).isoformat() if end is not None and end != to_time else to_data
+        for row in fetch(start.isoformat(), end):
+            rows[parse_time(row[1]).astimezone(timezone.utc)] = row
+    if missing:
+        expires = now.timestamp() + ttl
+        try:
+            redis.set_fields(key(sensor_id, bucket), {field(start): encode(rows.get(start), expires) for start in missing},
+                             ttl=int(ttl))
+        except Exception as e:
+            failed("set", e)
+    for start, row in cached.items():
+        if row is not None:
+            rows[start] = row
+    return [rows[start] for start in sorted(rows)]
+
+
+def late_fields(readings, now, grace=60.0):
+    """``{hash key: [fields]}`` of the cached buckets the ``(sensor_id, data)`` readings may change."""
+    # A reading of the open hour is in open buckets of every size, none of them cached
+    fields = {}
+    for sensor_id, data in readings:
+        last_seen = parse_time(data.last_seen)
+        if last_seen >= time_bucket("hour", now - timedelta(seconds=grace)):
+            continue
+        for bucket in BUCKETS:
+            fields.setdefault(key(sensor_id, bucket), set()).add(field(time_bucket(bucket, last_seen)))
+    return {bucket_key: sorted(values) for bucket_key, values in fields.items()}
+
+
+def forget(redis, readings, now, grace=60.0):
+    """Drop the cached buckets changed by late readings, without a round trip when there is none."""
+    fields = late_fields(readings, now, grace)
+    if fields:
+        # The readings are written already, a failure only leaves the buckets stale until they expire
+        try:
+            redis.delete_fields(fields)
+        except Exception as e:
+            failed("delete", e)
+            return {}
+        for bucket_key in fields:
+            INVALIDATIONS.inc(bucket_key.rsplit(":", 1)[1])
+    return fields
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+# time_bucket aligns weeks on Monday 2000-01-03
+WEEK_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return parse_time(datetime.fromisoformat(value))
+
+
+def time_bucket(bucket, moment):
+    """Start of the one ``bucket`` (hour, day, week, month or year) long bucket containing ``moment``, like Timescale's."""
+    moment = moment.astimezone(timezone.utc)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        return WEEK_ORIGIN + timedelta(weeks=(moment - WEEK_ORIGIN) // timedelta(weeks=1))
+    if bucket == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "year":
+        return moment.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Invalid bucket {bucket}")
+
+
+def next_bucket(bucket, start):
+    """Start of the bucket following the one starting at ``start``."""
+    if bucket == "hour":
+        return start + timedelta(hours=1)
+    if bucket == "day":
+        return start + timedelta(days=1)
+    if bucket == "week":
+        return start + timedelta(weeks=1)
+    if bucket == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def step_fill(rows, bucket, end, limit=10000):
+    """``Timescale.get_buckets`` rows with the empty buckets between them, and up to the one containing
+    ``end``, filled with the values of the previous row: the step interpolation of a series whose
+    unchanged readings were not written."""
+    filled = []
+    for row in rows:
+        start = parse_time(row[1])
+        while filled and next_bucket(bucket, filled[-1][1]) < start and len(filled) < limit:
+            filled.append((row[0], next_bucket(bucket, filled[-1][1]), *filled[-1][2:]))
+        filled.append((row[0], start, *row[2:]))
+    last = time_bucket(bucket, end)
+    while filled and filled[-1][1] < last and len(filled) < limit:
+        filled.append((filled[-1][0], next_bucket(bucket, filled[-1][1]), *filled[-1][2:]))
+    return filled
@@ -0,0 +1,114 @@
+"""Deadband suppression of the readings of slowly changing fields, in the consumer.
+
+A rule gives a field the change below which a new value is not worth writing: ``absolute``
+(in the field's unit) or ``relative`` (a fraction of the last written value), the larger one
+wins. A reading is not written at all, to Timescale, Cassandra or Redis, when it carries the
+same fields as the last reading written for its sensor, every one of them has a rule and is
+within it of the last written value, and less than ``heartbeat`` seconds of sensor time
+separate the two. Comparing with the last written value, not the last received one, keeps a
+slow drift from going unnoticed.
+
+The stored series is then the step interpolation of the readings: the value of a field at any
+time is the last written value before it, off by less than the deadband, and there is a
+written reading at least every ``heartbeat`` seconds. ``fill=step`` on ``GET /sensors/{id}/data``
+carries the last bucket forward through buckets left without readings.
+
+A reading that is written can still leave alone the stores that keep a single value per field:
+Cassandra's battery table is only updated when the sensor's battery level is out of the rule of
+the level that table holds (or older than ``heartbeat``), whatever the other fields did. Redis
+keeps the whole latest reading of a sensor as one value, it is written with every reading.
+
+The last written readings are kept in memory, by consumer: with several consumers it is only
+exact when the readings of a sensor always go to the same one.
+"""
+from app.shared.buckets import parse_time
+
+FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+
+
+class Rule:
+    def __init__(self, absolute=0.0, relative=0.0):
+        self.absolute = absolute
+        self.relative = relative
+
+    def within(self, previous, value):
+        return abs(value - previous) <= max(self.absolute, self.relative * abs(previous))
+
+
+def parse_rules(config):
+    """``{field: Rule}`` from ``{field: {"absolute": x, "relative": y}}``, as set in DEADBAND."""
+    rules = {}
+    for field, rule in (config or {}).items():
+        if field not in FIELDS:
+            raise ValueError(f"Unknown deadband field {field}, expected one of {', '.join(FIELDS)}")
+        unknown = set(rule) - {"absolute", "relative"}
+        if unknown:
+            raise ValueError(f"Unknown deadband rule {', '.join(sorted(unknown))} for {field}")
+        rules[field] = Rule(float(rule.get("absolute", 0.0)), float(rule.get("relative", 0.0)))
+    return rules
+
+
+class Deadband:
+    def __init__(self, rules, heartbeat=300.0):
+        self.rules = rules
+        self.heartbeat = heartbeat
+        # sensor_id -> (last_seen, {field: value}) of the last reading written
+        self.written = {}
+        # (field, sensor_id) -> (last_seen, value) held by the store keeping the latest value of the field
+        self.held = {}
+        self.readings = 0
+        self.suppressed = 0
+        self.fields_suppressed = 0
+
+    def admit(self, sensor_id, data, staged):
+        """Whether the reading has to be written. When it does it is staged, in the ``staged`` dict of its
+        batch, as the sensor's last written reading: ``commit`` it once the batch is written."""
+        self.readings += 1
+        last_seen = parse_time(data.last_seen)
+        values = {field: value for field in FIELDS if (value := getattr(data, field)) is not None}
+        # An earlier reading of the same batch counts as written, it is written with this one
+        previous = staged.get(sensor_id) or self.written.get(sensor_id)
+        if previous is not None:
+            previous_seen, previous_values = previous
+            # A late reading is history the step interpolation does not know about yet
+            if last_seen < previous_seen:
+                return True
+            if (last_seen - previous_seen).total_seconds() < self.heartbeat and values.keys() == previous_values.keys() \
+                    and all(field in self.rules and self.rules[field].within(previous_values[field], value)
+                            for field, value in values.items()):
+                self.suppressed += 1
+                return False
+        staged[sensor_id] = (last_seen, values)
+        return True
+
+    def commit(self, staged, failed=()):
+        """The staged readings were written, except those of the ``failed`` sensors: their retries
+        are still on their way, the next readings are compared with what the stores already have."""
+        for sensor_id, written in staged.items():
+            if sensor_id not in failed:
+                self.written[sensor_id] = written
+
+    def changed(self, field, readings):
+        """The ``(sensor_id, data)`` readings whose ``field`` has to be written to the store keeping its
+        latest value, the others are within the field's rule of the value it holds. ``hold`` the ones
+        written once the store has them."""
+        rule = self.rules.get(field)
+        changed = []
+        for sensor_id, data in readings:
+            held = self.held.get((field, sensor_id))
+            value = getattr(data, field)
+            if rule is not None and held is not None and value is not None:
+                held_seen, held_value = held
+                since = (parse_time(data.last_seen) - held_seen).total_seconds()
+                if 0 <= since < self.heartbeat and rule.within(held_value, value):
+                    self.fields_suppressed += 1
+                    continue
+            changed.append((sensor_id, data))
+        return changed
+
+    def hold(self, field, readings):
+        for sensor_id, data in readings:
+            self.held[(field, sensor_id)] = (parse_time(data.last_seen), getattr(data, field))
+
+    def ratio(self):
+        return self.suppressed / self.readings if self.readings else 0.0
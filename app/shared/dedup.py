@@ -0,0 +1,83 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DedupWindow:
+    """Bounded window of recently written message ids.
+
+    Ids are kept in an in-process LRU and mirrored in Redis (SET NX with a TTL) so that a restarted
+    consumer, or another consumer of the same queue, also recognises a redelivered message.
+    An id is only remembered once its message was fully written, so a crash half way through a
+    write still gets the message redelivered and retried.
+
+    Redis is only an optimisation here: when it fails the window falls back to the local LRU and
+    counts the error, a redelivery is then written again, which every store tolerates.
+    """
+
+    def __init__(self, redis=None, capacity=100000, ttl=24 * 60 * 60, prefix="dedup:"):
+        self.redis = redis
+        self.capacity = capacity
+        self.ttl = ttl
+        self.prefix = prefix
+        self._seen = OrderedDict()
+        self.hits = 0
+        self.errors = 0
+
+    def seen(self, message_id):
+        if message_id in self._seen:
+            self._seen.move_to_end(message_id)
+            self.hits += 1
+            return True
+        if self.redis is not None and self._redis_call("exists", self.redis.exists, self.prefix + message_id):
+            self._remember_locally(message_id)
+            self.hits += 1
+            return True
+        return False
+
+    def seen_many(self, message_ids):
+        """The subset of ``message_ids`` already written, checking Redis once for the whole batch."""
+        found = set()
+        unknown = []
+        for message_id in message_ids:
+            if message_id in self._seen:
+                self._seen.move_to_end(message_id)
+                found.add(message_id)
+            else:
+                unknown.append(message_id)
+        if self.redis is not None and unknown:
+            # Unseen when Redis cannot tell
+            exists_many = self._redis_call("exists_many", self.redis.exists_many, [self.prefix + i for i in unknown]) or ()
+            for message_id, exists in zip(unknown, exists_many):
+                if exists:
+                    self._remember_locally(message_id)
+                    found.add(message_id)
+        self.hits += len(found)
+        return found
+
+    def remember(self, message_id):
+        self._remember_locally(message_id)
+        if self.redis is not None:
+            self._redis_call("set_if_absent", self.redis.set_if_absent, self.prefix + message_id, 1, ttl=self.ttl)
+
+    def remember_many(self, message_ids):
+        for message_id in message_ids:
+            self._remember_locally(message_id)
+        if self.redis is not None and message_ids:
+            self._redis_call("set_many_if_absent", self.redis.set_many_if_absent, [self.prefix + i for i in message_ids],
+                             1, ttl=self.ttl)
+
+    def _redis_call(self, name, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Dedup window %s failed, falling back to the local window: %r", name, e)
+            return None
+
+    def _remember_locally(self, message_id):
+        self._seen[message_id] = True
+        self._seen.move_to_end(message_id)
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
@@ -0,0 +1,125 @@
+"""Downsampling of time series rows for charts, with NumPy.
+
+Rows are ``(id, time, velocity, temperature, humidity, battery_level)``: raw ``sensor_data``
+rows and ``Timescale.get_buckets`` rows share that layout. They are streamed into a
+``ColumnBuffer``, one float64 array per column, and reduced to at most ``max_points`` rows
+chosen on one field:
+
+* ``lttb`` (Largest Triangle Three Buckets) keeps the points that preserve the visual shape.
+* ``minmax`` keeps the lowest and highest point of each of ``max_points / 2`` time slices, one
+  slice per pixel column of the chart, so no peak is lost.
+
+The chosen rows are returned whole, with every field, in time order.
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+
+FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+METHODS = ("lttb", "minmax")
+
+
+class ColumnBuffer:
+    """Growable column arrays, filled chunk by chunk from a stream of rows that is not kept."""
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.time = np.empty(capacity)
+        self.fields = {field: np.empty(capacity) for field in FIELDS}
+        self.sensor_id = None
+
+    def _reserve(self, size):
+        capacity = len(self.time)
+        while capacity < size:
+            capacity *= 2
+        if capacity != len(self.time):
+            self.time = np.resize(self.time, capacity)
+            self.fields = {field: np.resize(values, capacity) for field, values in self.fields.items()}
+
+    def extend(self, rows):
+        """Append a chunk of rows, converted column by column (None becomes NaN)."""
+        rows = list(rows)
+        if not rows:
+            return self
+        self._reserve(self.size + len(rows))
+        end = self.size + len(rows)
+        self.sensor_id = rows[-1][0]
+        self.time[self.size:end] = [moment.timestamp() if isinstance(moment, datetime) else moment for _, moment, *_ in rows]
+        for column, field in enumerate(FIELDS, start=2):
+            self.fields[field][self.size:end] = np.array([row[column] for row in rows], dtype=float)
+        self.size = end
+        return self
+
+    def column(self, name):
+        return self.time[:self.size] if name == "time" else self.fields[name][:self.size]
+
+    def default_field(self):
+        # The first field the sensor reports, velocity and temperature sensors fill different ones
+        for field in FIELDS:
+            if not np.isnan(self.column(field)).all():
+                return field
+        return FIELDS[0]
+
+    def rows(self, indices):
+        times = self.column("time")[indices]
+        columns = [self.column(field)[indices] for field in FIELDS]
+        return [(self.sensor_id, datetime.fromtimestamp(moment, timezone.utc),
+                 *(None if np.isnan(values[i]) else float(values[i]) for values in columns))
+                for i, moment in enumerate(times)]
+
+
+def lttb_indices(x, y, n):
+    """Indices of the ``n`` points LTTB keeps, the first and last included."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1])[:n]
+    # Every point but the first and the last falls in one of n - 2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    selected = np.empty(n, dtype=int)
+    selected[0], selected[-1] = 0, size - 1
+    previous = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        # The third vertex is the average of the next bucket (the last point for the last bucket)
+        if i + 2 < n - 1:
+            next_x, next_y = x[edges[i + 1]:edges[i + 2]].mean(), y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Twice the area of the triangle each candidate makes with the previous point and the next average
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+
+def minmax_indices(x, y, n):
+    """Indices of the lowest and highest point of each of ``n // 2`` equal time slices, in time order."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    slices = max(n // 2, 1)
+    span = x[-1] - x[0]
+    slice_of = np.minimum(((x - x[0]) / span * slices).astype(int), slices - 1) if span else np.zeros(size, dtype=int)
+    # Sorted by slice then value: the first point of a slice is its minimum, the last its maximum
+    order = np.lexsort((y, slice_of))
+    boundaries = np.flatnonzero(np.diff(slice_of[order])) + 1
+    firsts = order[np.concatenate(([0], boundaries))]
+    lasts = order[np.concatenate((boundaries - 1, [size - 1]))]
+    return np.unique(np.concatenate((firsts, lasts)))
+
+
+def downsample(buffer, max_points, method="lttb", field=None):
+    """At most ``max_points`` rows of ``buffer`` chosen on ``field`` (by default the first one with values)."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method {method}, expected one of {', '.join(METHODS)}")
+    field = field or buffer.default_field()
+    x, y = buffer.column("time"), buffer.column(field)
+    # Rows without the field can not be placed on its chart
+    present = np.flatnonzero(~np.isnan(y))
+    if len(present) <= max_points:
+        return buffer.rows(present)
+    choose = lttb_indices if method == "lttb" else minmax_indices
+    return buffer.rows(present[choose(x[present], y[present], max_points)])
@@ -0,0 +1,32 @@
+import zlib
+
+import orjson
+
+# Several readings sent as a single AMQP message: a JSON array of the individual message bodies
+BATCH_CONTENT_TYPE = "application/x-sensor-batch+json"
+COMPRESSIONS = {"": None, "zlib": "deflate"}
+
+
+def encode(bodies, compression=""):
+    """Pack message bodies into one payload, returns (payload, content_type, content_encoding).
+
+    A single body is sent as is, so consumers that do not know about envelopes keep working
+    while batching is disabled.
+    """
+    if len(bodies) == 1 and not compression:
+        body = bodies[0]
+        return (body.encode() if isinstance(body, str) else body), None, None
+    # Bodies already are JSON documents, join them instead of parsing and dumping them again
+    payload = b"[" + b",".join(body.encode() if isinstance(body, str) else body for body in bodies) + b"]"
+    if compression == "zlib":
+        payload = zlib.compress(payload, 1)
+    return payload, BATCH_CONTENT_TYPE, COMPRESSIONS[compression]
+
+
+def decode(payload, content_type=None, content_encoding=None):
+    """Unpack a payload received from the broker into the list of (parsed) messages it carries."""
+    if content_type != BATCH_CONTENT_TYPE:
+        return [orjson.loads(payload)]
+    if content_encoding == "deflate":
+        payload = zlib.decompress(payload)
+    return orjson.loads(payload)
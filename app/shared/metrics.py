@@ -0,0 +1,463 @@
+"""Minimal Prometheus instrumentation: counters, histograms and callback gauges.
+
+Metrics live in the process wide ``REGISTRY`` and are rendered in the Prometheus text format
+by ``render``. Recording a value is a dict lookup, a bisect and an addition under a lock, so
+wrapping every database call costs well under a microsecond next to the call itself. With
+several API workers, ``MultiProcess`` adds up the metrics of all of them.
+"""
+import bisect
+import functools
+import glob
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from half a millisecond (a Redis GET on localhost) to ten seconds (a stuck query)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Methods of the clients that do not talk to their server
+NOT_TIMED = ("close", "getCursor", "get_session", "getDatabase", "getCollection")
+# Counters and histograms of the workers that exited, in a MultiProcess directory
+ARCHIVE = "archive.json"
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {"type": "counter", "values": [[list(labels), value] for labels, value in self._values.items()]}
+
+    def load(self, values):
+        self._values = {tuple(labels): value for labels, value in values}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def snapshot(self):
+        with self._lock:
+            return {"type": "histogram",
+                    "values": [[list(labels), list(counts), total] for labels, (counts, total) in self._values.items()]}
+
+    def load(self, values):
+        self._values = {tuple(labels): [list(counts), total] for labels, counts, total in values}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauges:
+    """Gauges read from a callback at scrape time, for state that is already tracked elsewhere.
+
+    The callback returns ``(name, help, value)`` or ``(name, help, value, {label: value})`` tuples.
+    """
+
+    def __init__(self, collect):
+        self.collect = collect
+
+    def snapshot(self):
+        return {"type": "gauges", "values": [[name, help, float(value), labels[0] if labels else {}]
+                                             for name, help, value, *labels in self.collect() if value is not None]}
+
+    def render(self):
+        lines = []
+        described = set()
+        for name, help, value, *labels in self.collect():
+            if value is None:
+                continue
+            if name not in described:
+                described.add(name)
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            labels = labels[0] if labels else {}
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {float(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, metric):
+        # Registering the same name twice returns the first metric, so modules can be reloaded
+        with self._lock:
+            return self._metrics.setdefault(name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(name, Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(name, Histogram(name, help, labels, buckets))
+
+    def gauges(self, name, collect):
+        return self.register(name, Gauges(collect))
+
+    def render(self):
+        lines = []
+        for name, metric in list(self._metrics.items()):
+            try:
+                lines += metric.render()
+            except Exception as e:
+                # A broken collector must not hide the other metrics
+                lines.append(f"# {name} failed: {e!r}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        snapshot = {}
+        for name, metric in list(self._metrics.items()):
+            try:
+                snapshot[name] = metric.snapshot()
+            except Exception as e:
+                logger.warning("Could not collect %s: %r", name, e)
+        return snapshot
+
+    def merged(self, snapshots):
+        """The text format of the sum of ``{pid: snapshot}`` of several processes with the metrics of this one.
+
+        Counters and histograms are added up. Gauges are per process, labelled with its pid.
+        """
+        totals = {}
+        for snapshot in snapshots.values():
+            _add(totals, snapshot)
+        registry = Registry()
+        for name, metric in list(self._metrics.items()):
+            if isinstance(metric, Gauges):
+                rows = [(gauge, help, value, {**labels, "worker": pid})
+                        for pid, snapshot in sorted(snapshots.items()) if name in snapshot
+                        for gauge, help, value, labels in snapshot[name]["values"]]
+                registry.gauges(name, lambda rows=rows: rows)
+                continue
+            total = Histogram(metric.name, metric.help, metric.labels, metric.buckets) if isinstance(metric, Histogram) \
+                else Counter(metric.name, metric.help, metric.labels)
+            total.load(totals.get(name, {}).get("values", []))
+            registry.register(name, total)
+        return registry.render()
+
+
+def _add(totals, snapshot):
+    # Adds the counters and histograms of a snapshot to totals, a snapshot too
+    for name, metric in snapshot.items():
+        if metric["type"] == "gauges":
+            continue
+        entry = totals.setdefault(name, {"type": metric["type"], "values": []})
+        index = {tuple(value[0]): value for value in entry["values"]}
+        for value in metric["values"]:
+            current = index.get(tuple(value[0]))
+            if current is None:
+                value = [list(part) if isinstance(part, list) else part for part in value]
+                entry["values"].append(value)
+                index[tuple(value[0])] = value
+            elif metric["type"] == "counter":
+                current[1] += value[1]
+            else:
+                current[1] = [a + b for a, b in zip(current[1], value[1])]
+                current[2] += value[2]
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, document):
+    # Written aside and renamed, so that readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(document, f)
+    os.replace(temporary, path)
+
+
+class MultiProcess:
+    """The metrics of every worker process of the API, shared through files in ``directory``.
+
+    Each process writes a snapshot of its registry, and of its ``status()``, to ``<pid>.json``
+    every ``interval`` seconds and whenever it renders. Whichever worker answers a scrape then
+    renders the counters and histograms of the whole API, so they never go back and forth
+    between workers. ``mark_process_dead`` keeps the counters of a worker that exited, in
+    ``archive.json``. The directory must be emptied before the workers start (``clear``).
+    """
+
+    def __init__(self, directory, registry=None, interval=1.0, status=None):
+        self.directory = directory
+        self.registry = registry or REGISTRY
+        self.interval = interval
+        self.status = status
+        self.path = os.path.join(directory, f"{os.getpid()}.json")
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.write()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshots", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                logger.warning("Could not write the metrics snapshot: %r", e)
+
+    def write(self):
+        _write(self.path, {"metrics": self.registry.snapshot(), "status": self.status() if self.status else None})
+
+    def processes(self):
+        """``{pid: snapshot document}`` of the live workers."""
+        documents = {}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            name = os.path.basename(path)[:-len(".json")]
+            if name.isdigit() and (document := _read(path)) is not None:
+                documents[int(name)] = document
+        return documents
+
+    def render(self):
+        self.write()
+        snapshots = {pid: document["metrics"] for pid, document in self.processes().items()}
+        archive = _read(os.path.join(self.directory, ARCHIVE))
+        if archive is not None:
+            # Pid 0 is not a live worker, and an archive holds no gauges
+            snapshots[0] = archive
+        return self.registry.merged(snapshots)
+
+    def statuses(self):
+        self.write()
+        return {pid: document["status"] for pid, document in sorted(self.processes().items())}
+
+
+def clear(directory):
+    """Empties a MultiProcess directory, before the workers of a new server start."""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def mark_process_dead(directory, pid):
+    """Moves the counters and histograms of a worker that exited to the archive, and drops its gauges."""
+    path = os.path.join(directory, f"{pid}.json")
+    document = _read(path)
+    if document is None:
+        return
+    archive = _read(os.path.join(directory, ARCHIVE)) or {}
+    _add(archive, document["metrics"])
+    _write(os.path.join(directory, ARCHIVE), archive)
+    os.remove(path)
+
+
+REGISTRY = Registry()
+STORE_LATENCY = REGISTRY.histogram("store_request_duration_seconds", "Duration of the calls to each store",
+                                   ("store", "operation"))
+STORE_ERRORS = REGISTRY.counter("store_request_errors_total", "Calls to each store that raised", ("store", "operation"))
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "Duration of the HTTP requests by route",
+                                  ("method", "route", "status"))
+# Returned by a finished stream
+_END = object()
+# Whether the current thread is inside a timed call
+_timing = threading.local()
+
+
+def render():
+    return REGISTRY.render()
+
+
+def timed(store, operation):
+    """Decorator recording the duration of each call, and the calls that raised, under store and operation.
+
+    Calls made from within another timed call (``add_temperature`` running ``execute``) are not
+    recorded again, so the time of a store is not counted twice. A generator (a streamed query) is
+    timed chunk by chunk: what the caller does between two chunks is not the store's time.
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def stream(*args, **kwargs):
+                chunks = function(*args, **kwargs)
+                step = timed(store, operation)(lambda: next(chunks, _END))
+                while (chunk := step()) is not _END:
+                    yield chunk
+            return stream
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_timing, "active", False):
+                return function(*args, **kwargs)
+            _timing.active = True
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                STORE_ERRORS.inc(store, operation)
+                raise
+            finally:
+                STORE_LATENCY.observe(time.perf_counter() - start, store, operation)
+                _timing.active = False
+        return wrapper
+    return decorator
+
+
+def instrumented(store, exclude=NOT_TIMED):
+    """Class decorator timing every public method the class defines, labelled with its name."""
+    def decorator(cls):
+        for name, attribute in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not callable(attribute):
+                continue
+            setattr(cls, name, timed(store, name)(attribute))
+        return cls
+    return decorator
+
+
+def instrument_engine(engine, store="postgres"):
+    """Time the statements of a SQLAlchemy engine, labelled with their verb (SELECT, INSERT...)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["metrics_start"].pop()
+        STORE_LATENCY.observe(time.perf_counter() - start, store, statement.split(None, 1)[0].lower())
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        starts = context.connection.info.get("metrics_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        verb = context.statement.split(None, 1)[0].lower() if context.statement else "unknown"
+        STORE_ERRORS.inc(store, verb)
+
+
+# Application -> {endpoint: route template}
+_routes = {}
+
+
+def route_template(scope):
+    """Template of the route that handled a request, once the router has run, or "unmatched"."""
+    app = scope["app"]
+    if app not in _routes:
+        _routes[app] = {route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")}
+    return _routes[app].get(scope.get("endpoint"), "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the duration of every request by method, route template and status.
+
+    Routes are labelled with their template (``/sensors/{sensor_id}/data``) so that the number of
+    series does not grow with the number of sensors.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], route_template(scope), status[0])
+
+
+def serve(port, host="0.0.0.0"):
+    """Serve ``/metrics`` from a background thread, for processes without an HTTP API (the consumer)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,246 @@
+"""On-demand profiling of the API and consumer processes.
+
+* ``SamplingProfiler`` looks at the stack of every thread at a fixed interval, from a thread of
+  its own, so it sees the request threads and costs nothing while it is not running. Its output
+  is collapsed stacks (``flamegraph.pl``, speedscope) or the hottest functions.
+* ``CProfileSession`` is the deterministic profiler, which only sees the thread that started it.
+* ``BackgroundSampler`` samples at a low rate all the time and logs the hottest functions.
+* ``AllocationTracker`` measures the memory each request allocates with tracemalloc.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Leaf functions of threads that are waiting rather than working, left out of the hot functions
+IDLE_FUNCTIONS = {"wait", "select", "poll", "epoll", "acquire", "sleep", "_wait_for_tstate_lock", "accept",
+                  "recv", "recv_into", "readinto", "get", "run_forever", "_run_once", "serve_forever"}
+
+
+def _function(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Statistical profiler: counts the stacks of every other thread every ``interval`` seconds."""
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def reset(self):
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_function(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, "thread"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """One ``thread;outer;...;inner count`` line per distinct stack, the input of flamegraph tools."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=20):
+        """The functions most often found running (at the top of a busy stack), with their share of the samples."""
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            if leaf.split(" ", 1)[0] not in IDLE_FUNCTIONS:
+                functions[leaf] += count
+        total = sum(functions.values())
+        return [(function, count, count / total) for function, count in functions.most_common(limit)]
+
+    def top_text(self, limit=20):
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms"]
+        lines += [f"{share:7.2%} {count:8} {function}" for function, count, share in self.top(limit)]
+        return "\n".join(lines) + "\n"
+
+
+class CProfileSession:
+    """cProfile of the calling thread, started and stopped from that same thread."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+        return self
+
+    def stop(self):
+        self.profile.disable()
+        return self
+
+    def text(self, sort="cumulative", limit=50):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self, path):
+        # Binary pstats file, for pstats, snakeviz or gprof2dot
+        self.profile.dump_stats(path)
+
+    def profile_bytes(self):
+        # The content dump() would write
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class BackgroundSampler:
+    """Always-on sampling at a low rate, logging the hottest functions every ``report_interval`` seconds."""
+
+    def __init__(self, interval=0.1, report_interval=60.0, limit=10):
+        self.profiler = SamplingProfiler(interval)
+        self.report_interval = report_interval
+        self.limit = limit
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="background-sampler", daemon=True)
+
+    def start(self):
+        self.profiler.start()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self.profiler.stop()
+
+    def _run(self):
+        while not self._stopping.wait(self.report_interval):
+            self.report()
+
+    def report(self):
+        profiler = self.profiler
+        if profiler.samples:
+            logger.info("Hot functions over the last %gs:\n%s", self.report_interval, profiler.top_text(self.limit))
+        profiler.reset()
+
+
+class AllocationTracker:
+    """Memory allocated by each request, measured with tracemalloc.
+
+    Two numbers per request: its peak (the most memory it had allocated at once, which is what
+    temporary objects such as a json round trip cost) and what it left allocated, by source line,
+    from snapshots taken before and after it. Only meant to be switched on while hunting
+    allocations: tracing slows every allocation down, and with concurrent requests the
+    allocations of one can show up in another.
+    """
+
+    def __init__(self, frames=5, limit=10, threshold=1024 * 1024):
+        self.limit = limit
+        self.threshold = threshold
+        # route -> number of requests, sum of their peaks, and Counter of retained bytes by source line
+        self.routes = {}
+        self._lock = threading.Lock()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def start(self):
+        snapshot = tracemalloc.take_snapshot()
+        # Measured after the snapshot, so that its own allocations do not count as the request's
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return snapshot, current
+
+    def record(self, route, started):
+        before, current = started
+        peak = tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+        retained = [stat for stat in after.compare_to(before, "lineno") if stat.size_diff > 0]
+        with self._lock:
+            entry = self.routes.setdefault(route, {"requests": 0, "peak_bytes": 0, "sites": Counter()})
+            entry["requests"] += 1
+            entry["peak_bytes"] += peak
+            for stat in retained[:self.limit]:
+                frame = stat.traceback[0]
+                entry["sites"][f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+        if peak >= self.threshold:
+            logger.warning("%s peaked at %d bytes allocated", route, peak)
+        return peak
+
+    def report(self, limit=10):
+        with self._lock:
+            return {route: {"requests": entry["requests"],
+                            "avg_peak_bytes": entry["peak_bytes"] / entry["requests"],
+                            "retained": [{"site": site, "bytes": size} for site, size in entry["sites"].most_common(limit)]}
+                    for route, entry in self.routes.items()}
+
+
+class SignalProfiler:
+    """Profile started by a signal handler and finished by ``poll``, for processes without an HTTP API.
+
+    Both run on the main thread, which is the thread cProfile sees. When the profile is over its
+    results are written to ``directory``: collapsed stacks and hot functions for ``sample``, binary
+    pstats and their text rendering for ``cprofile``.
+    """
+
+    def __init__(self, mode="sample", seconds=30.0, directory="/tmp", name="profile", interval=0.005):
+        self.mode = mode
+        self.seconds = seconds
+        self.directory = directory
+        self.name = name
+        self.interval = interval
+        self.profiler = None
+        self.deadline = None
+
+    def handle_signal(self, signum=None, frame=None):
+        if self.profiler is not None:
+            return
+        self.profiler = SamplingProfiler(self.interval) if self.mode == "sample" else CProfileSession()
+        self.deadline = time.monotonic() + self.seconds
+        self.profiler.start()
+        logger.info("Profiling (%s) for %gs", self.mode, self.seconds)
+
+    def poll(self):
+        if self.profiler is None or time.monotonic() < self.deadline:
+            return None
+        profiler, self.profiler = self.profiler.stop(), None
+        base = os.path.join(self.directory, f"{self.name}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}")
+        if isinstance(profiler, SamplingProfiler):
+            paths = {base + ".collapsed": profiler.collapsed(), base + ".top.txt": profiler.top_text()}
+        else:
+            profiler.dump(base + ".pstats")
+            paths = {base + ".txt": profiler.text()}
+        for path, content in paths.items():
+            with open(path, "w") as f:
+                f.write(content)
+        logger.info("Profile written to %s.*", base)
+        return base
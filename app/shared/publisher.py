@@ -1,33 +1,232 @@
-import pika
+import logging
+import queue
+import threading
 import time
 
+import pika
+
+from app.settings import get_settings
+from app.shared import envelope, metrics, tracing
+from app.shared.spool import Spool
+
+logger = logging.getLogger(__name__)
+
+# Durable like the retry and dead letter queues
 QUEUE_NAME = 'test'
 
 class Publisher:
+    """Publishes messages to RabbitMQ from a background thread.
+
+    ``publish`` never talks to the broker: it hands the message to an in-memory buffer and returns,
+    or raises ``queue.Full`` when the buffer and the overflow waiting for the spool are both full.
+    The publisher thread owns the (not thread-safe) pika connection. Whenever the broker is
+    unreachable, or the buffer is full, messages go to an on-disk spool that is replayed in order
+    once the broker is back, so broker hiccups show up neither as API latency nor as lost readings.
+
+    Readings are coalesced into envelopes of up to ``batch_size`` messages, waiting at most
+    ``batch_linger`` seconds for a batch to fill. A single thread sends them in arrival order,
+    so the order of the readings of each sensor is kept.
+    """
 
     channel = None
     conn = None
 
-    def __init__(self):
+    def __init__(self, host=None, port=None, spool=None, buffer_size=None, overflow_size=None, retry_interval=1.0,
+                 depth_check_interval=5.0, batch_size=None, batch_linger=None, compression=None,
+                 connection_factory=pika.BlockingConnection):
+        settings = get_settings()
         credentials = pika.PlainCredentials('guest', 'guest')
-        parameters = pika.ConnectionParameters('rabbitmq',
-                                       5672,
+        self.parameters = pika.ConnectionParameters(host or settings.rabbitmq_host,
+                                       port or settings.rabbitmq_port,
                                        '/',
-                                       credentials)
+                                       credentials,
+                                       socket_timeout=2,
+                                       blocked_connection_timeout=5)
+        self.spool = spool or Spool.claim(settings.spool_dir,
+                                          segment_bytes=settings.spool_segment_bytes,
+                                          fsync_every=settings.spool_fsync_every,
+                                          fsync_interval=settings.spool_fsync_interval)
+        self.connection_factory = connection_factory
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size or settings.publisher_batch_size
+        self.batch_linger = settings.publisher_batch_linger_ms / 1000 if batch_linger is None else batch_linger
+        self.compression = settings.publisher_compression if compression is None else compression
+        self.depth_check_interval = depth_check_interval
+        # Messages waiting in the broker queue, refreshed every depth_check_interval seconds
+        self.broker_depth = 0
+        self._last_depth_check = 0.0
+        self._buffer = queue.Queue(maxsize=buffer_size or settings.publisher_buffer_size)
+        # Readings that found the buffer full, and everything published after them until the publisher
+        # thread has moved them to the spool: they must not overtake the readings still buffered
+        self._overflow = []
+        self.overflow_size = overflow_size or settings.publisher_overflow_size
+        self._overflowing = False
+        self._overflow_lock = threading.Lock()
+        self._last_attempt = 0.0
+        self._stopping = threading.Event()
+        self._counters = {"published": 0, "spooled": 0, "publish_errors": 0, "connect_errors": 0, "batches": 0,
+                          "max_batch_size": 0}
+        self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self._thread.start()
+
+    @metrics.timed("rabbitmq", "publish")
+    def publish(self, message):
+        body = message.to_json()
+        with self._overflow_lock:
+            if not self._overflowing:
+                try:
+                    self._buffer.put_nowait(body)
+                    return
+                except queue.Full:
+                    # The publisher thread can not keep up: it spools the overflow once it is done with
+                    # the buffer, the caller does not wait for the disk
+                    self._overflowing = True
+            # The publisher thread is stuck (fsync, broker confirms): refuse rather than grow without bound
+            if len(self._overflow) >= self.overflow_size:
+                raise queue.Full
+            self._overflow.append(body)
+
+    def close(self):
+        self._stopping.set()
+        self._thread.join()
+        self.spool.close()
+        if self.conn is not None and self.conn.is_open:
+            self.conn.close()
+
+    def backlog(self):
+        # Readings accepted by the API that the consumers have not picked up yet
+        return self._buffer.qsize() + len(self._overflow) + self.spool.pending + self.broker_depth
+
+    def stats(self):
+        batches = self._counters["batches"]
+        return {"connected": self._connected(),
+                "buffered": self._buffer.qsize() + len(self._overflow),
+                "broker_depth": self.broker_depth,
+                **self._counters,
+                "avg_batch_size": self._counters["published"] / batches if batches else 0.0,
+                "spool": self.spool.stats()}
+
+    # Everything below runs on the publisher thread
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._buffer.empty() and not self._overflowing):
+            batch = self._next_batch()
+            if batch:
+                # While older readings wait in the spool, new ones queue up behind them to keep the order
+                if self.spool.pending or not self._ensure_connection() or not self._send(batch):
+                    self._spool(batch)
+            # The overflow came after everything in the buffer, it goes once the buffer is empty
+            if self._overflowing and self._buffer.empty():
+                self._spool_overflow()
+            if self.spool.pending and self._ensure_connection():
+                self._drain()
+            elif self._connected():
+                self._heartbeat()
+            if self._connected() and time.monotonic() - self._last_depth_check >= self.depth_check_interval:
+                self._check_depth()
+            self.spool.sync()
+
+    def _spool(self, bodies):
+        self._counters["spooled"] += len(bodies)
+        for body in bodies:
+            self.spool.append(body)
+
+    def _spool_overflow(self):
+        with self._overflow_lock:
+            bodies, self._overflow = self._overflow, []
+        self._spool(bodies)
+        with self._overflow_lock:
+            # Readings published meanwhile went to the overflow too, they are spooled on the next turn
+            if not self._overflow:
+                self._overflowing = False
+
+    def _next_batch(self):
+        try:
+            batch = [self._buffer.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take whatever is already buffered without waiting
+                batch.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _connected(self):
+        return self.conn is not None and self.conn.is_open and self.channel is not None and self.channel.is_open
+
+    def _ensure_connection(self):
+        if self._connected():
+            return True
+        # Do not hammer a broker that is down, and do not stall on connection attempts while stopping
+        if self._stopping.is_set() or time.monotonic() - self._last_attempt < self.retry_interval:
+            return False
+        self._last_attempt = time.monotonic()
         try:
-            self.conn = pika.BlockingConnection(parameters)
+            self.conn = self.connection_factory(self.parameters)
+            self.channel = self.conn.channel()
+            self.channel.queue_declare(queue=QUEUE_NAME, durable=True)
+            # Broker confirms make basic_publish fail loudly instead of losing the message
+            self.channel.confirm_delivery()
+            return True
         except Exception as e:
-            time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+            self._counters["connect_errors"] += 1
+            logger.warning("Broker unavailable, spooling readings: %r", e)
+            self._disconnect()
+            return False
 
-        self.channel = self.conn.channel()
-        self.channel.queue_declare(queue=QUEUE_NAME)
+    def _disconnect(self):
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+        self.channel = None
 
+    @metrics.timed("rabbitmq", "publish_batch")
+    def _send(self, batch):
+        payload, content_type, content_encoding = envelope.encode(batch, self.compression)
+        try:
+            self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=payload,
+                                       properties=pika.BasicProperties(content_type=content_type,
+                                                                       content_encoding=content_encoding,
+                                                                       delivery_mode=pika.DeliveryMode.Persistent,
+                                                                       headers={tracing.TRACE_HEADER: tracing.new_trace_id(),
+                                                                                tracing.PUBLISHED_AT_HEADER: time.time()}))
+            self._counters["published"] += len(batch)
+            self._counters["batches"] += 1
+            self._counters["max_batch_size"] = max(self._counters["max_batch_size"], len(batch))
+            return True
+        except Exception as e:
+            self._counters["publish_errors"] += 1
+            logger.warning("Publish of %d readings failed, spooling them: %r", len(batch), e)
+            self._disconnect()
+            return False
 
-    
-    def publish(self, message):
-        self.channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=message.to_json())
-        print(" [x] Sent %r" % message)
-    
-    def close(self):
-        self.conn.close()
+    def _heartbeat(self):
+        try:
+            self.conn.process_data_events(time_limit=0)
+        except Exception:
+            self._disconnect()
+
+    def _check_depth(self):
+        self._last_depth_check = time.monotonic()
+        try:
+            self.broker_depth = self.channel.queue_declare(queue=QUEUE_NAME, passive=True).method.message_count
+        except Exception:
+            self._disconnect()
+
+    def _drain(self):
+        # Replay the spool in order, committing only what the broker confirmed
+        while self.spool.pending:
+            records, position = self.spool.peek(self.batch_size)
+            if not records or not self._send(records):
+                return
+            self.spool.commit(position, len(records))
+            if not self._buffer.empty():
+                # Let the loop move fresh readings into the spool so they keep their place in line
+                return
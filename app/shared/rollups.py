@@ -0,0 +1,108 @@
+"""Running aggregates of the readings of every sensor, for the open hour and day buckets.
+
+The consumer adds each reading it writes to the aggregates (count, sum, min and max of every
+field) of the current hour and day buckets, and merges them into Redis hashes, one per sensor
+and bucket, every ``rollup_flush_interval`` seconds. ``GET /sensors/{id}/data`` answers the
+open buckets from them, so a live dashboard does not aggregate raw Timescale rows; the closed
+buckets still come from Timescale. Readings for buckets that are already closed are left to
+Timescale, and a reading counts once: redeliveries are dropped by the dedup window and retries
+are not counted again.
+
+A consumer only counts the readings it handles after it starts, and the aggregates it had not
+merged yet die with it. So every aggregator records the time it started counting under
+``SINCE_KEY`` with its first flush, and a rollup only answers for a bucket that opened after the
+last of them started: the bucket a consumer started or restarted in comes from Timescale.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.shared import versions
+from app.shared.buckets import parse_time, time_bucket
+
+FIELDS = ("velocity", "temperature", "humidity", "battery_level")
+BUCKETS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+KEY_PREFIX = "rollup:"
+# Epoch seconds the last aggregator started counting at
+SINCE_KEY = "rollups:since"
+
+
+def key(sensor_id, bucket, start):
+    return f"{KEY_PREFIX}{sensor_id}:{bucket}:{int(start.timestamp())}"
+
+
+def sensor_of(rollup_key):
+    return int(rollup_key[len(KEY_PREFIX):].split(":", 1)[0])
+
+
+def open_bucket(bucket, now=None):
+    """Start of the bucket the current time falls in."""
+    return time_bucket(bucket, now or datetime.now(timezone.utc))
+
+
+def covers(since, start):
+    """Whether the rollups hold every reading of the bucket opened at ``start``, given ``SINCE_KEY``."""
+    return since is not None and since <= start.timestamp()
+
+
+def ttl(bucket):
+    # Kept for one more bucket after closing, long enough for the last reads of a dashboard
+    return int(BUCKETS[bucket].total_seconds() * 2)
+
+
+def row(sensor_id, start, aggregates):
+    """A rollup as a row of ``Timescale.get_buckets``: id, start, avg velocity, temperature, humidity, min battery."""
+    def avg(field):
+        count, total = aggregates.get(field, (0, 0.0))[:2]
+        return total / count if count else None
+    battery = aggregates.get("battery_level")
+    return (sensor_id, start, avg("velocity"), avg("temperature"), avg("humidity"), battery[2] if battery else None)
+
+
+class RollupAggregator:
+    """Aggregates of the open buckets not merged into Redis yet, by rollup key."""
+
+    def __init__(self, since=None):
+        # key -> (ttl, {field: [count, sum, min, max]})
+        self.pending = {}
+        self.readings = 0
+        # When this aggregator started counting, recorded under SINCE_KEY by its first flush
+        self.since = time.time() if since is None else since
+        self.announced = False
+
+    def add(self, sensor_id, data, now=None):
+        last_seen = parse_time(data.last_seen)
+        values = {field: (1, value, value, value) for field in FIELDS
+                  if (value := getattr(data, field)) is not None}
+        for bucket in BUCKETS:
+            start = time_bucket(bucket, last_seen)
+            if start >= open_bucket(bucket, now):
+                self.merge(key(sensor_id, bucket, start), ttl(bucket), values)
+        self.readings += 1
+
+    def flush(self, redis):
+        """Merge the pending aggregates into Redis in one round trip, they are kept for the next flush if it fails."""
+        if not self.pending and self.announced:
+            return 0
+        pending, self.pending = self.pending, {}
+        try:
+            # The open buckets of the sensors changed, and so did their ETags
+            redis.merge_rollups(pending, versions=list({versions.data(sensor_of(rollup_key)): None for rollup_key in pending}),
+                                values=None if self.announced else {SINCE_KEY: self.since})
+        except Exception:
+            for rollup_key, (rollup_ttl, aggregates) in pending.items():
+                self.merge(rollup_key, rollup_ttl, aggregates)
+            raise
+        self.announced = True
+        return len(pending)
+
+    def merge(self, rollup_key, rollup_ttl, aggregates):
+        _, current = self.pending.setdefault(rollup_key, (rollup_ttl, {}))
+        for field, (count, total, low, high) in aggregates.items():
+            if field not in current:
+                current[field] = [count, total, low, high]
+            else:
+                aggregate = current[field]
+                aggregate[0] += count
+                aggregate[1] += total
+                aggregate[2] = min(aggregate[2], low)
+                aggregate[3] = max(aggregate[3], high)
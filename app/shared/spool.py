@@ -0,0 +1,305 @@
+import itertools
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Every record is stored as: payload length, crc32 of the payload and the time it was spooled
+RECORD_HEADER = struct.Struct(">IId")
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+OFFSET_FILE = "offset"
+LOCK_FILE = "lock"
+
+
+class Spool:
+    """Append-only, segmented on-disk log of messages that could not be handed to the broker yet.
+
+    Writes are buffered and fsync'ed in batches (every ``fsync_every`` records or ``fsync_interval``
+    seconds). Readers ``peek`` records in order and ``commit`` them once they are safely published,
+    the committed position is persisted so a restarted process resumes where it left off.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync_every=100, fsync_interval=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.RLock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        segments = self._list_segments()
+        self._read_segment, self._read_offset = self._load_offset(segments)
+        self._write_segment = segments[-1] if segments else self._read_segment
+        # Count what is still pending, and drop a torn record left by a crash in the middle of a write
+        self._pending, self._pending_bytes = self._scan(segments)
+        self._writer = open(self._segment_path(self._write_segment), "ab")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Lock file held while this spool owns its directory, see claim()
+        self._owner = None
+        # Records moved in from the spools of workers that are gone
+        self.adopted = 0
+
+    @classmethod
+    def claim(cls, base, **kwargs):
+        """The spool of ``base`` or, when another process owns it, of the first free ``base/worker-N``.
+
+        Every API worker needs a spool of its own: two writers in one directory would interleave
+        their records. Ownership is an flock on a file of the directory, so it goes away with its
+        process and a worker started after a crash replays the spool its predecessor left behind.
+        The records of free ``worker-N`` directories above the claimed one, left by workers that
+        were not started again, are moved into the claimed spool.
+        """
+        import fcntl
+
+        for slot in itertools.count():
+            directory = base if slot == 0 else os.path.join(base, f"worker-{slot}")
+            os.makedirs(directory, exist_ok=True)
+            owner = open(os.path.join(directory, LOCK_FILE), "a")
+            try:
+                fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner.close()
+                continue
+            spool = cls(directory, **kwargs)
+            spool._owner = owner
+            spool._adopt_orphans(base, slot)
+            return spool
+
+    def _adopt_orphans(self, base, slot):
+        import fcntl
+
+        for name in sorted(os.listdir(base)):
+            number = name[len("worker-"):]
+            if not name.startswith("worker-") or not number.isdigit() or int(number) <= slot:
+                continue
+            directory = os.path.join(base, name)
+            owner = open(os.path.join(directory, LOCK_FILE), "a")
+            try:
+                fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # A live worker owns it
+                owner.close()
+                continue
+            try:
+                orphan = Spool(directory, segment_bytes=self.segment_bytes)
+                # Committed only once synced here: a crash in between replays them twice, never loses them
+                while orphan.pending:
+                    records, position = orphan.peek(1000)
+                    if not records:
+                        break
+                    for record in records:
+                        self.append(record)
+                    self.sync()
+                    orphan.commit(position, len(records))
+                    self.adopted += len(records)
+                orphan.close()
+            finally:
+                owner.close()
+
+    # Paths and offsets
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:010d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _load_offset(self, segments):
+        try:
+            with open(os.path.join(self.directory, OFFSET_FILE)) as f:
+                segment, offset = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            return (segments[0] if segments else 0), 0
+        if segments and segment < segments[0]:
+            return segments[0], 0
+        return segment, offset
+
+    def _store_offset(self):
+        path = os.path.join(self.directory, OFFSET_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{self._read_segment} {self._read_offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _scan(self, segments):
+        pending = 0
+        pending_bytes = 0
+        for segment in segments:
+            if segment < self._read_segment:
+                continue
+            path = self._segment_path(segment)
+            offset = self._read_offset if segment == self._read_segment else 0
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while True:
+                    record = self._read_record(f)
+                    if record is None:
+                        break
+                    pending += 1
+                    pending_bytes += RECORD_HEADER.size + len(record[0])
+                valid_end = f.tell()
+            if segment == self._write_segment and valid_end < os.path.getsize(path):
+                # Torn tail: the process died while appending, everything after it is garbage
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+        return pending, pending_bytes
+
+    @staticmethod
+    def _read_record(f):
+        start = f.tell()
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            f.seek(start)
+            return None
+        length, crc, spooled_at = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            f.seek(start)
+            return None
+        return payload, spooled_at
+
+    # Writing
+
+    def append(self, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self._lock:
+            if self._writer.tell() >= self.segment_bytes:
+                self._rotate()
+            self._writer.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload), time.time()))
+            self._writer.write(payload)
+            self._pending += 1
+            self._pending_bytes += RECORD_HEADER.size + len(payload)
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def _sync(self):
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        self._writer.close()
+        self._write_segment += 1
+        self._writer = open(self._segment_path(self._write_segment), "ab")
+
+    # Reading
+
+    def peek(self, max_records):
+        """Return up to ``max_records`` pending payloads in order, plus the position right after them."""
+        with self._lock:
+            # Make buffered records visible to the reader, durability is still handled by _sync
+            self._writer.flush()
+            records = []
+            segment, offset = self._read_segment, self._read_offset
+            while len(records) < max_records and segment <= self._write_segment:
+                path = self._segment_path(segment)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        while len(records) < max_records:
+                            record = self._read_record(f)
+                            if record is None:
+                                break
+                            records.append(record[0])
+                        offset = f.tell()
+                if len(records) < max_records and segment < self._write_segment:
+                    segment, offset = segment + 1, 0
+                else:
+                    break
+            return records, (segment, offset)
+
+    def commit(self, position, count):
+        """Mark ``count`` records up to ``position`` (as returned by ``peek``) as delivered."""
+        with self._lock:
+            previous_segment = self._read_segment
+            # Records are contiguous: the bytes committed are the distance the reader moves
+            committed_bytes = self._distance((self._read_segment, self._read_offset), position)
+            self._read_segment, self._read_offset = position
+            self._pending = max(self._pending - count, 0)
+            self._pending_bytes = max(self._pending_bytes - committed_bytes, 0) if self._pending else 0
+            self._store_offset()
+            # Segments fully behind the reader are no longer needed
+            for segment in range(previous_segment, self._read_segment):
+                try:
+                    os.remove(self._segment_path(segment))
+                except FileNotFoundError:
+                    pass
+            if self._pending == 0 and self._read_segment == self._write_segment and self._read_offset > 0:
+                self._reset_segment()
+
+    def _distance(self, start, end):
+        (segment, offset), (end_segment, end_offset) = start, end
+        distance = 0
+        while segment < end_segment:
+            path = self._segment_path(segment)
+            if os.path.exists(path):
+                distance += os.path.getsize(path) - offset
+            segment, offset = segment + 1, 0
+        return distance + end_offset - offset
+
+    def _reset_segment(self):
+        # Everything was delivered, start a fresh segment instead of growing the current one forever
+        self._sync()
+        self._writer.close()
+        os.remove(self._segment_path(self._write_segment))
+        self._write_segment += 1
+        self._read_segment, self._read_offset = self._write_segment, 0
+        self._writer = open(self._segment_path(self._write_segment), "ab")
+        self._store_offset()
+
+    # Metrics
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def pending_bytes(self):
+        return self._pending_bytes
+
+    def oldest_age(self):
+        """Seconds since the oldest pending record was spooled, 0 when the spool is empty."""
+        with self._lock:
+            if not self._pending:
+                return 0.0
+            self._writer.flush()
+            segment, offset = self._read_segment, self._read_offset
+            while segment <= self._write_segment:
+                path = self._segment_path(segment)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        record = self._read_record(f)
+                    if record is not None:
+                        return max(time.time() - record[1], 0.0)
+                segment, offset = segment + 1, 0
+            return 0.0
+
+    def stats(self):
+        return {"pending": self.pending, "bytes": self.pending_bytes, "oldest_age": self.oldest_age()}
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._writer.close()
+            if self._owner is not None:
+                self._owner.close()
+                self._owner = None
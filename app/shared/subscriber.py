@@ -1,28 +1,38 @@
 import pika
 import time
 
+from app.settings import get_settings
 from app.shared.publisher import QUEUE_NAME
 
 class Subscriber:
-    def __init__(self):
+    def __init__(self, connection_factory=pika.BlockingConnection):
+        settings = get_settings()
         credentials = pika.PlainCredentials('guest', 'guest')
-        # Change the host to rabbitmq
-        parameters = pika.ConnectionParameters('localhost',
-                                       5672,
+        parameters = pika.ConnectionParameters(settings.rabbitmq_host,
+                                       settings.rabbitmq_port,
                                        '/',
                                        credentials)
         try:
-            self.conn = pika.BlockingConnection(parameters)
+            self.conn = connection_factory(parameters)
         except Exception as e:
             time.sleep(10)
-            self.conn = pika.BlockingConnection(parameters)
+            self.conn = connection_factory(parameters)
         self.channel = self.conn.channel()
 
 
-    def subscribe(self, callback):
-        result = self.channel.queue_declare(queue=QUEUE_NAME)
-        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=True)
-        self.channel.start_consuming()
+    # With auto_ack=False the callback must ack each message once it is safely processed.
+    # on_idle(channel) is called at least every idle_interval seconds, even when no message arrives
+    def subscribe(self, callback, auto_ack=True, prefetch_count=100, on_idle=None, idle_interval=0.1):
+        result = self.channel.queue_declare(queue=QUEUE_NAME, durable=True)
+        if not auto_ack:
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=auto_ack)
+        if on_idle is None:
+            self.channel.start_consuming()
+            return
+        while self.channel.is_open:
+            self.conn.process_data_events(time_limit=idle_interval)
+            on_idle(self.channel)
 
     def close(self):
         self.conn.close()
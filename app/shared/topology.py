@@ -0,0 +1,39 @@
+from app.shared.publisher import QUEUE_NAME
+
+# Databases a reading is written to, each one is retried on its own
+STORES = ("timescale", "cassandra", "redis")
+# Messages that could not be written after every retry end up here
+DEAD_LETTER_QUEUE = QUEUE_NAME + ".dead"
+
+# Headers used to route a message through the retry pipeline
+STORES_HEADER = "x-stores"
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-error"
+REPLAY_HEADER = "x-replayed-at"
+
+
+def retry_queue(store, attempt):
+    return f"{QUEUE_NAME}.retry.{store}.{attempt}"
+
+
+def retry_delay(attempt, base_delay):
+    # Exponential backoff: base, 2*base, 4*base, ...
+    return base_delay * (2 ** attempt)
+
+
+def declare(channel, max_attempts, base_delay):
+    """Declare the main queue, one delay queue per store and attempt, and the dead letter queue.
+
+    A delay queue has no consumers: its messages expire after the attempt's TTL and are
+    dead-lettered back to the main queue, so waiting for a retry never blocks the hot queue.
+    Every queue is durable, so persistent messages survive a broker restart.
+    """
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    for store in STORES:
+        for attempt in range(max_attempts):
+            channel.queue_declare(queue=retry_queue(store, attempt), durable=True, arguments={
+                "x-message-ttl": int(retry_delay(attempt, base_delay) * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": QUEUE_NAME,
+            })
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
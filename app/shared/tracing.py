@@ -0,0 +1,177 @@
+"""Ingest lag tracing: from the API accepting a reading to the reading being durable in each store.
+
+The publisher stamps every AMQP message with a trace id and the time it was published, and
+every reading carries the time the API received it. The consumer turns them into histograms
+(on ``/metrics``), a window of recent lags whose percentiles it reports to Redis for
+``GET /ingest/lag``, and optionally spans, written as JSON lines to a file or sent to an
+OpenTelemetry collector when the ``opentelemetry-sdk`` package is installed.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from app.shared import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "x-trace-id"
+PUBLISHED_AT_HEADER = "x-published-at"
+# Consumers report their lag percentiles under this prefix, one key per consumer
+LAG_KEY_PREFIX = "ingest:lag:"
+# Span of the delivery a retry or dead letter comes from: the attempt of the retry hangs from it
+PARENT_SPAN_HEADER = "x-parent-span-id"
+# The span covering an attempt, a delivery to the consumer, at writing readings from the API to the
+# stores. The other spans of the delivery are its children
+ROOT_SPAN = "ingest"
+
+# Seconds, from a few milliseconds (idle pipeline) to ten minutes (a consumer catching up)
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+QUEUE_WAIT = metrics.REGISTRY.histogram("ingest_queue_wait_seconds", "Time between publication and delivery to the consumer",
+                                        buckets=LAG_BUCKETS)
+WRITE_DURATION = metrics.REGISTRY.histogram("ingest_write_duration_seconds", "Duration of the batch writes to each store",
+                                            ("store",))
+STORE_LAG = metrics.REGISTRY.histogram("ingest_store_lag_seconds", "Time between reception by the API and the write to each store",
+                                       ("store",), buckets=LAG_BUCKETS)
+END_TO_END_LAG = metrics.REGISTRY.histogram("ingest_end_to_end_lag_seconds",
+                                            "Time between reception by the API and the write to every store",
+                                            buckets=LAG_BUCKETS)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def new_span_id():
+    return uuid.uuid4().hex[:16]
+
+
+class LagWindow:
+    """The last ``size`` lags, for percentiles that reflect the current state rather than all time."""
+
+    def __init__(self, size=10000):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentiles(self, percents=(50, 90, 99, 99.9)):
+        with self._lock:
+            samples = sorted(self._samples)
+        summary = {"count": len(samples), "max": samples[-1] if samples else None}
+        for percent in percents:
+            key = f"p{percent:g}".replace(".", "")
+            summary[key] = samples[min(int(len(samples) * percent / 100), len(samples) - 1)] if samples else None
+        return summary
+
+
+class FileExporter:
+    """Writes spans as JSON lines, one object per span."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace_id, name, start, end, attributes, span_id=None, parent_id=None):
+        line = json.dumps({"trace_id": trace_id, "span_id": span_id or new_span_id(), "parent_id": parent_id, "name": name,
+                           "start": start, "end": end, "duration": end - start, "attributes": attributes})
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    """Sends spans to an OpenTelemetry collector over OTLP/gRPC."""
+
+    def __init__(self, endpoint, service_name="sensors-consumer"):
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.ids = _id_generator()
+        self.provider = TracerProvider(resource=Resource.create({"service.name": service_name}), id_generator=self.ids)
+        self.provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        self.tracer = self.provider.get_tracer("sensors.ingest")
+
+    def export(self, trace_id, name, start, end, attributes, span_id=None, parent_id=None):
+        # Spans of a reading belong to the trace id the publisher stamped on its message, with the span and
+        # parent ids the consumer gave them
+        from opentelemetry.context import Context
+
+        if parent_id is None:
+            context = Context()
+        else:
+            parent = self._trace.SpanContext(trace_id=int(trace_id, 16), span_id=int(parent_id, 16), is_remote=False,
+                                             trace_flags=self._trace.TraceFlags(self._trace.TraceFlags.SAMPLED))
+            context = self._trace.set_span_in_context(self._trace.NonRecordingSpan(parent))
+        self.ids.next.trace_id = int(trace_id, 16)
+        self.ids.next.span_id = int(span_id, 16) if span_id else None
+        try:
+            span = self.tracer.start_span(name, context=context, start_time=int(start * 1e9), attributes=attributes)
+        finally:
+            self.ids.next.trace_id = self.ids.next.span_id = None
+        span.end(end_time=int(end * 1e9))
+
+
+def _id_generator():
+    from opentelemetry.sdk.trace.id_generator import RandomIdGenerator
+
+    class IdGenerator(RandomIdGenerator):
+        """Random ids, except for the span the exporter sets the ids of."""
+
+        def __init__(self):
+            self.next = threading.local()
+
+        def generate_trace_id(self):
+            return getattr(self.next, "trace_id", None) or super().generate_trace_id()
+
+        def generate_span_id(self):
+            return getattr(self.next, "span_id", None) or super().generate_span_id()
+
+    return IdGenerator()
+
+
+class Tracer:
+    """Records spans of a sample of the traces, or nothing when there is no exporter."""
+
+    def __init__(self, exporter=None, sample_rate=1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def sampled(self, trace_id):
+        # Decided by the trace id, so every span of a trace is kept or dropped together
+        return (self.exporter is not None and trace_id is not None
+                and int(trace_id[:8], 16) < self.sample_rate * 0x100000000)
+
+    def span(self, trace_id, name, start, end, span_id=None, parent_id=None, **attributes):
+        if not self.sampled(trace_id) or start is None:
+            return
+        try:
+            self.exporter.export(trace_id, name, start, end, attributes, span_id, parent_id)
+        except Exception as e:
+            # Tracing is best effort, it must never stop the readings from being written
+            logger.warning("Could not export span %s: %r", name, e)
+
+
+def make_tracer(settings):
+    if settings.tracing_exporter == "otlp":
+        try:
+            return Tracer(OpenTelemetryExporter(settings.tracing_otlp_endpoint), settings.tracing_sample_rate)
+        except ImportError:
+            logger.warning("opentelemetry-sdk is not installed, writing spans to %s instead", settings.tracing_file)
+            return Tracer(FileExporter(settings.tracing_file), settings.tracing_sample_rate)
+    if settings.tracing_exporter == "file":
+        return Tracer(FileExporter(settings.tracing_file), settings.tracing_sample_rate)
+    return Tracer()
+
+
+def lag_report(windows):
+    """What a consumer publishes for GET /ingest/lag: the percentiles of each of its lag windows."""
+    return json.dumps({"reported_at": time.time(),
+                       "lags": {name: window.percentiles() for name, window in windows.items()}})
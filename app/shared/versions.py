@@ -0,0 +1,77 @@
+"""Version counters of what the read routes return, for conditional GETs.
+
+Every write bumps (INCR) the counters of what it changes, in Redis, in the round trip of the
+write itself: a reading bumps its sensor's data counter and the fleet's battery (and, with a
+temperature, temperature) counter, registering or deleting a sensor bumps its own counter and
+the fleet's. The consumer writes each store on its own and retries the ones that failed, so
+there every store bumps the counters of what it serves once its write succeeded, retries
+included: a counter never moves only before the store behind it holds the reading. The ETag of a response is made of the counters of what it was computed from, read
+with one MGET, so ``If-None-Match`` is answered with a 304 without touching the other stores.
+
+The counters are prefixed with an epoch, a random token created with the first counter read: if
+Redis loses its data the counters start again from 0 under a new epoch, and no ETag sent before
+can match a different content.
+"""
+import hashlib
+import secrets
+
+EPOCH_KEY = "version:epoch"
+SENSORS = "version:sensors"
+BATTERY = "version:battery"
+TEMPERATURE = "version:temperature"
+
+
+def sensor(sensor_id):
+    return f"version:sensor:{sensor_id}"
+
+
+def data(sensor_id):
+    return f"version:data:{sensor_id}"
+
+
+def registration_keys(sensor_id):
+    return [SENSORS, sensor(sensor_id)]
+
+
+def reading_keys(readings, store=None):
+    """Counters changed by some ``(sensor_id, data)`` readings, each once, or only those of what ``store`` serves.
+
+    A sensor's data is read from Redis (latest) and Timescale (history), the battery and
+    temperature routes read Cassandra.
+    """
+    keys = {}
+    if store in (None, "cassandra"):
+        keys[BATTERY] = None
+        if any(reading.temperature is not None for _, reading in readings):
+            keys[TEMPERATURE] = None
+    if store in (None, "timescale", "redis"):
+        for sensor_id, _ in readings:
+            keys[data(sensor_id)] = None
+    return list(keys)
+
+
+def current(redis, keys):
+    """``(epoch, counters)`` of the keys, creating the epoch on first use."""
+    epoch, *counters = redis.get_many([EPOCH_KEY, *keys])
+    if epoch is None:
+        redis.set_if_absent(EPOCH_KEY, secrets.token_hex(4))
+        epoch = redis.get(EPOCH_KEY)
+    return epoch, counters
+
+
+def etag(epoch, counters, variant=""):
+    """A strong ETag for the counters, and for the variant (the query string) of the representation."""
+    def text(value):
+        return value.decode() if isinstance(value, bytes) else str(value or 0)
+    tag = f"{text(epoch)}-{'.'.join(text(counter) for counter in counters)}"
+    if variant:
+        tag += "-" + hashlib.blake2b(variant.encode(), digest_size=4).hexdigest()
+    return f'"{tag}"'
+
+
+def matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    # A list of ETags, weak ones (W/"...") compared by their value
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates
@@ -0,0 +1,112 @@
+"""Start-up time of the API: what importing it costs, by module, and what initialising it costs, by step.
+
+    python -m app.startup --module app.main --limit 15
+
+Import times come from ``python -X importtime`` in a fresh interpreter, so modules already
+imported by the caller do not hide their cost. Initialisation steps are timed in the process
+itself with ``checkpoint`` and ``phase``, and printed by the API once it is ready.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# When this module was first imported, the start of the first checkpoint
+STARTED = time.perf_counter()
+# Step name -> seconds, in the order they ran
+PHASES = {}
+_last = STARTED
+
+
+def checkpoint(name):
+    """Record the time since the previous checkpoint (or since start-up began) under ``name``."""
+    global _last
+    now = time.perf_counter()
+    PHASES[name] = PHASES.get(name, 0.0) + now - _last
+    _last = now
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASES[name] = PHASES.get(name, 0.0) + time.perf_counter() - start
+
+
+def elapsed():
+    return time.perf_counter() - STARTED
+
+
+def summary():
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in PHASES.items())
+
+
+def import_times(module="app.main", env=None):
+    """``(module, self seconds, cumulative seconds)`` of every module imported by ``import module``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env={**os.environ, **(env or {})}, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_import_times(result.stderr)
+
+
+def parse_import_times(output):
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return times
+
+
+def by_package(times):
+    """Self time summed by top level package, most expensive first."""
+    packages = Counter()
+    for name, own, _ in times:
+        packages[name.split(".", 1)[0]] += own
+    return packages.most_common()
+
+
+def total_import_time(times, module="app.main"):
+    return next((cumulative for name, _, cumulative in times if name == module), sum(own for _, own, _ in times))
+
+
+def print_report(times, module="app.main", limit=15, out=sys.stdout):
+    print(f"import {module}: {total_import_time(times, module):.3f}s", file=out)
+    print("\nBy package (self time):", file=out)
+    for package, seconds in by_package(times)[:limit]:
+        print(f"  {seconds * 1000:9.1f} ms  {package}", file=out)
+    print("\nSlowest modules (cumulative time):", file=out)
+    for name, _, cumulative in sorted(times, key=lambda item: item[2], reverse=True)[:limit]:
+        print(f"  {cumulative * 1000:9.1f} ms  {name}", file=out)
+    if PHASES:
+        print("\nInitialisation:", file=out)
+        for name, seconds in PHASES.items():
+            print(f"  {seconds * 1000:9.1f} ms  {name}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report where the start-up time of the API goes")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--limit", type=int, default=15)
+    parser.add_argument("--no-init", action="store_true",
+                        help="only report the imports, without running the startup hooks (which connect to the stores)")
+    args = parser.parse_args(argv)
+
+    times = import_times(args.module)
+    if not args.no_init and args.module == "app.main":
+        import asyncio
+        from app.main import app
+        asyncio.run(app.router.startup())
+        asyncio.run(app.router.shutdown())
+    print_report(times, args.module, args.limit)
+
+
+if __name__ == "__main__":
+    main()
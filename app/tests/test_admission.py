@@ -0,0 +1,56 @@
+import pytest
+from fastapi import HTTPException
+
+from app.sensors.admission import AdmissionController
+
+
+class EmptyBucket:
+    def take_token(self, key, rate, burst):
+        return False, 0.25
+
+
+def test_rate_limited_sensor_gets_429():
+    admission = AdmissionController(rate=1, burst=1)
+    with pytest.raises(HTTPException) as e:
+        with admission.admit(EmptyBucket(), 1):
+            pass
+    assert e.value.status_code == 429
+    assert e.value.headers["Retry-After"] == "1"
+
+
+def test_backlog_over_limit_gets_503():
+    admission = AdmissionController(rate=0, max_queue_depth=10, backlog=lambda: 10)
+    with pytest.raises(HTTPException) as e:
+        with admission.admit(None, 1):
+            pass
+    assert e.value.status_code == 503
+    assert admission.in_flight == 0
+    assert admission.rejected["queue_depth"] == 1
+
+
+def test_in_flight_limit():
+    admission = AdmissionController(rate=0, max_in_flight=1)
+    with admission.hold_slot():
+        with pytest.raises(HTTPException):
+            with admission.hold_slot():
+                pass
+    assert admission.in_flight == 0
+
+
+def test_store_latency_shedding_recovers():
+    """One very slow write neither sheds every request nor keeps shedding once the stores are fast again"""
+    now = [0.0]
+    admission = AdmissionController(rate=0, max_store_latency=0.5, decay=5.0, max_shed=0.9, clock=lambda: now[0])
+    admission.observe_latency(30.0)
+    admitted = 0
+    for _ in range(1000):
+        try:
+            with admission.admit(None, 1):
+                admitted += 1
+        except HTTPException:
+            pass
+    assert admitted and admission.rejected["store_latency"]
+    now[0] += 60
+    assert admission.current_latency() < 0.5
+    with admission.admit(None, 1):
+        pass
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app.fakes import FakeMongoDBClient
+from app.shared import analytics
+
+
+def mongodb(types):
+    client = FakeMongoDBClient()
+    for sensor_id, type in types.items():
+        client.add_sensor({"id": sensor_id, "type": type, "location": {"type": "Point", "coordinates": [0, 0]}})
+    return client
+
+
+def test_columns_skip_missing_values():
+    ids, values = analytics.load_columns([[(1, 2.0), (2, None)], [(3, 4.0)], []])
+    assert ids.tolist() == [1, 3] and values.tolist() == [2.0, 4.0]
+    ids, values = analytics.load_columns([])
+    assert len(ids) == len(values) == 0
+
+
+def test_sensor_types_are_cached_and_reloaded_for_new_sensors():
+    now = [0.0]
+    client = mongodb({1: "Temperatura", 2: "Velocitat"})
+    types = analytics.SensorTypes(ttl=60, min_reload=1, clock=lambda: now[0])
+    names, codes = types.lookup(client, np.array([2, 1, 2]))
+    assert [names[code] for code in codes] == ["Velocitat", "Temperatura", "Velocitat"]
+
+    client.add_sensor({"id": 5, "type": "Velocitat", "location": {"type": "Point", "coordinates": [0, 0]}})
+    # A sensor the map does not know yet is looked up again, but not more than once a second
+    assert types.lookup(client, np.array([5]))[1].tolist() == [analytics.UNKNOWN]
+    now[0] = 2.0
+    names, codes = types.lookup(client, np.array([5, 7]))
+    assert names[codes[0]] == "Velocitat" and codes[1] == analytics.UNKNOWN
+    assert types.loads == 2
+    types.lookup(client, np.array([1]))
+    assert types.loads == 2
+
+
+def test_fleet_summary_by_type():
+    rng = np.random.default_rng(1)
+    ids = rng.integers(1, 5, 10000)
+    values = rng.normal(20, 5, 10000)
+    codes = np.where(ids % 2 == 0, 0, 1)
+    summary = analytics.fleet_summary(ids, values, ("A", "B"), codes, percentiles=(50, 99), bins=10)
+
+    assert summary["readings"] == 10000 and summary["sensors"] == 4
+    assert summary["percentiles"]["p99"] == pytest.approx(np.percentile(values, 99))
+    assert sum(summary["histogram"]) == 10000 and len(summary["edges"]) == 11
+    by_type = {entry["type"]: entry for entry in summary["types"]}
+    assert by_type["A"]["sensors"] == 2 and by_type["A"]["readings"] == int((ids % 2 == 0).sum())
+    assert by_type["B"]["mean"] == pytest.approx(values[ids % 2 == 1].mean())
+    assert [a + b for a, b in zip(by_type["A"]["histogram"], by_type["B"]["histogram"])] == summary["histogram"]
@@ -0,0 +1,29 @@
+from benchmarks.histogram import Histogram
+from benchmarks.report import compare
+
+
+def test_histogram_percentiles():
+    """Percentiles stay within the bucket precision, and merging adds the samples up"""
+    histogram = Histogram()
+    for value in range(1, 10001):
+        histogram.record(value)
+    assert abs(histogram.percentile(50) - 5000) / 5000 < 0.02
+    assert abs(histogram.percentile(99) - 9900) / 9900 < 0.02
+    assert histogram.percentile(100) == 10000
+
+    other = Histogram()
+    other.record(1_000_000)
+    histogram.merge(other)
+    assert histogram.count == 10001
+    assert histogram.max == 1_000_000
+
+
+def test_compare_reports_regressions():
+    """Latency going up or throughput going down beyond the tolerance is a regression"""
+    baseline = {"operations": {"get_latest": {"p99": 1000, "throughput": 100}}}
+    report = {"operations": {"get_latest": {"p99": 1050, "throughput": 100}}}
+    assert compare(report, baseline, tolerance=0.1) == []
+
+    report = {"operations": {"get_latest": {"p99": 1500, "throughput": 80}}}
+    regressions = compare(report, baseline, tolerance=0.1)
+    assert {regression["metric"] for regression in regressions} == {"p99", "throughput"}
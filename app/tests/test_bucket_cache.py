@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+from app.fakes import FakeRedisClient, FakeTimescale
+from app.sensors import repository
+from app.sensors.schemas import SensorData
+from app.shared import bucket_cache
+
+NOW = datetime(2023, 3, 10, 12, 30, tzinfo=timezone.utc)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def reading(day, hour, temperature):
+    return SensorData(temperature=temperature, battery_level=1.0, last_seen=f"2023-03-{day:02d}T{hour:02d}:15:00.000Z")
+
+
+def test_closed_buckets_are_whole_and_past_the_grace():
+    starts = bucket_cache.closed_buckets("hour", utc(2023, 3, 10, 9, 30), None, NOW, grace=60)
+    # 9:00 is cut by the start of the range, 12:00 is open
+    assert starts == [utc(2023, 3, 10, 10), utc(2023, 3, 10, 11)]
+    assert bucket_cache.closed_buckets("hour", utc(2023, 3, 10, 10), utc(2023, 3, 10, 10, 59, 59, 999999), NOW) == \
+        [utc(2023, 3, 10, 10)]
+    assert bucket_cache.closed_buckets("hour", utc(2023, 3, 10, 11), None, utc(2023, 3, 10, 12, 0, 30), grace=60) == []
+    assert bucket_cache.closed_buckets("month", utc(2022, 11, 1), None, NOW) == [utc(2022, 11, 1), utc(2022, 12, 1),
+                                                                                 utc(2023, 1, 1), utc(2023, 2, 1)]
+
+
+def test_closed_buckets_come_from_the_cache_and_late_readings_drop_them():
+    redis, timescale = FakeRedisClient(), FakeTimescale()
+    for day, temperature in ((1, 10.0), (3, 30.0)):
+        timescale.insert_reading(1, reading(day, 8, temperature))
+
+    def get(from_data, to_data=None):
+        fetch = lambda start, end: timescale.get_buckets(1, "day", start, end)
+        return bucket_cache.get_buckets(redis, fetch, 1, "day", from_data, to_data, NOW, grace=60)
+
+    expected = timescale.get_buckets(1, "day", "2023-03-01T00:00:00+00:00")
+    hits = bucket_cache.REQUESTS.value("day", "hit")
+    assert get("2023-03-01T00:00:00+00:00") == expected
+    selects = timescale.calls["select"]
+    # The nine closed days, 2 March without readings included, are cached: only the open day is asked for
+    assert get("2023-03-01T00:00:00+00:00") == expected
+    assert timescale.calls["select"] == selects + 1
+    assert bucket_cache.REQUESTS.value("day", "hit") == hits + 9
+    assert get("2023-03-02T00:00:00+00:00", "2023-03-03T23:59:59.999999+00:00") == [expected[1]]
+
+    late = reading(2, 9, 20.0)
+    repository.record_data_many_timescale(timescale, [(1, late)], redis=redis, cache_grace=60)
+    rows = get("2023-03-01T00:00:00+00:00")
+    assert [row[3] for row in rows] == [10.0, 20.0, 30.0]
+    # A reading of the open hour changes no cached bucket and costs no round trip
+    assert bucket_cache.late_fields([(1, reading(10, 12, 1.0))], NOW) == {}
+
+
+def test_cached_buckets_expire_and_redis_errors_never_fail_a_write():
+    redis, timescale = FakeRedisClient(), FakeTimescale()
+    timescale.insert_reading(1, reading(1, 8, 10.0))
+
+    def get(now):
+        fetch = lambda start, end: timescale.get_buckets(1, "day", start, end)
+        return bucket_cache.get_buckets(redis, fetch, 1, "day", "2023-03-01T00:00:00+00:00", "2023-03-01T23:59:59.999999+00:00",
+                                        now, grace=60, ttl=3600)
+
+    get(NOW)
+    # A late reading whose invalidation fails is still written, its bucket is stale until it expires
+    def down(*args, **kwargs):
+        raise ConnectionError("redis down")
+    redis.delete_fields = down
+    errors = bucket_cache.ERRORS.value("delete")
+    repository.record_data_many_timescale(timescale, [(1, reading(1, 9, 20.0))], redis=redis, cache_grace=60)
+    assert bucket_cache.ERRORS.value("delete") == errors + 1
+    assert get(NOW)[0][3] == 10.0
+    assert get(NOW + timedelta(hours=2))[0][3] == 15.0
+    # Without Redis the buckets come from Timescale
+    redis.get_fields = down
+    assert get(NOW)[0][3] == 15.0
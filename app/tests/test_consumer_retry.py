@@ -0,0 +1,149 @@
+from types import SimpleNamespace
+
+from app.sensors import schemas
+from app.shared import envelope, topology
+from consumer.retry import CircuitBreaker
+from consumer.worker import SensorDataConsumer
+
+
+class Channel:
+    def __init__(self):
+        self.published = []
+        self.acked = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((routing_key, properties.headers))
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acked.append(delivery_tag)
+
+
+def make_consumer(failing_store):
+    consumer = SensorDataConsumer(redis=None, timescale=None, cassandra=None, max_attempts=2)
+    written = []
+
+    def writer(store):
+        def write(readings):
+            if store == failing_store:
+                raise TimeoutError(store)
+            written.extend(store for _ in readings)
+        return write
+
+    consumer.writers = {store: writer(store) for store in topology.STORES}
+    return consumer, written
+
+
+def deliver(consumer, channel, body, headers=None, tag=1, content_type=None, content_encoding=None):
+    properties = SimpleNamespace(headers=headers, content_type=content_type, content_encoding=content_encoding)
+    consumer.on_message(channel, SimpleNamespace(delivery_tag=tag), properties, body)
+
+
+def test_failing_store_goes_to_its_retry_queue():
+    """Only the failing database is retried, the message is acked right away"""
+    consumer, written = make_consumer("cassandra")
+    channel = Channel()
+    body = schemas.SensorDataMessage(sensor_id=1, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+    deliver(consumer, channel, body)
+    assert written == ["timescale", "redis"]
+    assert channel.acked == [1]
+    routing_key, headers = channel.published[0]
+    assert routing_key == topology.retry_queue("cassandra", 0)
+    assert headers[topology.STORES_HEADER] == ["cassandra"]
+    assert headers[topology.ATTEMPT_HEADER] == 1
+
+
+def test_exhausted_retries_and_poison_messages_are_dead_lettered():
+    consumer, _ = make_consumer("cassandra")
+    channel = Channel()
+    body = schemas.SensorDataMessage(sensor_id=1, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+    deliver(consumer, channel, body, headers={topology.STORES_HEADER: ["cassandra"], topology.ATTEMPT_HEADER: 2})
+    deliver(consumer, channel, "not json", tag=2)
+    assert [routing_key for routing_key, _ in channel.published] == [topology.DEAD_LETTER_QUEUE] * 2
+    assert channel.acked == [1, 2]
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.open and not breaker.allow()
+
+
+def test_envelopes_are_unpacked_reading_by_reading():
+    """Every reading of a compressed envelope is written once, the envelope is acked once"""
+    consumer, written = make_consumer(None)
+    channel = Channel()
+    bodies = [schemas.SensorDataMessage(sensor_id=i, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+              for i in range(3)]
+    payload, content_type, content_encoding = envelope.encode(bodies + bodies[:1], "zlib")
+    deliver(consumer, channel, payload, content_type=content_type, content_encoding=content_encoding)
+    assert sorted(written) == sorted(topology.STORES * 3)
+    assert channel.acked == [1]
+
+
+def test_readings_are_written_and_acked_in_batches():
+    """Readings are buffered until the batch is full, then written once per database and acked at once"""
+    consumer, written = make_consumer(None)
+    consumer.batch_size, consumer.flush_interval = 3, 60
+    channel = Channel()
+    for tag in range(1, 5):
+        body = schemas.SensorDataMessage(sensor_id=tag, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+        deliver(consumer, channel, body, tag=tag)
+    assert sorted(written) == sorted(topology.STORES * 3)
+    assert channel.acked == [3]
+    assert consumer.flushes == 1
+
+    consumer.flush_interval = 0
+    consumer.tick(channel)
+    assert channel.acked == [3, 4]
+
+
+def test_latest_values_are_written_once_per_sensor_and_batch():
+    """Redis and the battery table get the newest reading of each sensor, Timescale and temperatures all of them"""
+    from app.fakes import FakeCassandraClient, FakeRedisClient, FakeTimescale
+
+    redis, timescale, cassandra = FakeRedisClient(), FakeTimescale(), FakeCassandraClient()
+    consumer = SensorDataConsumer(redis=redis, timescale=timescale, cassandra=cassandra, batch_size=4)
+    consumer.flush_interval = 60
+    batteries = []
+    add_readings = cassandra.add_readings
+    cassandra.add_readings = lambda temperatures, battery_levels: batteries.append(battery_levels) or \
+        add_readings(temperatures, battery_levels)
+    channel = Channel()
+    # The newest reading of sensor 1 arrives before an older one
+    for tag, (sensor_id, minute, battery_level) in enumerate(((1, 2, 0.8), (1, 1, 0.9), (2, 0, 0.5), (1, 0, 1.0)), 1):
+        body = schemas.SensorDataMessage(sensor_id=sensor_id, data={"temperature": float(minute), "battery_level": battery_level,
+                                                                    "last_seen": f"2020-01-01T00:0{minute}:00.000Z"}).to_json()
+        deliver(consumer, channel, body, tag=tag)
+
+    assert redis.get_sensor(1)["battery_level"] == 0.8 and redis.get_sensor(2)["battery_level"] == 0.5
+    assert batteries == [[(1, 0.8), (2, 0.5)]]
+    assert cassandra.get_low_battery(0.85) == [(1, 0.8), (2, 0.5)]
+    assert len(timescale.get_buckets(1, "hour")) == 1 and len(cassandra._temperatures[1]) == 3
+    assert consumer.coalesced == 2
+
+
+def test_each_attempt_is_traced_once_under_the_one_before(tmp_path):
+    """A failed write and its retry give one tree: unique span ids, and every parent is exported"""
+    import json
+
+    from app.shared import tracing
+
+    consumer, _ = make_consumer("cassandra")
+    consumer.tracer = tracing.Tracer(tracing.FileExporter(str(tmp_path / "spans.jsonl")))
+    channel = Channel()
+    body = schemas.SensorDataMessage(sensor_id=1, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"},
+                                     received_at=1.0).to_json()
+    deliver(consumer, channel, body, headers={tracing.TRACE_HEADER: tracing.new_trace_id(), tracing.PUBLISHED_AT_HEADER: 2.0})
+    consumer.writers["cassandra"] = lambda readings: None
+    deliver(consumer, channel, body, headers=channel.published[0][1], tag=2)
+
+    spans = [json.loads(line) for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+    ids = [span["span_id"] for span in spans]
+    assert len(ids) == len(set(ids))
+    assert all(span["parent_id"] in ids for span in spans if span["parent_id"] is not None)
+    roots = [span for span in spans if span["name"] == tracing.ROOT_SPAN]
+    assert [root["attributes"]["failed"] for root in roots] == [["cassandra"], []]
+    assert roots[0]["parent_id"] is None and roots[1]["parent_id"] == roots[0]["span_id"]
+    assert [span["name"] for span in spans if span["parent_id"] == roots[1]["span_id"]] == ["write cassandra"]
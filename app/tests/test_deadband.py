@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.sensors import repository, schemas
+from app.shared import buckets, deadband, topology
+from app.tests.test_consumer_retry import Channel, deliver, make_consumer
+
+
+def reading(minute, **values):
+    return SimpleNamespace(**{field: values.get(field) for field in deadband.FIELDS},
+                           last_seen=f"2023-03-01T00:{minute:02d}:00+00:00")
+
+
+def admit(band, sensor_id, data):
+    # A batch of one reading, written
+    staged = {}
+    admitted = band.admit(sensor_id, data, staged)
+    band.commit(staged)
+    return admitted
+
+
+def test_readings_within_the_deadband_of_the_last_written_one_are_suppressed():
+    band = deadband.Deadband(deadband.parse_rules({"battery_level": {"absolute": 0.01}, "humidity": {"relative": 0.1}}),
+                             heartbeat=600)
+    assert admit(band, 1, reading(0, battery_level=0.5, humidity=40.0))
+    assert not admit(band, 1, reading(1, battery_level=0.505, humidity=43.0))
+    # Drift is measured from the last written value, not the last received one
+    assert not admit(band, 1, reading(2, battery_level=0.509, humidity=44.0))
+    assert admit(band, 1, reading(3, battery_level=0.515, humidity=44.0))
+    # Another field, a field without a rule, a late reading and the heartbeat are always written
+    assert admit(band, 1, reading(4, battery_level=0.515))
+    assert admit(band, 1, reading(5, battery_level=0.515, temperature=20.0))
+    assert admit(band, 1, reading(1, battery_level=0.515, temperature=20.0))
+    assert admit(band, 1, reading(15, battery_level=0.515, temperature=20.0))
+    # Sensors are independent
+    assert admit(band, 2, reading(1, battery_level=0.505, humidity=43.0))
+    assert (band.readings, band.suppressed) == (9, 2)
+
+    with pytest.raises(ValueError):
+        deadband.parse_rules({"pressure": {"absolute": 1}})
+
+
+def test_suppressed_readings_are_acked_without_writes():
+    consumer, written = make_consumer(None)
+    consumer.deadband = deadband.Deadband(deadband.parse_rules({"battery_level": {"absolute": 0.01}}))
+    consumer.batch_size, consumer.flush_interval = 3, 60
+    channel = Channel()
+    for tag, battery_level in enumerate((0.5, 0.501, 0.6), 1):
+        body = schemas.SensorDataMessage(sensor_id=1, data={"battery_level": battery_level,
+                                                            "last_seen": f"2020-01-01T00:0{tag}:00.000Z"}).to_json()
+        deliver(consumer, channel, body, tag=tag)
+    assert sorted(written) == sorted(topology.STORES * 2)
+    assert channel.acked == [3]
+    assert {gauge[0]: gauge[2] for gauge in consumer.metrics()}["consumer_deadband_suppressed_total"] == 1
+
+
+def test_deadband_follows_what_the_stores_got():
+    """Readings of one batch are compared with each other, a failed write leaves the state as it was"""
+    band = deadband.Deadband(deadband.parse_rules({"battery_level": {"absolute": 0.01}}))
+    staged = {}
+    assert band.admit(1, reading(0, battery_level=0.5), staged)
+    assert band.admit(1, reading(1, battery_level=0.6), staged)
+    assert band.admit(1, reading(2, battery_level=0.5), staged)
+    assert band.admit(2, reading(0, battery_level=0.5), staged)
+    band.commit(staged, failed={2})
+    assert band.written[1][1] == {"battery_level": 0.5} and 2 not in band.written
+
+    consumer, written = make_consumer("redis")
+    consumer.deadband = band
+    consumer.batch_size = 1
+    body = schemas.SensorDataMessage(sensor_id=3, data={"battery_level": 0.5, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+    deliver(consumer, Channel(), body)
+    assert 3 not in band.written
+
+
+def test_battery_updates_within_the_deadband_are_skipped_on_their_own():
+    """A written reading leaves Cassandra's battery level alone while it is within its rule of the one it holds"""
+    class Cassandra:
+        def __init__(self):
+            self.batteries = []
+
+        def add_readings(self, temperatures, battery_levels):
+            self.batteries.append(battery_levels)
+
+    band = deadband.Deadband(deadband.parse_rules({"battery_level": {"absolute": 0.01}, "humidity": {"relative": 0.02}}),
+                             heartbeat=600)
+    cassandra = Cassandra()
+    for minute, temperature, battery_level in ((0, 20.0, 0.5), (1, 25.0, 0.505), (2, 30.0, 0.509), (3, 35.0, 0.515),
+                                               (14, 40.0, 0.515)):
+        data = reading(minute, temperature=temperature, battery_level=battery_level)
+        assert band.admit(1, data, {})
+        repository.record_data_many_cassandra(cassandra, [(1, data)], deadband=band)
+    # Drift is measured from the level Cassandra holds, and it is refreshed every heartbeat
+    assert cassandra.batteries == [[(1, 0.5)], [], [], [(1, 0.515)], [(1, 0.515)]]
+    assert band.fields_suppressed == 2
+
+    # Nothing is held from a failed write
+    cassandra.add_readings = lambda temperatures, battery_levels: 1 / 0
+    with pytest.raises(ZeroDivisionError):
+        repository.record_data_many_cassandra(cassandra, [(2, reading(0, battery_level=0.5))], deadband=band)
+    assert ("battery_level", 2) not in band.held
+
+
+def test_step_fill_repeats_the_last_bucket():
+    rows = [(1, datetime(2023, 3, 1, 0, tzinfo=timezone.utc), 20.0, 1.0),
+            (1, datetime(2023, 3, 1, 3, tzinfo=timezone.utc), 21.0, 0.9)]
+    filled = buckets.step_fill(rows, "hour", datetime(2023, 3, 1, 4, 30, tzinfo=timezone.utc))
+    assert [row[1].hour for row in filled] == [0, 1, 2, 3, 4]
+    assert [row[2] for row in filled] == [20.0, 20.0, 20.0, 21.0, 21.0]
+    assert buckets.step_fill([], "hour", datetime(2023, 3, 1, tzinfo=timezone.utc)) == []
@@ -0,0 +1,43 @@
+from app.shared.dedup import DedupWindow
+
+
+def test_dedup_window_detects_redeliveries():
+    """A message id is reported as seen only after it was remembered"""
+    dedup = DedupWindow(capacity=2)
+    assert not dedup.seen("1:2020-01-01T00:00:00.000Z")
+    dedup.remember("1:2020-01-01T00:00:00.000Z")
+    assert dedup.seen("1:2020-01-01T00:00:00.000Z")
+    assert dedup.hits == 1
+
+
+def test_dedup_window_is_bounded():
+    """The oldest ids are evicted once the window is full"""
+    dedup = DedupWindow(capacity=2)
+    for message_id in ("a", "b", "c"):
+        dedup.remember(message_id)
+    assert not dedup.seen("a")
+    assert dedup.seen("b") and dedup.seen("c")
+
+
+def test_dedup_window_fails_open_when_redis_is_down():
+    """A Redis outage neither stops the consumer nor loses readings: the ids count as unseen"""
+    from app.fakes import FakeCassandraClient, FakeRedisClient, FakeTimescale
+    from app.sensors import schemas
+    from app.tests.test_consumer_retry import Channel, deliver
+    from consumer.worker import SensorDataConsumer
+
+    def down(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    redis = FakeRedisClient()
+    redis.exists_many = redis.set_many_if_absent = down
+    consumer = SensorDataConsumer(redis=redis, timescale=FakeTimescale(), cassandra=FakeCassandraClient(), batch_size=1)
+    channel = Channel()
+    body = schemas.SensorDataMessage(sensor_id=1, data={"battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}).to_json()
+    deliver(consumer, channel, body)
+    assert channel.acked == [1] and channel.published == []
+    assert redis.get_sensor(1)["battery_level"] == 1.0
+    assert consumer.dedup.errors == 2
+    # The local window still catches the redelivery
+    deliver(consumer, channel, body, tag=2)
+    assert consumer.dedup.hits == 1
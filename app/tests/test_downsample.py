@@ -0,0 +1,54 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.shared import downsample
+
+START = datetime(2023, 3, 1, tzinfo=timezone.utc)
+
+
+def readings(values, field=3):
+    rows = []
+    for i, value in enumerate(values):
+        row = [1, START + timedelta(seconds=i), None, None, None, None]
+        row[field] = value
+        rows.append(tuple(row))
+    return rows
+
+
+def test_lttb_keeps_the_ends_and_the_shape():
+    buffer = downsample.ColumnBuffer(capacity=4)
+    rows = readings([math.sin(i / 50) for i in range(1000)])
+    for start in range(0, len(rows), 128):
+        buffer.extend(rows[start:start + 128])
+    points = downsample.downsample(buffer, 100)
+    assert len(points) == 100
+    assert points[0] == rows[0] and points[-1] == rows[-1]
+    assert [point[1] for point in points] == sorted(point[1] for point in points)
+    # The crests of the sine wave survive
+    assert max(point[3] for point in points) > 0.99 and min(point[3] for point in points) < -0.99
+
+
+def test_minmax_keeps_every_peak():
+    values = [0.0] * 1000
+    values[123], values[777] = 50.0, -50.0
+    buffer = downsample.ColumnBuffer().extend(readings(values))
+    points = downsample.downsample(buffer, 20, method="minmax")
+    assert len(points) <= 20
+    assert {point[3] for point in points} == {0.0, 50.0, -50.0}
+
+
+def test_rows_without_the_field_are_left_out():
+    rows = readings([1.0, None, 2.0, None, 3.0])
+    buffer = downsample.ColumnBuffer().extend(rows)
+    assert buffer.default_field() == "temperature"
+    assert downsample.downsample(buffer, 10) == [rows[0], rows[2], rows[4]]
+    assert downsample.downsample(buffer, 10, field="humidity") == []
+
+
+def test_indices_of_small_series():
+    x, y = np.arange(5, dtype=float), np.arange(5, dtype=float)
+    assert list(downsample.lttb_indices(x, y, 10)) == [0, 1, 2, 3, 4]
+    assert list(downsample.lttb_indices(x, y, 2)) == [0, 4]
+    assert list(downsample.minmax_indices(x, y, 4)) == [0, 1, 2, 4]
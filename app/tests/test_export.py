@@ -0,0 +1,38 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from app import export
+
+START = datetime(2023, 3, 1, 22, tzinfo=timezone.utc)
+
+
+def chunks(size=3):
+    rows = [(sensor_id, START + timedelta(hours=hour), None, 20.0 + hour, None, 0.5)
+            for hour in range(4) for sensor_id in (1, 2)]
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+def test_stream_is_one_parquet_file_or_arrow_stream():
+    data = b"".join(export.stream(chunks()))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.num_rows == 8 and table.schema == export.schema()
+    assert table.column("temperature").to_pylist()[:3] == [20.0, 20.0, 21.0]
+    assert pq.ParquetFile(io.BytesIO(data)).num_row_groups == 3
+
+    fields = ("temperature",)
+    parts = list(export.stream([[row[:2] + (row[3],) for row in chunk] for chunk in chunks()], fields, "arrow"))
+    table = pa.ipc.open_stream(b"".join(parts)).read_all()
+    assert table.column_names == ["id", "last_seen", "temperature"]
+    assert table.column("last_seen")[0].as_py() == START
+
+
+def test_partitioned_by_day(tmp_path):
+    assert export.write(chunks(), str(tmp_path), partition="day") == 8
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["day=2023-03-01", "day=2023-03-02"]
+    table = ds.dataset(str(tmp_path), format="parquet", partitioning="hive").to_table()
+    assert table.num_rows == 8
+    assert pq.read_table(tmp_path / "day=2023-03-01" / "part-0.parquet").num_rows == 4
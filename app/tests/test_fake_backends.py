@@ -0,0 +1,449 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import backends
+from app.settings import get_settings
+from app.shared import tracing
+
+SENSOR = {"name": "Sensor 1", "latitude": 1.0, "longitude": 1.0, "type": "Temperatura",
+          "mac_address": "00:00:00:00:00:00", "manufacturer": "Dummy", "model": "Dummy Temp",
+          "serie_number": "0000 0000 0000 0000", "firmware_version": "1.0",
+          "description": "Sensor de temperatura model Dummy Temp del fabricant Dummy"}
+
+
+@pytest.fixture
+def fake_backends(monkeypatch):
+    monkeypatch.setenv("BACKEND", "fake")
+    get_settings.cache_clear()
+    backends.reset()
+    yield backends
+    backends.reset()
+    get_settings.cache_clear()
+
+
+@pytest.fixture
+def client(fake_backends):
+    from app.main import app
+    return TestClient(app)
+
+
+def test_api_runs_on_fake_backends(client, fake_backends):
+    """The whole write and read path works without any service"""
+    assert client.post("/sensors", json=SENSOR).status_code == 200
+    for day, temperature in ((1, 1.0), (2, 15.0), (3, 18.0)):
+        response = client.post("/sensors/1/data", json={"temperature": temperature, "humidity": 1.0, "battery_level": 0.1,
+                                                        "last_seen": f"2020-01-0{day}T00:00:00.000Z"})
+        assert response.status_code == 200
+
+    response = client.get("/sensors/1/data")
+    assert response.json()["temperature"] == 18.0
+    response = client.get("/sensors/1/data?from=2020-01-01T00:00:00.000Z&to=2020-01-03T00:00:00.000Z&bucket=day")
+    assert len(response.json()) == 3
+    assert client.get("/sensors/quantity_by_type").json() == {"sensors": [{"type": "Temperatura", "quantity": 1}]}
+    assert len(client.get("/sensors/low_battery").json()["sensors"]) == 1
+
+
+def test_round_trips_per_reading(client, fake_backends):
+    """Writing a reading costs one round trip to Timescale and two to Cassandra"""
+    def round_trips(store):
+        fake = fake_backends.fakes().get(store)
+        return sum(fake.calls.values()) if fake is not None else 0
+
+    client.post("/sensors", json=SENSOR)
+    before = {store: round_trips(store) for store in ("timescale", "cassandra")}
+    client.post("/sensors/1/data", json={"temperature": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
+    assert round_trips("timescale") - before["timescale"] == 1
+    assert round_trips("cassandra") - before["cassandra"] == 2
+
+
+def test_queue_mode_through_fake_broker(client, fake_backends, monkeypatch, tmp_path):
+    """In queue mode readings go through the in-process broker to the consumer"""
+    from app.sensors import controller
+    from consumer.worker import SensorDataConsumer
+
+    monkeypatch.setenv("INGEST_MODE", "queue")
+    monkeypatch.setenv("SPOOL_DIR", str(tmp_path))
+    monkeypatch.setenv("PUBLISHER_BATCH_LINGER_MS", "0")
+    get_settings.cache_clear()
+    monkeypatch.setattr(controller, "publisher", None)
+
+    client.post("/sensors", json=SENSOR)
+    assert client.post("/sensors/1/data", json={"temperature": 3.0, "battery_level": 1.0,
+                                                "last_seen": "2020-01-01T00:00:00.000Z"}).status_code == 200
+    controller.publisher.close()
+
+    redis = backends.redis_client()
+    tracer = tracing.Tracer(tracing.FileExporter(str(tmp_path / "spans.jsonl")))
+    consumer = SensorDataConsumer(redis=redis, timescale=backends.timescale(), cassandra=backends.cassandra_client(),
+                                  tracer=tracer)
+    subscriber = backends.subscriber()
+    subscriber.channel.basic_consume(queue="test", on_message_callback=consumer.on_message)
+    subscriber.conn.process_data_events(time_limit=1)
+    assert redis.get_sensor(1)["temperature"] == 3.0
+    # The main queue is as durable as the retry queues the consumer declares next to it
+    from app.shared import topology
+    topology.declare(subscriber.channel, max_attempts=2, base_delay=1.0)
+    assert backends.broker().durable["test"]
+
+    # The lag of the reading is traced from the API to every store
+    consumer.report_lag()
+    lags = next(iter(client.get("/ingest/lag").json()["consumers"].values()))["lags"]
+    assert lags["end_to_end"]["count"] == 1 and lags["queue_wait"]["count"] == 1
+    spans = [json.loads(line) for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+    assert {span["name"] for span in spans} == {"queue_wait", "write timescale", "write cassandra", "write redis", "ingest"}
+    assert len({span["trace_id"] for span in spans}) == 1
+    # One tree: the ingest span is the root and the parent of every other span
+    root = next(span for span in spans if span["name"] == "ingest")
+    assert root["parent_id"] is None
+    assert all(span["parent_id"] == root["span_id"] for span in spans if span is not root)
+
+
+def test_requests_waiting_for_a_thread_count_as_in_flight(fake_backends, monkeypatch):
+    """With every worker thread busy, the requests queuing for one are counted and the next ones get 503"""
+    import threading
+
+    import anyio.to_thread
+
+    from app.main import app
+    from app.sensors import controller, repository
+
+    monkeypatch.setenv("ADMISSION_MAX_IN_FLIGHT", "2")
+    monkeypatch.setenv("RATE_LIMIT_PER_SENSOR", "0")
+    get_settings.cache_clear()
+    monkeypatch.setattr(controller, "admission", None)
+    writing, release = threading.Event(), threading.Event()
+    record_data = repository.record_data
+
+    def slow_record_data(**kwargs):
+        writing.set()
+        release.wait(5)
+        return record_data(**kwargs)
+
+    monkeypatch.setattr(repository, "record_data", slow_record_data)
+    reading = {"temperature": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"}
+    with TestClient(app) as client:
+        client.post("/sensors", json=SENSOR)
+        # A thread pool of one thread, held by the first reading
+        client.portal.call(lambda: setattr(anyio.to_thread.current_default_thread_limiter(), "total_tokens", 1))
+        statuses = []
+        posts = [threading.Thread(target=lambda: statuses.append(client.post("/sensors/1/data", json=reading).status_code))
+                 for _ in range(2)]
+        posts[0].start()
+        assert writing.wait(5)
+        posts[1].start()
+        admission = controller.get_admission_controller()
+        deadline = time.monotonic() + 5
+        while admission.in_flight < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        response = client.post("/sensors/1/data", json=reading)
+        release.set()
+        for post in posts:
+            post.join()
+    assert response.status_code == 503 and "Retry-After" in response.headers
+    assert admission.rejected["in_flight"] == 1
+    assert statuses == [200, 200]
+
+
+def test_metrics_endpoint(client, fake_backends):
+    """Store calls and requests show up on /metrics, requests labelled with their route template"""
+    client.post("/sensors", json=SENSOR)
+    client.post("/sensors/1/data", json={"temperature": 1.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
+    body = client.get("/metrics").text
+    assert 'store_request_duration_seconds_count{store="timescale",operation="insert_reading"}' in body
+    assert 'http_request_duration_seconds_count{method="POST",route="/sensors/{sensor_id}/data",status="200"}' in body
+
+
+def test_admin_profile_requires_the_token(client, fake_backends, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    get_settings.cache_clear()
+    assert client.get("/admin/profile?seconds=0.1").status_code == 403
+    response = client.get("/admin/profile?seconds=0.1&format=top", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert "samples every" in response.text
+
+
+def test_sensor_and_near_sensors_are_plain_json(client, fake_backends):
+    """A sensor is returned as a JSON object, and near sensors come with their latest reading"""
+    client.post("/sensors", json=SENSOR)
+    client.post("/sensors/1/data", json={"temperature": 2.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
+    sensor = client.get("/sensors/1").json()
+    assert sensor["id"] == 1 and sensor["latitude"] == 1.0 and "location" not in sensor
+
+    near = client.get("/sensors/near?latitude=1.0&longitude=1.0&radius=100").json()
+    assert [sensor["id"] for sensor in near] == [1]
+    assert near[0]["temperature"] == 2.0
+    assert client.get("/sensors/near?latitude=50.0&longitude=50.0&radius=100").json() == []
+
+
+def test_sensors_are_listed_by_pages_and_exported(client, fake_backends):
+    """Pages follow the cursor until the last one, the export streams every sensor with its metadata"""
+    for i in range(5):
+        client.post("/sensors", json={**SENSOR, "name": f"Sensor {i}"})
+    client.post("/sensors/2/data", json={"temperature": 2.0, "battery_level": 1.0, "last_seen": "2020-01-01T00:00:00.000Z"})
+
+    ids, cursor, pages = [], None, 0
+    while True:
+        response = client.get("/sensors", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        ids += [sensor["id"] for sensor in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert ids == [1, 2, 3, 4, 5] and pages == 3
+    assert client.get("/sensors", params={"cursor": "not a cursor"}).status_code == 400
+
+    response = client.get("/sensors/export", params={"metadata": True, "latest": True})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [1, 2, 3, 4, 5]
+    assert lines[0]["type"] == SENSOR["type"] and lines[0]["latitude"] == 1.0 and lines[0]["latest"] is None
+    assert lines[1]["latest"]["temperature"] == 2.0
+    assert set(json.loads(client.get("/sensors/export").text.splitlines()[0])) == {"id", "name", "joined_at"}
+
+
+def test_open_buckets_come_from_the_consumer_rollups(client, fake_backends, monkeypatch, tmp_path):
+    """The open hour is answered from the rollup the consumer keeps in Redis, without a Timescale query"""
+    from datetime import datetime, timezone
+    from app.sensors import controller
+    from app.shared import rollups
+    from consumer.worker import SensorDataConsumer
+
+    monkeypatch.setenv("INGEST_MODE", "queue")
+    monkeypatch.setenv("SPOOL_DIR", str(tmp_path))
+    monkeypatch.setenv("PUBLISHER_BATCH_LINGER_MS", "0")
+    get_settings.cache_clear()
+    monkeypatch.setattr(controller, "publisher", None)
+
+    now = datetime.now(timezone.utc)
+    start = rollups.open_bucket("hour", now)
+    client.post("/sensors", json=SENSOR)
+    for second, temperature in ((0, 10.0), (1, 20.0)):
+        last_seen = now.replace(second=second, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        client.post("/sensors/1/data", json={"temperature": temperature, "battery_level": 0.5 + second, "last_seen": last_seen})
+    controller.publisher.close()
+
+    timescale = backends.timescale()
+    # A consumer counting since before the hour opened
+    consumer = SensorDataConsumer(redis=backends.redis_client(), timescale=timescale, cassandra=backends.cassandra_client(),
+                                  rollups=rollups.RollupAggregator(since=start.timestamp()))
+    subscriber = backends.subscriber()
+    subscriber.channel.basic_consume(queue="test", on_message_callback=consumer.on_message)
+    subscriber.conn.process_data_events(time_limit=1)
+    consumer.flush_rollups()
+
+    selects = timescale.calls["select"]
+    response = client.get("/sensors/1/data", params={"from": start.isoformat(), "bucket": "hour"})
+    if rollups.open_bucket("hour") != start:
+        pytest.skip("the hour changed during the test")
+    assert response.json() == [[1, start.isoformat(), None, 15.0, None, 0.5]]
+    assert timescale.calls["select"] == selects
+    # A range ending before now is not covered by the rollup
+    response = client.get("/sensors/1/data", params={"from": start.isoformat(), "to": now.isoformat(), "bucket": "hour"})
+    assert timescale.calls["select"] == selects + 1
+    # Once a consumer (re)started within the hour, the rollup may miss readings: Timescale answers
+    rollups.RollupAggregator().flush(backends.redis_client())
+    response = client.get("/sensors/1/data", params={"from": start.isoformat(), "bucket": "hour"})
+    assert timescale.calls["select"] == selects + 2
+    assert response.json() == [[1, start.isoformat(), None, 15.0, None, 0.5]]
+
+
+def test_raw_readings_are_downsampled(client, fake_backends):
+    """max_points streams the raw readings and keeps that many, by bucket too"""
+    client.post("/sensors", json=SENSOR)
+    for hour in range(18):
+        client.post("/sensors/1/data", json={"temperature": float(hour % 5), "battery_level": 1.0,
+                                             "last_seen": f"2020-01-01T{hour:02d}:00:00.000Z"})
+
+    response = client.get("/sensors/1/data", params={"max_points": 6, "from": "2020-01-01T00:00:00.000Z"})
+    points = response.json()
+    assert len(points) == 6
+    assert points[0][1] == "2020-01-01T00:00:00+00:00" and points[-1][1] == "2020-01-01T17:00:00+00:00"
+    response = client.get("/sensors/1/data", params={"max_points": 4, "downsample": "minmax", "bucket": "hour",
+                                                          "from": "2020-01-01T00:00:00.000Z"})
+    assert {point[3] for point in response.json()} == {0.0, 4.0}
+    assert client.get("/sensors/1/data", params={"max_points": 4, "downsample": "median",
+                                                   "from": "2020-01-01T00:00:00.000Z"}).status_code == 400
+    assert client.get("/sensors/1/data", params={"max_points": 1}).status_code == 422
+    assert client.get("/sensors/1/data", params={"from": "2020-01-01T00:00:00.000Z"}).status_code == 400
+
+
+def test_readings_are_exported_as_parquet(client, fake_backends):
+    """The export streams a slice of sensor_data as one Parquet file"""
+    import io
+    import pyarrow.parquet as pq
+
+    for i in range(3):
+        client.post("/sensors", json={**SENSOR, "name": f"Sensor {i}"})
+    for sensor_id in (1, 2, 3):
+        for day in (1, 2):
+            client.post(f"/sensors/{sensor_id}/data", json={"temperature": float(sensor_id), "battery_level": 1.0,
+                                                            "last_seen": f"2020-01-0{day}T00:00:00.000Z"})
+
+    response = client.get("/sensors/readings", params={"ids": "1,3", "from": "2020-01-02T00:00:00.000Z",
+                                                       "columns": "temperature"})
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column_names == ["id", "last_seen", "temperature"]
+    assert table.column("id").to_pylist() == [1, 3] and table.column("temperature").to_pylist() == [1.0, 3.0]
+    assert client.get("/sensors/readings", params={"columns": "pressure"}).status_code == 400
+    assert client.get("/sensors/readings", params={"ids": "one"}).status_code == 400
+
+
+def test_fleet_analytics_by_type(client, fake_backends, monkeypatch):
+    """Readings of the window are summarised for the whole fleet and for each type of sensor"""
+    from app.sensors import controller
+    monkeypatch.setattr(controller, "sensor_types", None)
+    client.post("/sensors", json=SENSOR)
+    client.post("/sensors", json={**SENSOR, "name": "Sensor 2", "type": "Velocitat"})
+    for sensor_id, temperature in ((1, 10.0), (1, 20.0), (2, 30.0)):
+        day = int(temperature // 10)
+        client.post(f"/sensors/{sensor_id}/data", json={"temperature": temperature, "battery_level": 1.0,
+                                                        "last_seen": f"2020-01-0{day}T00:00:00.000Z"})
+
+    response = client.get("/sensors/analytics", params={"metric": "temperature", "from": "2020-01-01T00:00:00.000Z",
+                                                        "percentiles": "50", "bins": 2})
+    summary = response.json()
+    assert summary["readings"] == 3 and summary["sensors"] == 2 and summary["percentiles"] == {"p50": 20.0}
+    assert summary["histogram"] == [1, 2]
+    assert [(entry["type"], entry["readings"], entry["mean"]) for entry in summary["types"]] == \
+        [("Temperatura", 2, 15.0), ("Velocitat", 1, 30.0)]
+    assert client.get("/sensors/analytics", params={"metric": "pressure", "from": "2020-01-01"}).status_code == 400
+    assert client.get("/sensors/analytics", params={"from": "2020-01-01", "percentiles": "150"}).status_code == 400
+    assert client.get("/sensors/analytics").status_code == 400
+
+
+def test_conditional_gets_answer_304_from_the_version_counters(client, fake_backends):
+    """A matching If-None-Match costs one Redis MGET, writes change the ETags of what they change only"""
+    client.post("/sensors", json=SENSOR)
+    sensor = client.get("/sensors/1")
+    data = client.get("/sensors/1/data", params={"from": "2020-01-01T00:00:00.000Z", "bucket": "day"})
+    quantity = client.get("/sensors/quantity_by_type")
+    battery = client.get("/sensors/low_battery")
+
+    mongodb, cassandra = fake_backends.fakes()["mongodb"], fake_backends.fakes()["cassandra"]
+    calls = (sum(mongodb.calls.values()), sum(cassandra.calls.values()))
+    response = client.get("/sensors/1", headers={"If-None-Match": sensor.headers["ETag"]})
+    assert response.status_code == 304 and response.content == b"" and response.headers["ETag"] == sensor.headers["ETag"]
+    assert client.get("/sensors/quantity_by_type", headers={"If-None-Match": f'W/"x", {quantity.headers["ETag"]}'}).status_code == 304
+    assert (sum(mongodb.calls.values()), sum(cassandra.calls.values())) == calls
+
+    client.post("/sensors/1/data", json={"temperature": 1.0, "battery_level": 0.1, "last_seen": "2020-01-01T00:00:00.000Z"})
+    assert client.get("/sensors/1", headers={"If-None-Match": sensor.headers["ETag"]}).status_code == 304
+    assert client.get("/sensors/quantity_by_type", headers={"If-None-Match": quantity.headers["ETag"]}).status_code == 304
+    response = client.get("/sensors/1/data", params={"from": "2020-01-01T00:00:00.000Z", "bucket": "day"},
+                          headers={"If-None-Match": data.headers["ETag"]})
+    assert response.status_code == 200 and len(response.json()) == 1
+    assert client.get("/sensors/low_battery", headers={"If-None-Match": battery.headers["ETag"]}).status_code == 200
+    # Another query string is another representation
+    assert client.get("/sensors/1/data", params={"from": "2020-01-02T00:00:00.000Z", "bucket": "day"},
+                      headers={"If-None-Match": response.headers["ETag"]}).status_code == 200
+
+    client.post("/sensors", json={**SENSOR, "name": "Sensor 2"})
+    assert client.get("/sensors/quantity_by_type", headers={"If-None-Match": quantity.headers["ETag"]}).status_code == 200
+
+
+def test_a_store_retry_changes_the_etags_of_what_it_serves(client, fake_backends):
+    """The ETags of a store's routes change once that store holds the reading, also when it took a retry"""
+    from types import SimpleNamespace
+
+    from app.sensors import schemas
+    from app.shared import topology
+    from consumer.worker import SensorDataConsumer
+
+    class Channel:
+        def __init__(self):
+            self.published = []
+
+        def basic_publish(self, exchange, routing_key, body, properties=None):
+            self.published.append((body, properties.headers))
+
+        def basic_ack(self, delivery_tag, multiple=False):
+            pass
+
+    def deliver(body, headers=None):
+        consumer.on_message(channel, SimpleNamespace(delivery_tag=1), SimpleNamespace(headers=headers, content_type=None,
+                                                                                       content_encoding=None), body)
+
+    client.post("/sensors", json=SENSOR)
+    consumer = SensorDataConsumer(redis=backends.redis_client(), timescale=backends.timescale(),
+                                  cassandra=backends.cassandra_client(), bucket_cache_grace=get_settings().bucket_cache_grace)
+    write_timescale = consumer.writers["timescale"]
+    attempts = []
+
+    def failing_once(readings):
+        attempts.append(readings)
+        if len(attempts) == 1:
+            raise TimeoutError("timescale")
+        write_timescale(readings)
+
+    consumer.writers["timescale"] = failing_once
+    channel = Channel()
+    deliver(schemas.SensorDataMessage(sensor_id=1, data={"temperature": 3.0, "battery_level": 0.1,
+                                                         "last_seen": "2020-01-01T00:00:00.000Z"}).to_json())
+    params = {"from": "2020-01-01T00:00:00.000Z", "bucket": "day"}
+    data = client.get("/sensors/1/data", params=params)
+    battery = client.get("/sensors/low_battery")
+    assert data.json() == [] and len(battery.json()) == 1
+
+    (body, headers), = channel.published
+    assert headers[topology.STORES_HEADER] == ["timescale"]
+    deliver(body, headers)
+    response = client.get("/sensors/1/data", params=params, headers={"If-None-Match": data.headers["ETag"]})
+    assert response.status_code == 200 and len(response.json()) == 1
+    assert client.get("/sensors/low_battery", headers={"If-None-Match": battery.headers["ETag"]}).status_code == 304
+
+
+def test_step_filled_series_without_an_end_change_tag_with_the_current_bucket(client, fake_backends, monkeypatch):
+    """fill=step without "to" fills up to the current bucket, a 304 must not hand back a shorter series"""
+    from datetime import datetime, timezone
+    from app.sensors import controller
+
+    class Clock:
+        moment = datetime(2020, 1, 3, 12, tzinfo=timezone.utc)
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.moment
+
+    monkeypatch.setattr(controller, "datetime", Clock)
+    client.post("/sensors", json=SENSOR)
+    params = {"from": "2020-01-01T00:00:00.000Z", "bucket": "day", "fill": "step"}
+    first = client.get("/sensors/1/data", params=params)
+    assert client.get("/sensors/1/data", params=params, headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    Clock.moment = datetime(2020, 1, 4, 0, 30, tzinfo=timezone.utc)
+    assert client.get("/sensors/1/data", params=params, headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+    params["to"] = "2020-01-03T00:00:00.000Z"
+    tagged = client.get("/sensors/1/data", params=params).headers["ETag"]
+    Clock.moment = datetime(2020, 1, 5, tzinfo=timezone.utc)
+    assert client.get("/sensors/1/data", params=params, headers={"If-None-Match": tagged}).status_code == 304
+
+
+def test_bulk_registration_costs_one_round_trip_per_store(client, fake_backends, tmp_path):
+    """Sensors registered in bulk are written with one call per store and chunk, and reported one by one"""
+    from app import register
+
+    client.post("/sensors", json=SENSOR)
+    sensors = [{**SENSOR, "name": f"Sensor {i}", "type": "Humitat" if i % 2 else "Temperatura"} for i in range(1, 6)]
+    stores = ("mongodb", "elasticsearch", "cassandra")
+    before = {store: sum(fake_backends.fakes()[store].calls.values()) for store in stores}
+    response = client.post("/sensors/bulk", json=sensors + [sensors[1]])
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["created"], report["existing"], report["duplicates"]) == (4, 1, 1)
+    assert [item["status"] for item in report["items"]] == ["exists", "created", "created", "created", "created", "duplicate"]
+    assert sorted(item["id"] for item in report["items"] if item["status"] == "created") == [2, 3, 4, 5]
+    for store in stores:
+        fake = fake_backends.fakes()[store]
+        assert sum(fake.calls.values()) - before[store] == 1
+    assert client.get("/sensors/3").json()["name"] == "Sensor 3"
+    assert client.get("/sensors/quantity_by_type").json() == {"sensors": [{"type": "Humitat", "quantity": 2},
+                                                                         {"type": "Temperatura", "quantity": 3}]}
+
+    path = tmp_path / "sensors.jsonl"
+    path.write_text("\n".join(json.dumps({**SENSOR, "name": f"Sensor {i}"}) for i in range(5, 8)))
+    report = register.main([str(path), "--chunk-size", "2", "--report", str(tmp_path / "report.json")])
+    assert (report["created"], report["existing"]) == (2, 1)
+    assert json.loads((tmp_path / "report.json").read_text())["items"][1] == {"name": "Sensor 6", "status": "created", "id": 6}
@@ -0,0 +1,84 @@
+from app.shared import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("latency_seconds", "Latency", ("store",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "redis")
+    lines = histogram.render()
+    assert 'latency_seconds_bucket{store="redis",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{store="redis",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{store="redis",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{store="redis"} 3' in lines
+
+
+def test_nested_calls_are_timed_once():
+    """A method calling another timed method of the same client is recorded only under its own name"""
+    @metrics.instrumented("test_store")
+    class Client:
+        def execute(self):
+            return 1
+
+        def insert(self):
+            return self.execute()
+
+        def fail(self):
+            raise TimeoutError()
+
+    client = Client()
+    client.insert()
+    try:
+        client.fail()
+    except TimeoutError:
+        pass
+    assert metrics.STORE_LATENCY.count("test_store", "insert") == 1
+    assert metrics.STORE_LATENCY.count("test_store", "execute") == 0
+    assert metrics.STORE_ERRORS.value("test_store", "fail") == 1
+
+
+def test_streams_are_timed_by_chunk():
+    """The time a caller spends on a chunk is not counted as time spent in the store"""
+    @metrics.instrumented("test_stream")
+    class Client:
+        def stream(self):
+            yield [1, 2]
+            yield [3]
+
+    chunks = []
+    for chunk in Client().stream():
+        assert not getattr(metrics._timing, "active", False)
+        chunks.append(chunk)
+    assert chunks == [[1, 2], [3]]
+    # One observation per chunk and one for the end of the stream
+    assert metrics.STORE_LATENCY.count("test_stream", "stream") == 3
+
+
+def test_workers_share_their_metrics(tmp_path):
+    """Whichever worker renders, counters and histograms are those of every worker, dead ones included"""
+    def worker(pid, calls, in_flight):
+        registry = metrics.Registry()
+        counter = registry.counter("calls_total", "Calls", ("store",))
+        histogram = registry.histogram("latency_seconds", "Latency", ("store",), buckets=(0.1, 1.0))
+        registry.gauges("state", lambda: [("in_flight", "In flight", in_flight)])
+        for _ in range(calls):
+            counter.inc("redis")
+            histogram.observe(0.5, "redis")
+        shared = metrics.MultiProcess(str(tmp_path), registry, status=lambda: {"in_flight": in_flight})
+        shared.path = str(tmp_path / f"{pid}.json")
+        shared.write()
+        return shared
+
+    first, second = worker(101, 2, 1), worker(102, 3, 4)
+    for shared in (first, second):
+        lines = shared.render().splitlines()
+        assert 'calls_total{store="redis"} 5' in lines
+        assert 'latency_seconds_bucket{store="redis",le="1.0"} 5' in lines
+        assert 'in_flight{worker="101"} 1.0' in lines and 'in_flight{worker="102"} 4.0' in lines
+    assert first.statuses() == {101: {"in_flight": 1}, 102: {"in_flight": 4}}
+
+    metrics.mark_process_dead(str(tmp_path), 102)
+    lines = first.render().splitlines()
+    assert 'calls_total{store="redis"} 5' in lines
+    assert not any(line.startswith('in_flight{worker="102"}') for line in lines)
+    metrics.clear(str(tmp_path))
+    assert not list(tmp_path.iterdir())
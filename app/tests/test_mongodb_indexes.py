@@ -0,0 +1,22 @@
+from app import mongodb_client
+from app.fakes import FakeMongoDBClient
+
+
+def test_plan_stages_walk_the_winning_plan():
+    classic = {"queryPlanner": {"winningPlan": {"stage": "PROJECTION_DEFAULT", "inputStage": {
+        "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "id_unique"}}}}}
+    assert mongodb_client.plan_stages(classic) == ["PROJECTION_DEFAULT", "FETCH", "IXSCAN"]
+    # Plans of the slot based engine, and plans with several inputs
+    sbe = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}, "slotBasedPlan": {}}}}
+    assert mongodb_client.plan_stages(sbe) == ["OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_indexes_are_created_once_not_on_every_registration():
+    mongodb = FakeMongoDBClient()
+    for sensor_id in (1, 2, 3):
+        mongodb.add_sensor({"id": sensor_id, "type": "Temperatura", "location": {"coordinates": [1.0, 1.0]}})
+    mongodb.add_sensors([{"id": 4, "type": "Humitat", "location": {"coordinates": [1.0, 1.0]}}])
+    assert mongodb.calls["create_indexes"] == 1
+    names = {index.document["name"]: index.document for index in mongodb_client.INDEXES}
+    assert names["id_unique"]["unique"] and set(names) == set(mongodb.ensure_indexes())
@@ -0,0 +1,34 @@
+import threading
+
+from app.shared import profiling
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_sees_other_threads():
+    """The hot function of a worker thread shows up in the collapsed stacks and the top functions"""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="worker")
+    worker.start()
+    try:
+        profiler = profiling.SamplingProfiler(0.001).start()
+        # Waiting like the profiling endpoint does, on a wait the top functions leave out
+        threading.Event().wait(0.2)
+        profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+    assert any(line.startswith("worker;") and "busy_loop" in line for line in profiler.collapsed().splitlines())
+    assert "busy_loop" in profiler.top(3)[0][0]
+
+
+def test_signal_profiler_writes_its_results(tmp_path):
+    profiler = profiling.SignalProfiler("cprofile", seconds=0, directory=str(tmp_path), name="consumer")
+    profiler.handle_signal()
+    sum(range(1000))
+    base = profiler.poll()
+    assert (tmp_path / (base.rsplit("/", 1)[-1] + ".pstats")).exists()
+    assert "function calls" in open(base + ".txt").read()
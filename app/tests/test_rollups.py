@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.fakes import FakeRedisClient
+from app.sensors.schemas import SensorData
+from app.shared import rollups
+
+NOW = datetime(2023, 3, 1, 10, 30, tzinfo=timezone.utc)
+
+
+def reading(minute, temperature, battery_level, hour=10):
+    return SensorData(temperature=temperature, battery_level=battery_level,
+                      last_seen=f"2023-03-01T{hour:02d}:{minute:02d}:00.000Z")
+
+
+def test_readings_are_aggregated_by_open_bucket():
+    aggregator = rollups.RollupAggregator()
+    aggregator.add(1, reading(5, 10.0, 0.9), now=NOW)
+    aggregator.add(1, reading(25, 20.0, 0.8), now=NOW)
+    # The 9 o'clock hour is closed, the reading only counts for the day
+    aggregator.add(1, reading(55, 30.0, 0.7, hour=9), now=NOW)
+
+    hour = aggregator.pending[rollups.key(1, "hour", datetime(2023, 3, 1, 10, tzinfo=timezone.utc))]
+    day = aggregator.pending[rollups.key(1, "day", datetime(2023, 3, 1, tzinfo=timezone.utc))]
+    assert hour == (7200, {"temperature": [2, 30.0, 10.0, 20.0], "battery_level": [2, pytest.approx(1.7), 0.8, 0.9]})
+    assert day[1]["temperature"] == [3, 60.0, 10.0, 30.0]
+    assert rollups.row(1, NOW, day[1]) == (1, NOW, None, 20.0, None, 0.7)
+
+
+def test_rollups_are_merged_into_redis_and_kept_when_it_fails():
+    redis = FakeRedisClient()
+    aggregator = rollups.RollupAggregator()
+    hour_key = rollups.key(1, "hour", datetime(2023, 3, 1, 10, tzinfo=timezone.utc))
+    aggregator.add(1, reading(5, 10.0, 0.9), now=NOW)
+    assert aggregator.flush(redis) == 2
+    aggregator.add(1, reading(6, 30.0, 0.5), now=NOW)
+
+    broken = FakeRedisClient()
+    broken.merge_rollups = lambda pending, versions=(), values=None: (_ for _ in ()).throw(ConnectionError("down"))
+    with pytest.raises(ConnectionError):
+        aggregator.flush(broken)
+    assert aggregator.flush(redis) == 2
+    assert redis.get_rollup(hour_key) == {"temperature": (2, 40.0, 10.0, 30.0), "battery_level": (2, 1.4, 0.5, 0.9)}
+    assert redis.get_rollup("rollup:2:hour:0") is None
+
+
+def test_rollups_only_cover_the_buckets_opened_after_their_writers_started():
+    """A consumer started mid-hour, or restarted after losing its pending aggregates, leaves the hour to Timescale"""
+    redis = FakeRedisClient()
+    hour = datetime(2023, 3, 1, 10, tzinfo=timezone.utc)
+    aggregator = rollups.RollupAggregator(since=hour.timestamp() - 60)
+    # Announced by the first flush, even without readings
+    assert aggregator.flush(redis) == 0
+    since, _ = redis.get_rollup_since(rollups.key(1, "hour", hour), rollups.SINCE_KEY)
+    assert rollups.covers(since, hour)
+    restarted = rollups.RollupAggregator(since=NOW.timestamp())
+    restarted.flush(redis)
+    since, _ = redis.get_rollup_since(rollups.key(1, "hour", hour), rollups.SINCE_KEY)
+    assert not rollups.covers(since, hour)
+    assert rollups.covers(since, datetime(2023, 3, 1, 11, tzinfo=timezone.utc))
+    assert not rollups.covers(None, hour)
+
+
+def test_rollup_hashes_are_parsed():
+    from app.redis_client import parse_rollup
+    entries = {b"temperature:count": b"2", b"temperature:sum": b"30.5", b"temperature:min": b"10", b"temperature:max": b"20.5"}
+    assert parse_rollup(entries) == {"temperature": (2, 30.5, 10.0, 20.5)}
+    assert parse_rollup({}) is None
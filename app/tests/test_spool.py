@@ -0,0 +1,175 @@
+import threading
+
+from app.shared.spool import Spool
+
+
+def test_spool_replays_in_order(tmp_path):
+    """Records come back in the order they were appended, across segments"""
+    spool = Spool(str(tmp_path), segment_bytes=64, fsync_every=1)
+    for i in range(10):
+        spool.append(f"reading {i}")
+    assert spool.pending == 10
+    records, position = spool.peek(4)
+    assert records == [f"reading {i}".encode() for i in range(4)]
+    spool.commit(position, len(records))
+    records, position = spool.peek(100)
+    assert records == [f"reading {i}".encode() for i in range(4, 10)]
+    spool.commit(position, len(records))
+    assert spool.pending == 0
+    assert spool.oldest_age() == 0.0
+    spool.close()
+
+
+def test_spool_survives_restart(tmp_path):
+    """Uncommitted records are still pending after reopening the spool"""
+    spool = Spool(str(tmp_path), fsync_every=100)
+    for i in range(5):
+        spool.append(f"reading {i}")
+    records, position = spool.peek(2)
+    spool.commit(position, len(records))
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending == 3
+    records, _ = spool.peek(100)
+    assert records == [b"reading 2", b"reading 3", b"reading 4"]
+    spool.close()
+
+
+def test_spool_drops_torn_tail(tmp_path):
+    """A half-written record at the end of the log is discarded on startup"""
+    spool = Spool(str(tmp_path))
+    spool.append("complete")
+    spool.close()
+    segment = next(tmp_path.glob("segment-*.log"))
+    with open(segment, "ab") as f:
+        f.write(b"\x00\x00\x00\x10garbage")
+
+    spool = Spool(str(tmp_path))
+    assert spool.pending == 1
+    spool.append("after restart")
+    records, _ = spool.peek(100)
+    assert records == [b"complete", b"after restart"]
+    spool.close()
+
+
+def test_each_process_claims_a_spool_of_its_own(tmp_path):
+    """A second owner gets the next free directory, and a freed directory is taken over with its records"""
+    first = Spool.claim(str(tmp_path), fsync_every=1)
+    second = Spool.claim(str(tmp_path), fsync_every=1)
+    assert first.directory == str(tmp_path)
+    assert second.directory == str(tmp_path / "worker-1")
+    second.append("left behind")
+    second.close()
+
+    third = Spool.claim(str(tmp_path))
+    assert third.directory == str(tmp_path / "worker-1")
+    assert third.peek(10)[0] == [b"left behind"]
+    first.close()
+    third.close()
+
+
+def test_overflowing_readings_keep_their_place_in_line(tmp_path):
+    """Readings that find the publisher buffer full are spooled after the ones already buffered"""
+    import json
+
+    from app.sensors import schemas
+    from app.shared.publisher import Publisher
+
+    def unavailable(parameters):
+        raise ConnectionError("broker down")
+
+    publisher = Publisher(spool=Spool(str(tmp_path)), buffer_size=2, overflow_size=1000, batch_size=1, batch_linger=0,
+                          connection_factory=unavailable)
+    for sensor_id in range(1, 201):
+        publisher.publish(schemas.SensorDataMessage(sensor_id=sensor_id, data={"battery_level": 1.0,
+                                                                              "last_seen": "2020-01-01T00:00:00.000Z"}))
+    publisher.close()
+    spool = Spool(str(tmp_path))
+    records, _ = spool.peek(1000)
+    assert [json.loads(record)["sensor_id"] for record in records] == list(range(1, 201))
+    spool.close()
+
+
+def test_overflow_is_bounded_while_the_publisher_thread_is_stuck(tmp_path):
+    import json
+    import queue
+
+    import pytest
+
+    from app.sensors import schemas
+    from app.shared.publisher import Publisher
+
+    connecting, release = threading.Event(), threading.Event()
+
+    def stuck(parameters):
+        connecting.set()
+        release.wait(5)
+        raise ConnectionError("broker down")
+
+    def message(sensor_id):
+        return schemas.SensorDataMessage(sensor_id=sensor_id, data={"battery_level": 1.0,
+                                                                   "last_seen": "2020-01-01T00:00:00.000Z"})
+
+    publisher = Publisher(spool=Spool(str(tmp_path)), buffer_size=1, overflow_size=1, batch_size=1, batch_linger=0,
+                          connection_factory=stuck)
+    publisher.publish(message(1))
+    assert connecting.wait(5)
+    publisher.publish(message(2))
+    publisher.publish(message(3))
+    with pytest.raises(queue.Full):
+        publisher.publish(message(4))
+    release.set()
+    publisher.close()
+    spool = Spool(str(tmp_path))
+    records, _ = spool.peek(1000)
+    assert [json.loads(record)["sensor_id"] for record in records] == [1, 2, 3]
+    spool.close()
+
+
+def test_failed_connection_attempts_are_counted(tmp_path):
+    import time
+
+    from app.sensors import schemas
+    from app.shared.publisher import Publisher
+
+    def unavailable(parameters):
+        raise ConnectionError("broker down")
+
+    publisher = Publisher(spool=Spool(str(tmp_path)), batch_linger=0, connection_factory=unavailable)
+    publisher.publish(schemas.SensorDataMessage(sensor_id=1, data={"battery_level": 1.0,
+                                                                   "last_seen": "2020-01-01T00:00:00.000Z"}))
+    deadline = time.monotonic() + 5
+    while not publisher.stats()["spooled"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert publisher.stats()["connect_errors"] == 1
+    publisher.close()
+
+
+def test_pending_bytes_follow_partial_commits(tmp_path):
+    """Committed records stop counting in pending_bytes, across segments"""
+    spool = Spool(str(tmp_path), segment_bytes=64, fsync_every=1)
+    for i in range(10):
+        spool.append(f"reading {i}")
+    record_bytes = spool.pending_bytes // 10
+    for committed in (3, 7):
+        records, position = spool.peek(committed - (10 - spool.pending))
+        spool.commit(position, len(records))
+        assert spool.pending_bytes == (10 - committed) * record_bytes
+    spool.close()
+    assert Spool(str(tmp_path)).pending_bytes == 3 * record_bytes
+
+
+def test_spools_of_workers_that_are_gone_are_adopted(tmp_path):
+    """The records of a free worker-N spool above the claimed one are moved into it"""
+    owners = [Spool.claim(str(tmp_path), fsync_every=1) for _ in range(3)]
+    owners[2].append("orphaned")
+    for spool in owners[1:]:
+        spool.close()
+
+    second = Spool.claim(str(tmp_path))
+    assert second.directory == str(tmp_path / "worker-1")
+    assert second.adopted == 1 and second.peek(10)[0] == [b"orphaned"]
+    assert Spool(str(tmp_path / "worker-2")).pending == 0
+    owners[0].close()
+    second.close()
@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import startup
+
+# Seconds allowed to import the API in a fresh interpreter, about twice what it takes on a laptop
+COLD_START_BUDGET = 1.5
+DRIVERS = ("cassandra", "elasticsearch", "pymongo", "pika", "psycopg2", "redis", "yoyo")
+
+
+def test_importing_the_api_loads_no_driver():
+    """Drivers are imported by the first request that needs them, and nothing connects at import time"""
+    code = ("import json, sys, app.main; "
+            f"print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in {DRIVERS!r})))")
+    result = subprocess.run([sys.executable, "-c", code], env={**os.environ, "BACKEND": "live"},
+                            capture_output=True, text=True, check=True)
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+def test_cold_start_budget():
+    times = startup.import_times("app.main", env={"BACKEND": "live"})
+    total = startup.total_import_time(times)
+    assert total < COLD_START_BUDGET, "import app.main took %.2fs:\n%s" % (total, startup.by_package(times)[:10])
+
+
+def test_import_times_are_grouped_by_package():
+    output = ("import time: self [us] | cumulative | imported package\n"
+              "import time:       100 |        100 |     sqlalchemy.orm\n"
+              "import time:       300 |        400 |   sqlalchemy\n"
+              "import time:        50 |        450 | app.main\n")
+    times = startup.parse_import_times(output)
+    assert times[0] == ("sqlalchemy.orm", 0.0001, 0.0001)
+    assert startup.by_package(times) == [("sqlalchemy", pytest.approx(0.0004)), ("app", pytest.approx(0.00005))]
+    assert startup.total_import_time(times) == pytest.approx(0.00045)
@@ -0,0 +1,41 @@
+import os
+
+from app import database, workers
+from app.sensors import controller
+
+
+def test_workers_are_sized_by_the_cpus():
+    assert workers.worker_count(3, cpus=16) == 3
+    assert workers.worker_count(0, cpus=4) == 4
+    assert workers.worker_count(0, per_cpu=2, cpus=4) == 8
+    assert workers.worker_count(0, per_cpu=0.1, cpus=4) == 1
+
+
+def test_cgroup_quota_limits_the_cpus(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert workers.cgroup_cpu_limit(str(tmp_path)) == 1.5
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert workers.cgroup_cpu_limit(str(tmp_path)) is None
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert workers.cgroup_cpu_limit(str(tmp_path)) == 2.0
+    assert workers.cgroup_cpu_limit(str(tmp_path / "missing")) is None
+
+
+def test_forked_workers_drop_the_clients_of_their_parent(monkeypatch):
+    """The publisher, the admission controller and the database connections are per worker"""
+    monkeypatch.setattr(controller, "publisher", object())
+    monkeypatch.setattr(controller, "admission", object())
+    disposed = []
+    monkeypatch.setattr(database, "_engine", type("Engine", (), {"dispose": lambda self, close=True: disposed.append(close)})())
+
+    pid = os.fork()
+    if pid == 0:
+        ok = controller.publisher is None and controller.admission is None and disposed == [False]
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # The parent keeps its own
+    assert controller.publisher is not None and disposed == []
@@ -1,7 +1,10 @@
 import psycopg2
+import psycopg2.extras
 import os
+from app.shared.metrics import instrumented
 
 
+@instrumented("timescale")
 class Timescale:
     def __init__(self):
         self.conn = psycopg2.connect(
@@ -25,6 +28,75 @@ class Timescale:
     def execute(self, query):
         return self.cursor.execute(query)
 
+    # Store a reading, replacing a previous reading of the same sensor at the same time
+    def insert_reading(self, sensor_id, data):
+        self.cursor.execute("""
+            INSERT INTO sensor_data(id, battery_level, last_seen, temperature, humidity, velocity)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature,
+            humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level;""",
+            (sensor_id, data.battery_level, data.last_seen, data.temperature, data.humidity, data.velocity))
+        self.conn.commit()
+
+    # Store several (sensor_id, data) readings with a single statement and commit
+    def insert_readings(self, readings):
+        # ON CONFLICT can not update the same row twice in one statement, the last reading wins
+        rows = {(sensor_id, data.last_seen): (sensor_id, data.battery_level, data.last_seen, data.temperature,
+                                              data.humidity, data.velocity) for sensor_id, data in readings}
+        psycopg2.extras.execute_values(self.cursor, """
+            INSERT INTO sensor_data(id, battery_level, last_seen, temperature, humidity, velocity)
+            VALUES %s
+            ON CONFLICT (id, last_seen) DO UPDATE SET temperature = EXCLUDED.temperature,
+            humidity = EXCLUDED.humidity, velocity = EXCLUDED.velocity, battery_level = EXCLUDED.battery_level;""",
+            list(rows.values()), page_size=max(len(rows), 1))
+        self.conn.commit()
+
+    # Aggregate the readings of a sensor in buckets of one hour, day, week, month or year.
+    # Rows are (id, bucket start, avg velocity, avg temperature, avg humidity, min battery level)
+    def get_buckets(self, sensor_id, bucket, from_time=None, to_time=None):
+        conditions = ["id = %s"]
+        parameters = [sensor_id]
+        if from_time:
+            conditions.append("last_seen >= %s")
+            parameters.append(from_time)
+        if to_time:
+            conditions.append("last_seen <= %s")
+            parameters.append(to_time)
+        self.cursor.execute(f"""
+            SELECT id, time_bucket('1 {bucket}', last_seen) AS {bucket}, AVG(velocity), AVG(temperature), AVG(humidity), MIN(battery_level)
+            FROM sensor_data WHERE {" AND ".join(conditions)}
+            GROUP BY id, {bucket} ORDER BY {bucket};""", parameters)
+        return self.cursor.fetchall()
+
+    # Stream raw readings in time order from a server side cursor, chunk_size rows at a time. columns
+    # (checked by the caller) picks what each row holds, sensor_ids None means every sensor. Without
+    # ordered the rows come as the chunks of the hypertable are scanned, with no sort
+    def stream_readings(self, columns, sensor_ids=None, from_time=None, to_time=None, chunk_size=10000, ordered=True):
+        conditions = ["TRUE"]
+        parameters = []
+        if sensor_ids is not None:
+            conditions.append("id = ANY(%s)")
+            parameters.append(list(sensor_ids))
+        if from_time:
+            conditions.append("last_seen >= %s")
+            parameters.append(from_time)
+        if to_time:
+            conditions.append("last_seen <= %s")
+            parameters.append(to_time)
+        with self.conn.cursor(name="sensor_readings") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"""
+                SELECT {", ".join(columns)} FROM sensor_data WHERE {" AND ".join(conditions)}
+                {"ORDER BY last_seen, id" if ordered else ""};""", parameters)
+            while rows := cursor.fetchmany(chunk_size):
+                yield rows
+        # A named cursor lives in a transaction, end it
+        self.conn.commit()
+
+    # Leave a failed transaction so the connection can be used again
+    def rollback(self):
+        self.conn.rollback()
+
     def delete(self, table):
         self.cursor.execute("DELETE FROM " + table)
         self.conn.commit()
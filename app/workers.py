@@ -0,0 +1,47 @@
+"""Sizing of the API worker processes, for the multi-worker mode of ``gunicorn.conf.py``."""
+import math
+import os
+
+
+def cgroup_cpu_limit(root="/sys/fs/cgroup"):
+    """CPUs allowed by the container's cgroup quota (``docker run --cpus``), None without a quota."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: a quota of -1 means no limit
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """CPUs this process may run on: its affinity mask, lowered by a cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+def worker_count(configured=0, per_cpu=1.0, cpus=None):
+    """``configured`` workers, or ``per_cpu`` workers for every available CPU when it is 0.
+
+    A worker is one event loop plus its thread pool, and the GIL keeps it to about one CPU, so one
+    worker per CPU saturates the node. More only helps when the stores are slow and the thread
+    pools of the workers are full.
+    """
+    if configured > 0:
+        return configured
+    return max(1, round((cpus or available_cpus()) * per_cpu))
@@ -0,0 +1,237 @@
+"""Load generator and latency benchmark for the REST API.
+
+    python -m benchmarks.api --backend fake --sensors 200 --rate 500 --duration 30 --read-ratio 0.5 \
+        --report bench.json [--baseline baseline.json --tolerance 0.1]
+
+``--target inprocess`` (the default) drives the FastAPI app in this process, any other value is
+used as the base URL of a running API (e.g. ``http://localhost:8000`` served by uvicorn).
+Requests are sent open-loop at ``--rate`` requests/second and latencies are measured from the
+time each request was scheduled, so a slow server is not hidden by a slower request rate.
+With ``--backend fake`` every request is also charged the store round trips it caused.
+Per sensor rate limiting applies as usual: set RATE_LIMIT_PER_SENSOR=0 to disable it.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from benchmarks.fleet import Fleet
+from benchmarks.histogram import Histogram
+from benchmarks import report as reports
+
+# Read operations and their share of the reads
+READ_MIX = {
+    "get_latest": 40,
+    "get_range": 25,
+    "near": 10,
+    "search": 10,
+    "quantity_by_type": 5,
+    "low_battery": 5,
+    "temperature_values": 5,
+}
+
+
+class Workload:
+    """Builds the requests of each operation against a fleet whose sensors are already registered."""
+
+    def __init__(self, fleet, ids):
+        self.fleet = fleet
+        self.ids = ids
+        self._lock = threading.Lock()
+
+    def request(self, operation, rng):
+        index = rng.randrange(len(self.ids))
+        sensor_id = self.ids[index]
+        if operation == "post_data":
+            with self._lock:
+                reading = self.fleet.reading(index + 1)
+            return "POST", f"/sensors/{sensor_id}/data", reading
+        if operation == "get_latest":
+            return "GET", f"/sensors/{sensor_id}/data", None
+        if operation == "get_range":
+            end = self.fleet.last_seen(index + 1)
+            start = self.fleet.start
+            return "GET", (f"/sensors/{sensor_id}/data?from={start.isoformat().replace('+00:00', 'Z')}"
+                           f"&to={end.isoformat().replace('+00:00', 'Z')}&bucket={rng.choice(['hour', 'day'])}"), None
+        if operation == "near":
+            sensor = self.fleet.sensors[index]
+            return "GET", f"/sensors/near?latitude={sensor['latitude']}&longitude={sensor['longitude']}&radius=1000", None
+        if operation == "search":
+            sensor_type = self.fleet.sensors[index]["type"]
+            return "GET", f'/sensors/search?query={{"type":"{sensor_type}"}}&size=10', None
+        if operation == "quantity_by_type":
+            return "GET", "/sensors/quantity_by_type", None
+        if operation == "low_battery":
+            return "GET", "/sensors/low_battery", None
+        if operation == "temperature_values":
+            return "GET", "/sensors/temperature/values", None
+        raise ValueError(f"Unknown operation {operation}")
+
+
+def pick_operation(rng, read_ratio):
+    if rng.random() >= read_ratio:
+        return "post_data"
+    return rng.choices(list(READ_MIX), weights=list(READ_MIX.values()))[0]
+
+
+def make_client_factory(target):
+    if target == "inprocess":
+        from fastapi.testclient import TestClient
+        from app.main import app
+        # Server errors are counted like any other failed request instead of aborting the run
+        return lambda: TestClient(app, raise_server_exceptions=False)
+    import httpx
+    return lambda: httpx.Client(base_url=target, timeout=30)
+
+
+def store_round_trips():
+    """Total round trips per store so far, None when the stores are not the fakes."""
+    from app import backends
+    if not backends.is_fake():
+        return None
+    return {name: sum(fake.calls.values()) for name, fake in backends.fakes().items() if hasattr(fake, "calls")}
+
+
+def setup(client, fleet):
+    """Register the fleet and send one reading per sensor, returns the sensor ids."""
+    ids = []
+    for index, sensor in enumerate(fleet.sensors):
+        response = client.post("/sensors", json=sensor)
+        if response.status_code != 200:
+            raise RuntimeError(f"Could not register {sensor['name']}: {response.status_code} {response.text}")
+        ids.append(response.json()["id"])
+        client.post(f"/sensors/{ids[-1]}/data", json=fleet.reading(index + 1))
+    return ids
+
+
+def calibrate(client, workload, operations, repeat=5, seed=0):
+    """Average store round trips of each operation, measured one request at a time."""
+    if store_round_trips() is None:
+        return {}
+    rng = random.Random(seed)
+    costs = {}
+    for operation in operations:
+        before = store_round_trips()
+        for _ in range(repeat):
+            method, url, body = workload.request(operation, rng)
+            client.request(method, url, json=body)
+        after = store_round_trips()
+        costs[operation] = sum(after.get(store, 0) - before.get(store, 0) for store in after) / repeat
+    return costs
+
+
+def run(client_factory, workload, rate, duration, read_ratio, workers, seed=0):
+    """Send requests open-loop at ``rate`` per second for ``duration`` seconds."""
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter() + 0.1
+    results = [dict() for _ in range(workers)]
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = client_factory()
+        stats = results[number]
+        for slot in range(number, total, workers):
+            scheduled = start + slot * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = pick_operation(rng, read_ratio)
+            method, url, body = workload.request(operation, rng)
+            try:
+                status = client.request(method, url, json=body).status_code
+            except Exception:
+                status = 0
+            latency = (time.perf_counter() - scheduled) * 1e6
+            entry = stats.setdefault(operation, {"histogram": Histogram(), "errors": 0, "statuses": {}})
+            entry["histogram"].record(latency)
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+            if not 200 <= status < 400:
+                entry["errors"] += 1
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    merged = {}
+    for stats in results:
+        for operation, entry in stats.items():
+            target = merged.setdefault(operation, {"histogram": Histogram(), "errors": 0, "statuses": {}})
+            target["histogram"].merge(entry["histogram"])
+            target["errors"] += entry["errors"]
+            for status, count in entry["statuses"].items():
+                target["statuses"][str(status)] = target["statuses"].get(str(status), 0) + count
+    return merged, elapsed
+
+
+def build_report(config, merged, elapsed, costs, store_calls):
+    operations = {}
+    everything = Histogram()
+    errors = 0
+    for operation, entry in merged.items():
+        histogram = entry["histogram"]
+        everything.merge(histogram)
+        errors += entry["errors"]
+        operations[operation] = {**histogram.summary(),
+                                 "errors": entry["errors"],
+                                 "error_rate": entry["errors"] / histogram.count if histogram.count else 0.0,
+                                 "statuses": entry["statuses"],
+                                 "throughput": histogram.count / elapsed}
+        if operation in costs:
+            operations[operation]["round_trips_per_request"] = costs[operation]
+    operations["all"] = {**everything.summary(), "errors": errors,
+                         "error_rate": errors / everything.count if everything.count else 0.0,
+                         "throughput": everything.count / elapsed}
+    return {"config": config, "environment": reports.environment(), "elapsed": elapsed,
+            "latency_unit": "us", "operations": operations, "store_calls": store_calls}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sensors API")
+    parser.add_argument("--target", default="inprocess", help='"inprocess" or the base URL of a running API')
+    parser.add_argument("--backend", choices=["fake", "live"], help="stores to use when running in process")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=200, help="requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="share of read requests")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against this JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        os.environ["BACKEND"] = args.backend
+    client_factory = make_client_factory(args.target)
+    fleet = Fleet(args.sensors, seed=args.seed)
+    client = client_factory()
+    ids = setup(client, fleet)
+    workload = Workload(fleet, ids)
+    costs = calibrate(client, workload, ["post_data", *READ_MIX], seed=args.seed)
+
+    before = store_round_trips()
+    merged, elapsed = run(client_factory, workload, args.rate, args.duration, args.read_ratio, args.workers, args.seed)
+    after = store_round_trips()
+    store_calls = {store: after[store] - before.get(store, 0) for store in after} if after is not None else None
+
+    config = {key: value for key, value in vars(args).items() if key not in ("report", "baseline")}
+    report = build_report(config, merged, elapsed, costs, store_calls)
+    reports.print_table(report)
+    if args.report:
+        reports.save(report, args.report)
+    if args.baseline:
+        regressions = reports.compare(report, reports.load(args.baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {operation} {metric}: {baseline:.2f} -> {current:.2f} ({change:+.1%})".format(**regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
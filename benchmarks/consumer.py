@@ -0,0 +1,241 @@
+"""Throughput benchmark of the consumer over a matrix of settings.
+
+    python -m benchmarks.consumer --backend fake --messages 20000 --prefetch 10,100,1000 \
+        --batch-size 1,50,200 --flush-interval 0.05 --workers 1,2,4 --codec none,zlib \
+        --csv consumer.csv --json consumer.json
+
+For every cell of the matrix the queue is pre-loaded with ``--messages`` synthetic readings
+(``--envelope-size`` readings per AMQP message, encoded with the cell's codec), then drained by
+the cell's number of consumers. Each cell reports readings/second, the end-to-end lag of the
+readings (from publication to the end of their write) and, with the fake backend, the round
+trips to every store and to the broker per reading.
+
+With ``--backend live`` the consumers are separate processes connected to RabbitMQ and the
+databases of docker-compose. With ``--backend fake`` the stores and the broker only exist in
+this process, so the consumers are threads sharing them: their scaling is bound by the GIL and
+only tells how round trips and batching interact, not how a fleet of processes scales.
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pika
+
+from benchmarks.fleet import Fleet
+from benchmarks.histogram import Histogram
+from benchmarks import report as reports
+
+CODECS = {"none": "", "zlib": "zlib"}
+COLUMNS = ("prefetch", "batch_size", "flush_interval", "workers", "codec", "readings", "messages", "elapsed",
+           "readings_per_second", "lag_p50_ms", "lag_p90_ms", "lag_p99_ms", "lag_max_ms", "flushes",
+           "store_round_trips_per_reading", "broker_round_trips_per_reading")
+
+
+def preload(channel, fleet, readings, envelope_size, codec):
+    """Publish ``readings`` readings to the queue, returns the number of AMQP messages."""
+    from app.sensors import schemas
+    from app.shared import envelope, tracing
+    from app.shared.publisher import QUEUE_NAME
+
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.queue_purge(queue=QUEUE_NAME)
+    sensor_ids = itertools.cycle(range(1, fleet.size + 1))
+    messages = 0
+    for start in range(0, readings, envelope_size):
+        bodies = []
+        for _ in range(min(envelope_size, readings - start)):
+            sensor_id = next(sensor_ids)
+            bodies.append(schemas.SensorDataMessage(sensor_id=sensor_id, data=fleet.reading(sensor_id)).to_json())
+        payload, content_type, content_encoding = envelope.encode(bodies, CODECS[codec])
+        properties = pika.BasicProperties(content_type=content_type, content_encoding=content_encoding,
+                                          headers={tracing.TRACE_HEADER: tracing.new_trace_id(),
+                                                   tracing.PUBLISHED_AT_HEADER: time.time()})
+        channel.basic_publish(exchange="", routing_key=QUEUE_NAME, body=payload, properties=properties)
+        messages += 1
+    return messages
+
+
+def make_consumer(cell, lag, done):
+    """A consumer that records the lag of every reading it flushes and counts the acked messages."""
+    from app import backends
+    from app.shared import tracing
+    from app.shared.dedup import DedupWindow
+    from consumer.worker import SensorDataConsumer
+
+    class BenchConsumer(SensorDataConsumer):
+        def flush(self, ch):
+            published = [headers.get(tracing.PUBLISHED_AT_HEADER) for _, headers in self.pending]
+            acked = len(self.pending_tags)
+            super().flush(ch)
+            now = time.time()
+            for published_at in published:
+                if published_at is not None:
+                    lag.record((now - published_at) * 1e6)
+            with done.get_lock():
+                done.value += acked
+
+    redis = backends.redis_client()
+    return BenchConsumer(redis=redis, timescale=backends.timescale(), cassandra=backends.cassandra_client(),
+                         dedup=DedupWindow(redis=redis), batch_size=cell["batch_size"],
+                         flush_interval=cell["flush_interval"])
+
+
+def consume(cell, messages, done, deadline, results):
+    """Consume until ``messages`` messages were acked by all the consumers together."""
+    from app import backends
+    from app.shared.publisher import QUEUE_NAME
+
+    lag = Histogram()
+    consumer = make_consumer(cell, lag, done)
+    subscriber = backends.subscriber()
+    subscriber.channel.basic_qos(prefetch_count=cell["prefetch"])
+    subscriber.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=consumer.on_message)
+    idle = min(max(cell["flush_interval"], 0.001), 0.1)
+    while done.value < messages and time.time() < deadline:
+        subscriber.conn.process_data_events(time_limit=idle)
+        consumer.tick(subscriber.channel)
+    consumer.flush(subscriber.channel)
+    subscriber.close()
+    results.put({"lag": lag, "flushes": consumer.flushes})
+
+
+def round_trips():
+    from app import backends
+    if not backends.is_fake():
+        return None
+    return {name: sum(fake.calls.values()) for name, fake in backends.fakes().items() if hasattr(fake, "calls")}
+
+
+def run_cell(cell, fleet, readings, envelope_size, timeout):
+    from app import backends
+
+    if backends.is_fake():
+        # Every cell starts from empty stores, and the fakes must exist before the consumers share them
+        backends.reset()
+        backends.redis_client(), backends.timescale(), backends.cassandra_client()
+    publisher = backends.subscriber()
+    messages = preload(publisher.channel, fleet, readings, envelope_size, cell["codec"])
+    publisher.close()
+
+    before = round_trips()
+    done = multiprocessing.Value("l", 0)
+    deadline = time.time() + timeout
+    if backends.is_fake():
+        results = _ThreadResults()
+        workers = [threading.Thread(target=consume, args=(cell, messages, done, deadline, results))
+                   for _ in range(cell["workers"])]
+    else:
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=consume, args=(cell, messages, done, deadline, results))
+                   for _ in range(cell["workers"])]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    after = round_trips()
+
+    lag = Histogram()
+    for result in collected:
+        lag.merge(result["lag"])
+    row = {**cell, "readings": lag.count, "messages": done.value, "elapsed": elapsed,
+           "readings_per_second": lag.count / elapsed if elapsed else 0.0,
+           "lag_p50_ms": lag.percentile(50) / 1000, "lag_p90_ms": lag.percentile(90) / 1000,
+           "lag_p99_ms": lag.percentile(99) / 1000, "lag_max_ms": lag.max / 1000,
+           "flushes": sum(result["flushes"] for result in collected),
+           "store_round_trips_per_reading": None, "broker_round_trips_per_reading": None}
+    if after is not None and lag.count:
+        row["store_round_trips_per_reading"] = sum(after.get(store, 0) - before.get(store, 0)
+                                                   for store in after if store != "broker") / lag.count
+        row["broker_round_trips_per_reading"] = (after.get("broker", 0) - before.get("broker", 0)) / lag.count
+    if done.value < messages:
+        print(f" [!] Timed out with {done.value} of {messages} messages consumed", file=sys.stderr)
+    return row
+
+
+class _ThreadResults:
+    """What consume() needs of a multiprocessing.Queue, for consumers running as threads."""
+
+    def __init__(self):
+        self._results = []
+        self._condition = threading.Condition()
+
+    def put(self, result):
+        with self._condition:
+            self._results.append(result)
+            self._condition.notify_all()
+
+    def get(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._results)
+            return self._results.pop(0)
+
+
+def matrix(args):
+    for prefetch, batch_size, flush_interval, workers, codec in itertools.product(
+            args.prefetch, args.batch_size, args.flush_interval, args.workers, args.codec):
+        yield {"prefetch": prefetch, "batch_size": batch_size, "flush_interval": flush_interval,
+               "workers": workers, "codec": codec}
+
+
+def print_row(row, out=sys.stdout):
+    rt = row["store_round_trips_per_reading"]
+    print(f"prefetch={row['prefetch']:<5} batch={row['batch_size']:<5} flush={row['flush_interval']:<6} "
+          f"workers={row['workers']:<3} codec={row['codec']:<5} {row['readings_per_second']:>10.1f} readings/s  "
+          f"lag p50={row['lag_p50_ms']:.1f}ms p99={row['lag_p99_ms']:.1f}ms"
+          + (f"  rt/reading={rt:.3f}" if rt is not None else ""), file=out)
+
+
+def save_csv(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    numbers = lambda kind: lambda value: [kind(item) for item in value.split(",")]
+    parser = argparse.ArgumentParser(description="Benchmark the consumer throughput")
+    parser.add_argument("--backend", choices=["fake", "live"], default="fake")
+    parser.add_argument("--messages", type=int, default=10000, help="readings pre-loaded in each cell")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--envelope-size", type=int, default=1, help="readings per AMQP message")
+    parser.add_argument("--prefetch", type=numbers(int), default=[100])
+    parser.add_argument("--batch-size", type=numbers(int), default=[1, 100])
+    parser.add_argument("--flush-interval", type=numbers(float), default=[0.05])
+    parser.add_argument("--workers", type=numbers(int), default=[1])
+    parser.add_argument("--codec", type=lambda value: value.split(","), default=["none"])
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed per cell")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--csv", help="write the rows of the matrix here")
+    parser.add_argument("--json", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    for codec in args.codec:
+        if codec not in CODECS:
+            parser.error(f"Unknown codec {codec}, expected one of {', '.join(CODECS)}")
+
+    os.environ["BACKEND"] = args.backend
+    # Readings keep moving forward across cells, so the dedup window never skips them
+    fleet = Fleet(args.sensors, seed=args.seed)
+    rows = []
+    for cell in matrix(args):
+        row = run_cell(cell, fleet, args.messages, args.envelope_size, args.timeout)
+        print_row(row)
+        rows.append(row)
+    if args.csv:
+        save_csv(rows, args.csv)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "environment": reports.environment(), "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+SENSOR_TYPES = ("Temperatura", "Velocitat")
+
+
+class Fleet:
+    """A synthetic fleet of sensors, spread around a point, producing plausible readings."""
+
+    def __init__(self, sensors=100, seed=42, latitude=41.38, longitude=2.17, start=None):
+        self.random = random.Random(seed)
+        self.size = sensors
+        self.start = start or datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.sensors = []
+        for i in range(sensors):
+            sensor_type = SENSOR_TYPES[i % len(SENSOR_TYPES)]
+            self.sensors.append({
+                "name": f"Bench {sensor_type} {i}",
+                "latitude": latitude + self.random.uniform(-0.05, 0.05),
+                "longitude": longitude + self.random.uniform(-0.05, 0.05),
+                "type": sensor_type,
+                "mac_address": ":".join(f"{(i >> shift) & 0xff:02x}" for shift in (40, 32, 24, 16, 8, 0)),
+                "manufacturer": "Bench",
+                "model": f"Bench {sensor_type}",
+                "serie_number": f"{i:016d}",
+                "firmware_version": "1.0",
+                "description": f"Sensor de {sensor_type.lower()} de benchmark número {i}",
+            })
+        self._clock = {}
+        self._battery = {}
+
+    def reading(self, sensor_id):
+        """Next reading of a sensor (ids start at 1), one minute after its previous one."""
+        index = sensor_id - 1
+        tick = self._clock.get(sensor_id, 0)
+        self._clock[sensor_id] = tick + 1
+        battery = max(self._battery.get(sensor_id, 1.0) - self.random.uniform(0, 0.001), 0.0)
+        self._battery[sensor_id] = battery
+        reading = {"battery_level": round(battery, 4),
+                   "last_seen": (self.start + timedelta(minutes=tick)).isoformat().replace("+00:00", "Z")}
+        if self.sensors[index]["type"] == "Temperatura":
+            reading["temperature"] = round(20 + 5 * self.random.gauss(0, 1), 2)
+            reading["humidity"] = round(self.random.uniform(30, 70), 2)
+        else:
+            reading["velocity"] = round(max(self.random.gauss(50, 15), 0), 2)
+        return reading
+
+    def last_seen(self, sensor_id):
+        return self.start + timedelta(minutes=self._clock.get(sensor_id, 0))
+
+    def random_sensor(self):
+        return self.random.randint(1, self.size)
@@ -0,0 +1,70 @@
+import math
+
+
+class Histogram:
+    """Latency histogram with HDR-style log-linear buckets.
+
+    Values (in microseconds) are bucketed by power of two, each split in ``sub_buckets`` linear
+    sub-buckets, so every recorded value is kept with a relative error below 2 / sub_buckets
+    whatever its magnitude, in constant memory.
+    """
+
+    def __init__(self, sub_buckets=128):
+        self.sub_buckets = sub_buckets
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value):
+        if value < self.sub_buckets:
+            return int(value)
+        exponent = int(math.log2(value / self.sub_buckets)) + 1
+        return exponent * self.sub_buckets + int(value / 2 ** exponent)
+
+    def _value(self, index):
+        # Upper bound of the bucket, so percentiles are never optimistic
+        exponent, sub = divmod(index, self.sub_buckets)
+        if exponent == 0:
+            return float(sub)
+        return (sub + 1) * 2 ** exponent - 1
+
+    def record(self, value, count=1):
+        value = max(value, 0.0)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(self.count * percent / 100), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def summary(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else 0.0,
+                "min": self.min if self.count else 0.0,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "p999": self.percentile(99.9),
+                "max": self.max}
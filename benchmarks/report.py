@@ -0,0 +1,51 @@
+import json
+import platform
+import sys
+import time
+
+# Metrics where a higher value is a regression, and where a lower one is
+LOWER_IS_BETTER = ("p50", "p90", "p99", "p999", "mean", "round_trips_per_request", "error_rate")
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def environment():
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "timestamp": time.time()}
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance=0.10):
+    """Compare the ``operations`` of two reports, returns the list of regressions beyond ``tolerance``.
+
+    Each regression is a dict with the operation, the metric, both values and the relative change.
+    """
+    regressions = []
+    for operation, current in report["operations"].items():
+        previous = baseline.get("operations", {}).get(operation)
+        if previous is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if metric not in current or metric not in previous or not previous[metric]:
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if (metric in LOWER_IS_BETTER and change > tolerance) or (metric in HIGHER_IS_BETTER and change < -tolerance):
+                regressions.append({"operation": operation, "metric": metric, "baseline": previous[metric],
+                                    "current": current[metric], "change": change})
+    return regressions
+
+
+def print_table(report, out=sys.stdout):
+    print(f"{'operation':<20}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p99.9 ms':>10}"
+          f"{'rt/req':>8}", file=out)
+    for operation, stats in sorted(report["operations"].items()):
+        print(f"{operation:<20}{stats['count']:>8}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+              f"{stats['p50'] / 1000:>10.2f}{stats['p99'] / 1000:>10.2f}{stats['p999'] / 1000:>10.2f}"
+              f"{stats.get('round_trips_per_request', 0):>8.2f}", file=out)
@@ -0,0 +1,189 @@
+"""Throughput of the API as the number of gunicorn workers grows.
+
+    python -m benchmarks.workers --backend fake --workers 1,2,4,8 --clients 4 --concurrency 8 \
+        --duration 20 --json workers.json
+
+For every number of workers the API is started with ``gunicorn.conf.py`` and loaded closed-loop
+by ``--clients`` processes, each keeping ``--concurrency`` requests in flight over keep-alive
+connections. Requests completed during the first ``--warmup`` seconds are not counted. Each row
+reports requests/second, the speedup over the first row, that speedup per worker (1.0 is linear
+scaling) and latency percentiles.
+
+With ``--backend fake`` the fleet is registered by the gunicorn master before it forks (see
+``seeded_app``), so every worker serves the same sensors from its own copy of the stores;
+``--fake-latency`` adds a delay to every store call. With ``--backend live`` the API uses the
+stores of docker-compose and the fleet is registered over HTTP. The clients run on the same
+machine as the API: once workers and clients together need more CPUs than the machine has, the
+numbers measure the machine, not the API.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks import api, report as reports
+from benchmarks.fleet import Fleet
+from benchmarks.histogram import Histogram
+
+
+def seeded_app():
+    """The API with the benchmark fleet already registered, for ``gunicorn 'benchmarks.workers:seeded_app()'``."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    fleet = Fleet(int(os.environ["BENCH_SENSORS"]), seed=int(os.environ["BENCH_SEED"]))
+    api.setup(TestClient(app), fleet)
+    return app
+
+
+def start_server(workers, port, args):
+    env = {**os.environ, "BACKEND": args.backend, "API_WORKERS": str(workers), "BIND": f"127.0.0.1:{port}",
+           "BENCH_SENSORS": str(args.sensors), "BENCH_SEED": str(args.seed),
+           "FAKE_LATENCY": str(args.fake_latency)}
+    # Per sensor rate limiting would turn most of the load into 429s
+    env.setdefault("RATE_LIMIT_PER_SENSOR", "0")
+    target = "benchmarks.workers:seeded_app()" if args.backend == "fake" else "app.main:app"
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", target],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    wait_ready(server, url, workers)
+    return server, url
+
+
+def wait_ready(server, url, workers, timeout=60):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            if httpx.get(url + "/", timeout=1).status_code == 200:
+                # The first worker answers before the others have started
+                time.sleep(0.5 + 0.1 * workers)
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The API did not start within {timeout}s")
+
+
+def load(url, ids, args, number, deadline, counted_from, results):
+    """One client process: ``args.concurrency`` threads sending requests back to back until ``deadline``."""
+    import httpx
+
+    fleet = Fleet(args.sensors, seed=args.seed)
+    workload = api.Workload(fleet, ids)
+    histogram = Histogram()
+    counts = {"requests": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def run(thread):
+        rng = random.Random(args.seed * 1000 + number * 100 + thread)
+        latencies = Histogram()
+        requests = errors = 0
+        with httpx.Client(base_url=url, timeout=30) as client:
+            while time.time() < deadline:
+                method, path, body = workload.request(api.pick_operation(rng, args.read_ratio), rng)
+                start = time.perf_counter()
+                try:
+                    status = client.request(method, path, json=body).status_code
+                except httpx.HTTPError:
+                    status = 0
+                if time.time() < counted_from:
+                    continue
+                latencies.record((time.perf_counter() - start) * 1e6)
+                requests += 1
+                errors += not 200 <= status < 400
+        with lock:
+            histogram.merge(latencies)
+            counts["requests"] += requests
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=run, args=(thread,)) for thread in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put({"histogram": histogram, **counts})
+
+
+def run_cell(workers, port, ids, args):
+    server, url = start_server(workers, port, args)
+    try:
+        if ids is None:
+            import httpx
+            with httpx.Client(base_url=url, timeout=30) as client:
+                ids = api.setup(client, Fleet(args.sensors, seed=args.seed))
+        counted_from = time.time() + args.warmup
+        deadline = counted_from + args.duration
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=load, args=(url, ids, args, number, deadline, counted_from, results))
+                   for number in range(args.clients)]
+        for client in clients:
+            client.start()
+        collected = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+    histogram = Histogram()
+    for result in collected:
+        histogram.merge(result["histogram"])
+    requests = sum(result["requests"] for result in collected)
+    return ids, {"workers": workers, "requests": requests, "errors": sum(result["errors"] for result in collected),
+                 "throughput": requests / args.duration, **{key: histogram.summary()[key] for key in ("p50", "p99")}}
+
+
+def print_rows(rows, out=sys.stdout):
+    print(f"{'workers':>8}{'requests':>10}{'errors':>8}{'req/s':>10}{'speedup':>9}{'per worker':>12}"
+          f"{'p50 ms':>9}{'p99 ms':>9}", file=out)
+    for row in rows:
+        print(f"{row['workers']:>8}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10.1f}"
+              f"{row['speedup']:>9.2f}{row['efficiency']:>12.2f}{row['p50'] / 1000:>9.2f}{row['p99'] / 1000:>9.2f}",
+              file=out)
+
+
+def main(argv=None):
+    from app.workers import available_cpus
+
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser(description="Benchmark the API throughput across worker processes")
+    parser.add_argument("--backend", choices=["fake", "live"], default="fake")
+    parser.add_argument("--workers", type=lambda value: [int(item) for item in value.split(",")],
+                        default=sorted({1, max(cpus // 2, 1), cpus}))
+    parser.add_argument("--clients", type=int, default=max(cpus // 2, 1), help="load generating processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per client process")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="share of read requests")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="seconds added to every fake store call")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured per row")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds not measured at the start of each row")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    rows = []
+    # Live stores keep the fleet registered by the first row, fake ones are seeded by every master
+    ids = list(range(1, args.sensors + 1)) if args.backend == "fake" else None
+    for workers in args.workers:
+        ids, row = run_cell(workers, args.port, ids, args)
+        rows.append(row)
+    for row in rows:
+        row["speedup"] = row["throughput"] / rows[0]["throughput"] if rows[0]["throughput"] else 0.0
+        row["efficiency"] = row["speedup"] * rows[0]["workers"] / row["workers"]
+    print_rows(rows)
+    if args.json:
+        reports.save({"config": vars(args), "environment": {**reports.environment(), "cpus": cpus}, "rows": rows},
+                     args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Inspect and replay the dead letter queue.
+
+    python -m consumer.deadletters list [--limit N]
+    python -m consumer.deadletters replay [--limit N] [--store STORE]
+    python -m consumer.deadletters purge
+"""
+import argparse
+import json
+import time
+
+import pika
+
+from app import backends
+from app.shared import topology
+from app.shared.publisher import QUEUE_NAME
+
+
+def list_messages(channel, limit):
+    # Messages are fetched without acking them, closing the channel puts them back in the queue
+    messages = []
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=topology.DEAD_LETTER_QUEUE, auto_ack=False)
+        if method is None:
+            break
+        headers = properties.headers or {}
+        messages.append({"stores": headers.get(topology.STORES_HEADER),
+                         "attempt": headers.get(topology.ATTEMPT_HEADER),
+                         "error": headers.get(topology.ERROR_HEADER),
+                         "body": body.decode(errors="replace")})
+    return messages
+
+
+def replay(channel, limit, store=None):
+    # Send dead letters back to the main queue with a fresh retry budget, in the order they died
+    replayed = 0
+    skipped = []
+    for _ in range(limit):
+        method, properties, body = channel.basic_get(queue=topology.DEAD_LETTER_QUEUE, auto_ack=False)
+        if method is None:
+            break
+        headers = dict(properties.headers or {})
+        stores = headers.get(topology.STORES_HEADER) or list(topology.STORES)
+        if store is not None and store not in stores:
+            skipped.append(method.delivery_tag)
+            continue
+        if store is not None:
+            stores = [store]
+        headers[topology.STORES_HEADER] = stores
+        headers.pop(topology.ATTEMPT_HEADER, None)
+        headers.pop(topology.ERROR_HEADER, None)
+        headers[topology.REPLAY_HEADER] = time.time()
+        channel.basic_publish(exchange='', routing_key=QUEUE_NAME, body=body,
+                              properties=pika.BasicProperties(headers=headers,
+                                                              delivery_mode=pika.DeliveryMode.Persistent))
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        replayed += 1
+    for delivery_tag in skipped:
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+    return replayed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and replay dead-lettered sensor readings")
+    parser.add_argument("command", choices=["list", "replay", "purge"])
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--store", choices=topology.STORES, help="only replay the writes to this database")
+    args = parser.parse_args(argv)
+
+    subscriber = backends.subscriber()
+    channel = subscriber.channel
+    try:
+        channel.queue_declare(queue=topology.DEAD_LETTER_QUEUE, durable=True)
+        if args.command == "list":
+            for message in list_messages(channel, args.limit):
+                print(json.dumps(message))
+        elif args.command == "replay":
+            print(f"Replayed {replay(channel, args.limit, args.store)} messages")
+        else:
+            print(f"Purged {channel.queue_purge(queue=topology.DEAD_LETTER_QUEUE).method.message_count} messages")
+    finally:
+        subscriber.close()
+
+
+if __name__ == "__main__":
+    main()
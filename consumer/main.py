@@ -0,0 +1,66 @@
+import logging
+import signal
+
+from app import backends
+from app.settings import get_settings
+from app.shared import deadband, metrics, profiling, rollups, topology, tracing
+from app.shared.dedup import DedupWindow
+from consumer.worker import SensorDataConsumer
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    settings = get_settings()
+    logging.basicConfig(level=settings.log_level, format=settings.log_format)
+    # The consumer keeps one client per database for its whole life
+    redis = backends.redis_client()
+    timescale = backends.timescale()
+    cassandra = backends.cassandra_client()
+    dedup = DedupWindow(redis=redis, capacity=settings.dedup_window_size, ttl=settings.dedup_ttl)
+    consumer = SensorDataConsumer(redis=redis, timescale=timescale, cassandra=cassandra, dedup=dedup,
+                                  max_attempts=settings.retry_max_attempts,
+                                  failure_threshold=settings.circuit_failure_threshold,
+                                  reset_timeout=settings.circuit_reset_timeout,
+                                  batch_size=settings.consumer_batch_size,
+                                  flush_interval=settings.consumer_flush_interval,
+                                  tracer=tracing.make_tracer(settings),
+                                  lag_window_size=settings.lag_window_size,
+                                  lag_report_interval=settings.lag_report_interval,
+                                  rollups=rollups.RollupAggregator() if settings.rollup_flush_interval else None,
+                                  rollup_flush_interval=settings.rollup_flush_interval,
+                                  bucket_cache_grace=settings.bucket_cache_grace if settings.bucket_cache else None,
+                                  deadband=deadband.Deadband(deadband.parse_rules(settings.deadband), settings.deadband_heartbeat)
+                                  if settings.deadband else None)
+
+    metrics.REGISTRY.gauges("consumer", consumer.metrics)
+    if settings.consumer_metrics_port:
+        metrics.serve(settings.consumer_metrics_port)
+
+    # kill -USR1 <pid> profiles the consumer for PROFILE_SECONDS, the results land in PROFILE_DIR
+    profiler = profiling.SignalProfiler(settings.profile_mode, settings.profile_seconds, settings.profile_dir, "consumer")
+    signal.signal(signal.SIGUSR1, profiler.handle_signal)
+    if settings.profile_background_interval:
+        profiling.BackgroundSampler(settings.profile_background_interval, settings.profile_background_report).start()
+
+    def on_idle(channel):
+        consumer.tick(channel)
+        profiler.poll()
+
+    subscriber = backends.subscriber()
+    topology.declare(subscriber.channel, settings.retry_max_attempts, settings.retry_base_delay)
+    try:
+        logger.info("Waiting for sensor data. To exit press CTRL+C")
+        subscriber.subscribe(consumer.on_message, auto_ack=False, prefetch_count=settings.consumer_prefetch_count,
+                             on_idle=on_idle, idle_interval=min(max(settings.consumer_flush_interval, 0.01), 1.0))
+    finally:
+        if consumer.rollups is not None:
+            consumer.flush_rollups()
+        subscriber.close()
+        cassandra.close()
+        timescale.close()
+        redis.close()
+
+
+if __name__ == "__main__":
+    main()
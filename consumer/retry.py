@@ -0,0 +1,39 @@
+import time
+
+
+class CircuitBreaker:
+    """Stops calling a store that keeps failing, so its timeouts do not slow down the healthy ones.
+
+    After ``failure_threshold`` consecutive failures the circuit opens for ``reset_timeout`` seconds:
+    writes to the store are not attempted and go straight to its retry queue. Once the timeout
+    expires a single write is let through to probe whether the store recovered.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Half open: let this call through, a failure reopens the circuit right away
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    @property
+    def open(self):
+        return self.opened_at is not None
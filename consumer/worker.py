@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+import socket
+import time
+
+import pika
+
+from app.sensors import repository, schemas
+from app.shared import envelope, topology, tracing
+from app.shared.dedup import DedupWindow
+from consumer.retry import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Id of the root span of a delivery, kept in its headers while the consumer handles it
+DELIVERY_SPAN = "x-delivery-span-id"
+
+
+class SensorDataConsumer:
+    """Writes the readings received from RabbitMQ to Redis, Timescale and Cassandra.
+
+    Messages are acknowledged only after they were handled, and readings whose id was already
+    written are acknowledged without touching the databases, so redeliveries are harmless.
+    Each database is written on its own: when one fails, only that write is sent to the
+    database's retry queue and the others are not repeated. Messages that can not be parsed,
+    or that keep failing after every retry, go to the dead letter queue.
+    Envelopes batching several readings are unpacked and handled reading by reading.
+
+    Readings are buffered until ``batch_size`` of them are pending or the oldest one waited
+    ``flush_interval`` seconds, then written with one round trip per database and acknowledged
+    with a single ``multiple`` ack. ``tick`` must be called regularly so a partial batch is
+    flushed even when no more messages arrive.
+
+    The lag of every reading, from its reception by the API to its write in each store, is
+    recorded in histograms and in windows of recent lags whose percentiles ``tick`` reports to
+    Redis every ``lag_report_interval`` seconds for ``GET /ingest/lag``. Each delivery is traced
+    as an attempt of its own: one root span, exported when its batch is flushed, with the queue
+    wait and the store writes as children. Retries hang from the attempt they come from.
+
+    With a ``RollupAggregator``, first deliveries are also added to the running aggregates of
+    their open hour and day buckets, which ``tick`` merges into Redis every
+    ``rollup_flush_interval`` seconds (see ``app.shared.rollups``).
+    """
+
+    def __init__(self, redis, timescale, cassandra, dedup=None, max_attempts=5,
+                 failure_threshold=5, reset_timeout=10.0, batch_size=1, flush_interval=0.0,
+                 tracer=None, lag_window_size=10000, lag_report_interval=5.0, rollups=None,
+                 rollup_flush_interval=1.0, bucket_cache_grace=None, deadband=None):
+        self.redis = redis
+        self.timescale = timescale
+        self.cassandra = cassandra
+        self.dedup = dedup or DedupWindow(redis=redis)
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Each writer takes a list of (sensor_id, data) readings
+        self.writers = {
+            # Late readings also drop the closed buckets they change from the API's cache
+            "timescale": lambda readings: repository.record_data_many_timescale(self.timescale, readings, redis=self.redis,
+                                                                                cache_grace=bucket_cache_grace),
+            "cassandra": lambda readings: repository.record_data_many_cassandra(self.cassandra, readings, redis=self.redis,
+                                                                                deadband=self.deadband),
+            "redis": lambda readings: repository.record_data_many_redis(self.redis, readings),
+        }
+        self.breakers = {store: CircuitBreaker(failure_threshold, reset_timeout) for store in topology.STORES}
+        # (message, headers) of the readings waiting for the next flush, and the delivery tags to ack
+        self.pending = []
+        self.pending_tags = []
+        # (headers, delivered_at, received_at) of the deliveries of the pending readings, to trace them
+        self.pending_deliveries = []
+        self.pending_since = None
+        self.flushes = 0
+        # Readings whose latest value writes were left to a newer reading of the same sensor
+        self.coalesced = 0
+        self.tracer = tracer or tracing.Tracer()
+        self.lags = {name: tracing.LagWindow(lag_window_size) for name in ("queue_wait", "end_to_end", *topology.STORES)}
+        self.lag_report_interval = lag_report_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._last_lag_report = time.monotonic()
+        self.rollups = rollups
+        self.rollup_flush_interval = rollup_flush_interval
+        self._last_rollup_flush = time.monotonic()
+        self.deadband = deadband
+
+    def on_message(self, ch, method, properties, body):
+        headers = {**(properties.headers or {}), DELIVERY_SPAN: tracing.new_span_id()}
+        delivered_at = time.time()
+        self.observe_delivery(headers, delivered_at)
+        received = []
+        try:
+            documents = envelope.decode(body, properties.content_type, properties.content_encoding)
+        except Exception as e:
+            # A poison message will never succeed, do not waste retries on it
+            self.dead_letter(ch, body, headers, list(topology.STORES), e)
+            documents = []
+        for document in documents:
+            message = self.parse(ch, document, headers)
+            if message is not None:
+                self.pending.append((message, headers))
+                if message.received_at is not None:
+                    received.append(message.received_at)
+        self.pending_tags.append(method.delivery_tag)
+        self.pending_deliveries.append((headers, delivered_at, min(received, default=None)))
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.pending_since >= self.flush_interval:
+            self.flush(ch)
+
+    def tick(self, ch):
+        # Flush a partial batch whose oldest reading waited long enough
+        if self.pending_tags and time.monotonic() - self.pending_since >= self.flush_interval:
+            self.flush(ch)
+        if time.monotonic() - self._last_lag_report >= self.lag_report_interval:
+            self.report_lag()
+        if self.rollups is not None and time.monotonic() - self._last_rollup_flush >= self.rollup_flush_interval:
+            self.flush_rollups()
+
+    def flush_rollups(self):
+        self._last_rollup_flush = time.monotonic()
+        try:
+            self.rollups.flush(self.redis)
+        except Exception as e:
+            # The aggregates stay pending, the next flush tries again
+            logger.warning("Could not flush the rollups: %r", e)
+
+    def observe_delivery(self, headers, delivered_at):
+        published_at = headers.get(tracing.PUBLISHED_AT_HEADER)
+        # Retries wait in their delay queue on purpose, only first deliveries measure the queue
+        if published_at is None or topology.STORES_HEADER in headers:
+            return
+        tracing.QUEUE_WAIT.observe(delivered_at - published_at)
+        self.lags["queue_wait"].record(delivered_at - published_at)
+
+    def report_lag(self):
+        self._last_lag_report = time.monotonic()
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(tracing.LAG_KEY_PREFIX + self.name, tracing.lag_report(self.lags),
+                           ttl=max(int(self.lag_report_interval * 3), 30))
+        except Exception as e:
+            logger.warning("Could not report the ingest lag: %r", e)
+
+    def parse(self, ch, document, headers):
+        try:
+            message = schemas.SensorDataMessage.parse_obj(document)
+        except Exception as e:
+            self.dead_letter(ch, json.dumps(document), headers, list(topology.STORES), e)
+            return None
+        # Readings published before the API stamped them start their lag at publication
+        if message.received_at is None:
+            message.received_at = headers.get(tracing.PUBLISHED_AT_HEADER)
+        return message
+
+    def flush(self, ch):
+        pending, tags, deliveries = self.pending, self.pending_tags, self.pending_deliveries
+        self.pending, self.pending_tags, self.pending_deliveries, self.pending_since = [], [], [], None
+        failures = self.handle(ch, pending) if pending else {}
+        self.trace_deliveries(deliveries, failures)
+        if tags:
+            self.flushes += 1
+            ch.basic_ack(delivery_tag=tags[-1], multiple=len(tags) > 1)
+
+    def handle(self, ch, pending):
+        keys = [self.dedup_key(message, headers) for message, headers in pending]
+        seen = self.dedup.seen_many(keys)
+        # Readings are written together when they need the same databases: first deliveries need
+        # all of them, a retry only the one that failed
+        groups = {}
+        suppressed = []
+        staged = {}
+        for key, (message, headers) in zip(keys, pending):
+            if key in seen:
+                continue
+            seen.add(key)
+            # First deliveries within the deadband of the sensor's last written reading are not written at all
+            if self.deadband is not None and topology.STORES_HEADER not in headers \
+                    and not self.deadband.admit(message.sensor_id, message.data, staged):
+                suppressed.append(key)
+                continue
+            stores = tuple(headers.get(topology.STORES_HEADER) or topology.STORES)
+            groups.setdefault(stores, []).append((key, message, headers))
+            # Retries were counted on their first delivery
+            if self.rollups is not None and topology.STORES_HEADER not in headers:
+                self.rollups.add(message.sensor_id, message.data)
+
+        written = suppressed
+        failed_sensors = set()
+        # Delivery span id -> stores that failed to write readings of the delivery
+        failures = {}
+        for stores, items in groups.items():
+            spans = {(headers.get(tracing.TRACE_HEADER), headers[DELIVERY_SPAN]) for _, _, headers in items}
+            failed = self.write([message for _, message, _ in items], stores, spans)
+            if failed:
+                failed_sensors.update(message.sensor_id for _, message, _ in items)
+                for _, _, headers in items:
+                    failures.setdefault(headers[DELIVERY_SPAN], set()).update(failed)
+            for store, error in failed.items():
+                for _, message, headers in items:
+                    # Retries and dead letters carry the single reading, not the envelope it arrived in
+                    self.retry(ch, message.to_json(), headers, store, headers.get(topology.ATTEMPT_HEADER, 0), error)
+            if not failed:
+                self.observe_written([message for _, message, _ in items])
+            written.extend(key for key, _, _ in items)
+        self.dedup.remember_many(written)
+        # The deadband compares the next readings with what was written, not with what was attempted
+        if self.deadband is not None:
+            self.deadband.commit(staged, failed_sensors)
+        return failures
+
+    def observe_written(self, messages):
+        # The readings are now visible in every store they were written to
+        now = time.time()
+        for message in messages:
+            if message.received_at is not None:
+                tracing.END_TO_END_LAG.observe(now - message.received_at)
+                self.lags["end_to_end"].record(now - message.received_at)
+
+    def trace_deliveries(self, deliveries, failures):
+        # Exactly one root span per delivery, once its readings were handled, whatever became of them
+        now = time.time()
+        for headers, delivered_at, received_at in deliveries:
+            trace_id, span_id = headers.get(tracing.TRACE_HEADER), headers[DELIVERY_SPAN]
+            published_at = headers.get(tracing.PUBLISHED_AT_HEADER)
+            if published_at is not None and topology.STORES_HEADER not in headers:
+                self.tracer.span(trace_id, "queue_wait", published_at, delivered_at, parent_id=span_id)
+            self.tracer.span(trace_id, tracing.ROOT_SPAN, received_at or published_at or delivered_at, now,
+                             span_id=span_id, parent_id=headers.get(tracing.PARENT_SPAN_HEADER),
+                             attempt=headers.get(topology.ATTEMPT_HEADER, 0), failed=sorted(failures.get(span_id, ())))
+
+    @staticmethod
+    def dedup_key(message, headers):
+        if topology.STORES_HEADER not in headers:
+            return message.id
+        # Retries and replays are tracked apart from the first delivery of the reading
+        stores = headers[topology.STORES_HEADER]
+        return message.id + f"/{','.join(stores)}/{headers.get(topology.ATTEMPT_HEADER, 0)}/{headers.get(topology.REPLAY_HEADER, '')}"
+
+    def write(self, messages, stores, spans=()):
+        # Returns the stores that failed, with their error
+        failed = {}
+        readings = [(message.sensor_id, message.data) for message in messages]
+        # Latest value stores take one write per sensor of the batch, the newest reading
+        if "redis" in stores or "cassandra" in stores:
+            self.coalesced += len(readings) - len({sensor_id for sensor_id, _ in readings})
+        for store in stores:
+            breaker = self.breakers[store]
+            if not breaker.allow():
+                failed[store] = "circuit open"
+                continue
+            try:
+                start = time.time()
+                self.writers[store](readings)
+                end = time.time()
+                breaker.success()
+                tracing.WRITE_DURATION.observe(end - start, store)
+                for message in messages:
+                    if message.received_at is not None:
+                        tracing.STORE_LAG.observe(end - message.received_at, store)
+                        self.lags[store].record(end - message.received_at)
+                for trace_id, span_id in spans:
+                    self.tracer.span(trace_id, f"write {store}", start, end, parent_id=span_id, store=store,
+                                     readings=len(messages))
+            except Exception as e:
+                breaker.failure()
+                failed[store] = e
+                if store == "timescale":
+                    self.rollback_timescale()
+        return failed
+
+    def metrics(self):
+        # Gauges for /metrics, the store latencies are recorded by the clients themselves
+        yield "consumer_pending_readings", "Readings waiting for the next flush", len(self.pending)
+        yield "consumer_flushes_total", "Batches written and acked", self.flushes
+        yield "consumer_dedup_hits_total", "Redelivered readings that were skipped", self.dedup.hits
+        yield "consumer_dedup_errors_total", "Redis errors of the dedup window, treated as unseen", self.dedup.errors
+        yield "consumer_coalesced_readings_total", "Readings whose latest value writes a newer reading replaced", self.coalesced
+        if self.deadband is not None:
+            yield "consumer_deadband_readings_total", "Readings checked against the deadband rules", self.deadband.readings
+            yield "consumer_deadband_suppressed_total", "Readings not written, within the deadband", self.deadband.suppressed
+            yield "consumer_deadband_suppression_ratio", "Share of the readings not written", self.deadband.ratio()
+            yield "consumer_deadband_fields_suppressed_total", "Field values of written readings left out of the " \
+                "stores keeping the latest one, within the deadband", self.deadband.fields_suppressed
+        if self.rollups is not None:
+            yield "consumer_rollup_pending", "Rollups waiting to be merged into Redis", len(self.rollups.pending)
+            yield "consumer_rollup_readings_total", "Readings added to the rollups", self.rollups.readings
+        for store, breaker in self.breakers.items():
+            yield "consumer_circuit_open", "Whether writes to the store are suspended", breaker.open, {"store": store}
+
+    def rollback_timescale(self):
+        try:
+            self.timescale.rollback()
+        except Exception:
+            pass
+
+    def retry(self, ch, body, headers, store, attempt, error):
+        if attempt >= self.max_attempts:
+            self.dead_letter(ch, body, headers, [store], error)
+            return
+        ch.basic_publish(exchange='', routing_key=topology.retry_queue(store, attempt), body=body,
+                         properties=self.properties(headers, [store], attempt + 1, error))
+
+    def dead_letter(self, ch, body, headers, stores, error):
+        logger.error("Dead-lettering message for %s: %r", stores, error)
+        ch.basic_publish(exchange='', routing_key=topology.DEAD_LETTER_QUEUE, body=body,
+                         properties=self.properties(headers, stores, headers.get(topology.ATTEMPT_HEADER, 0), error))
+
+    @staticmethod
+    def properties(headers, stores, attempt, error):
+        headers = dict(headers)
+        # The retry is an attempt of its own, traced as a child of the delivery it comes from
+        if DELIVERY_SPAN in headers:
+            headers[tracing.PARENT_SPAN_HEADER] = headers.pop(DELIVERY_SPAN)
+        headers[topology.STORES_HEADER] = stores
+        headers[topology.ATTEMPT_HEADER] = attempt
+        headers[topology.ERROR_HEADER] = str(error)[:500]
+        return pika.BasicProperties(headers=headers, delivery_mode=pika.DeliveryMode.Persistent)
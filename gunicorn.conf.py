@@ -0,0 +1,42 @@
+# Multi-worker mode of the API: gunicorn -c gunicorn.conf.py app.main:app
+#
+# The app is imported once by the master and the workers are forked from it. Importing it opens
+# no connection (see app/startup.py), and the modules that keep clients or threads drop them in
+# each worker (os.register_at_fork), so every worker creates its own on first use. Each worker
+# keeps its own admission control and publisher, with a spool directory of its own. Its metrics
+# are its own too, but with PROMETHEUS_MULTIPROC_DIR set they are shared through that directory
+# and every scrape of /metrics gets the sum of all the workers.
+import os
+
+from app.migrations import apply_migrations, ensure_mongodb_indexes
+from app.settings import get_settings
+from app.shared import metrics
+from app.workers import worker_count
+
+settings = get_settings()
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = worker_count(settings.api_workers, settings.api_workers_per_cpu)
+preload_app = True
+# Leave the publishers time to flush their buffers on shutdown
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Migrate and create the MongoDB indexes once, in the master, instead of once per worker
+    if not settings.skip_migrations:
+        apply_migrations()
+        ensure_mongodb_indexes()
+        os.environ["SKIP_MIGRATIONS"] = "true"
+        get_settings.cache_clear()
+    # What the workers of a previous run left would be counted again
+    if settings.prometheus_multiproc_dir:
+        metrics.clear(settings.prometheus_multiproc_dir)
+    server.log.info("Starting %d API workers", workers)
+
+
+def child_exit(server, worker):
+    # The counters of the worker stay in the totals, its gauges go
+    if settings.prometheus_multiproc_dir:
+        metrics.mark_process_dead(settings.prometheus_multiproc_dir, worker.pid)